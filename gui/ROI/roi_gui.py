@@ -462,6 +462,8 @@ class RoiGUI(GUIBase):
         self._mw.close_MenuAction.triggered.connect(self._mw.close)
         # options menu
         self._mw.mosaic_scan_MenuAction.triggered.connect(self.open_mosaic_settings)
+        # double click on the roi map selects the closest roi
+        self.roi_image.scene().sigMouseClicked.connect(self.roi_map_clicked)
 
     def __disconnect_internal_signals(self):
         """ disconnect signals from slots within this module """
@@ -471,6 +473,7 @@ class RoiGUI(GUIBase):
         self._mw.tracking_mode_Action.triggered.disconnect()
         self._mw.close_MenuAction.triggered.disconnect()
         self._mw.mosaic_scan_MenuAction.triggered.disconnect()
+        self.roi_image.scene().sigMouseClicked.disconnect(self.roi_map_clicked)
 
     def show(self):
         """Make main window visible and put it above all other windows. """
@@ -584,11 +587,28 @@ class RoiGUI(GUIBase):
             dy = ScaledFloat(mouse_pos.y() - roi_pos[1])
             d_total = ScaledFloat(
                 np.sqrt((mouse_pos.x() - roi_pos[0])**2 + (mouse_pos.y() - roi_pos[1])**2))
-            self._mw.roi_distance_Label.setText(
-                '{0:.2r} (dx = {1:.2r}, dy = {2:.2r})'.format(d_total, dx, dy))
+            text = '{0:.2r} (dx = {1:.2r}, dy = {2:.2r})'.format(d_total, dx, dy)
         else:
-            self._mw.roi_distance_Label.setText('? (?, ?)')
-        pass
+            text = '? (?, ?)'
+        # name of the roi under the mouse pointer (region query on the spatial index of the roi list)
+        half_width = self.roi_logic().roi_width / 2
+        names = self.roi_logic().get_rois_in_region((mouse_pos.x() - half_width, mouse_pos.x() + half_width),
+                                                    (mouse_pos.y() - half_width, mouse_pos.y() + half_width))
+        if names:
+            text += ' - {0}'.format(names[-1])  # the last roi is drawn on top of the others
+        self._mw.roi_distance_Label.setText(text)
+
+    @QtCore.Slot(object)
+    def roi_map_clicked(self, event):
+        """ Handles a double click on the roi map: the closest roi becomes the active one.
+        @param event: pyqtgraph MouseClickEvent
+        """
+        if not event.double():
+            return
+        position = self.roi_image.getViewBox().mapSceneToView(event.scenePos())
+        name, distance = self.roi_logic().get_nearest_roi((position.x(), position.y()))
+        if name is not None and distance <= self.roi_logic().roi_width:
+            self.roi_logic().set_active_roi(name)
 
     @QtCore.Slot(dict)
     def update_roi_list(self, roi_dict):
@@ -136,6 +136,7 @@ class IxonUltra(Base, CameraInterface):
         default_cooler_on: True
         default_acquisition_mode: 'RUN_TILL_ABORT'      # use a default acquisition mode where frame transfer setting has an effect
         default_trigger_mode: 'INTERNAL'
+        data_type: 'uint16'  # pixel type of the retrieved image data: 'uint16' or 'int32'
     """
 
     _dll_location = ConfigOption('dll_location', missing='error')
@@ -145,6 +146,7 @@ class IxonUltra(Base, CameraInterface):
     _default_cooler_on = ConfigOption('default_cooler_on', True)
     _default_acquisition_mode = ConfigOption('default_acquisition_mode', 'SINGLE_SCAN')
     _default_trigger_mode = ConfigOption('default_trigger_mode', 'INTERNAL')
+    _data_type = ConfigOption('data_type', 'uint16')  # 'uint16' uses the 16 bit dll functions, 'int32' the 32 bit ones
 
     _exposure = _default_exposure
     _temperature = _default_temperature
@@ -166,6 +168,9 @@ class IxonUltra(Base, CameraInterface):
     _scans = 1
     _acquiring = False
     _cur_image = None
+    _frame_buffer = None  # reusable buffer for the live display (most recent image)
+    _acquisition_buffer = None  # array set by the logic to store the next kinetic series (e.g. a memory-mapped file)
+    _last_retrieved_image = 0  # index of the last image of the current kinetic series retrieved by get_new_frames
 
     # def __init__(self, **kwargs):
     #     super().__init__(**kwargs)
@@ -173,6 +178,9 @@ class IxonUltra(Base, CameraInterface):
     def on_activate(self):
         """ Initialisation performed during activation of the module.
          """
+        if self._data_type not in ['uint16', 'int32']:
+            self.log.warning(f'Data type {self._data_type} not supported. Using uint16 instead.')
+            self._data_type = 'uint16'
         try:
             self.dll = cdll.LoadLibrary(self._dll_location)
             self.dll.Initialize()
@@ -313,6 +321,7 @@ class IxonUltra(Base, CameraInterface):
         self.set_exposure(self._exposure)  # make sure this is taken into account, call it hence after acquisition mode setting
         self._set_number_kinetics(n_frames)
         self._scans = n_frames  # set this attribute to get the right dimension for get_acquired_data method
+        self._last_retrieved_image = 0
         msg = self._start_acquisition()
         if msg != "DRV_SUCCESS":
             return False
@@ -332,94 +341,115 @@ class IxonUltra(Base, CameraInterface):
         return True
         # or return True only if _set_aquisition_mode terminates without error ? to test which is the better option
 
-    def get_most_recent_image(self):
+    def get_new_frames(self):
+        """ Return the frames acquired since the last call, during a movie acquisition (kinetic series).
+
+        @return numpy array: image data of the new frames in format [[[row],[row]...], ...].
+                             The first dimension has length 0 if no new frame is available.
+        """
+        first, last = self._get_number_new_images()
+        first = max(first, self._last_retrieved_image + 1)
+        n_new = last - first + 1
+        if n_new <= 0:
+            return np.empty((0, self._height, self._width), dtype=self._data_type)
+        # use a new array (not the reusable stack buffer) as the frames are typically handed over to a file writer
+        image_array = self._get_images(first, last, n_new,
+                                       out=np.empty((n_new, self._height, self._width), dtype=self._data_type))
+        self._last_retrieved_image = last
+        return image_array
+
+    def get_most_recent_image(self, out=None):
         """ Return an array of last acquired image.
 
-        This method is mainly used for the live display during video saving
+        This method is mainly used for the live display during video saving.
+        The image is read by the dll directly into a reusable buffer (or into out, if given), so the returned array
+        is overwritten by the next call. Copy it if it has to be kept.
 
-        @return numpy array: image data in format [[row],[row]...]
+        @param numpy ndarray out: optional C-contiguous array of shape (height, width) and of the configured data type
 
-        Each pixel might be a float, integer or sub pixels
+        @return numpy array: image data in format [[row],[row]...]
         """
-        width = self._width
-        height = self._height
-        dim = width * height
-
-        dim = int(dim)
-        image_array = np.zeros(dim)
-        cimage_array = c_int * dim
-        cimage = cimage_array()
+        shape = (self._height, self._width)
+        image_array = self._get_buffer('_frame_buffer', shape, out)
+        if image_array is None:
+            return
 
-        error_code = self.dll.GetMostRecentImage(byref(cimage), dim)
+        error_code = self._dll_function('GetMostRecentImage')(self._buffer_pointer(image_array), image_array.size)
         if ERROR_DICT[error_code] != 'DRV_SUCCESS':
             self.log.warning('Couldn\'t retrieve an image. {0}'.format(ERROR_DICT[error_code]))
-        else:
-            for i in range(len(cimage)):
-                image_array[i] = cimage[i]
-
-        image_array = np.reshape(image_array, (self._height, self._width))  # (self._width, self._height))
 
         return image_array
 
-    def get_acquired_data(self):
+    def get_acquired_data(self, out=None):
         """ Return an array of the acquired data.
         Depending on the acquisition mode, this can be just one frame (single scan, run_till_abort)
         or the entire data as a 3D stack (kinetic series)
 
-        @return numpy ndarray: image data in format [[row],[row]...]
+        The data is read by the dll directly into a new array (or into out, if given), which can be kept by the
+        caller. Only the live display (get_most_recent_image) uses a reusable buffer.
 
-        Each pixel might be a float, integer or sub pixels
+        @param numpy ndarray out: optional C-contiguous array of the expected shape and of the configured data type
+
+        @return numpy ndarray: image data in format [[row],[row]...]
         """
         width = self._width
         height = self._height
 
         if self._read_mode == 'IMAGE':
-            if self._acquisition_mode == 'SINGLE_SCAN':
-                dim = width * height
+            if self._acquisition_mode in ['SINGLE_SCAN', 'RUN_TILL_ABORT']:
+                shape = (height, width)
             elif self._acquisition_mode == 'KINETICS':
-                dim = width * height * self._scans
-            elif self._acquisition_mode == 'RUN_TILL_ABORT':
-                dim = width * height
+                shape = (self._scans, height, width) if self._scans > 1 else (height, width)
             else:
                 self.log.error('Your acquisition mode is not covered currently')
                 return
         elif self._read_mode == 'SINGLE_TRACK' or self._read_mode == 'FVB':
             if self._acquisition_mode == 'SINGLE_SCAN':
-                dim = width
+                shape = (width, )
             elif self._acquisition_mode == 'KINETICS':
-                dim = width * self._scans
+                shape = (self._scans, width) if self._scans > 1 else (width, )
+            else:
+                self.log.error('Your acquisition mode is not covered currently')
+                return
         else:
             self.log.error('Your acquisition mode is not covered currently')
             return
 
-        dim = int(dim)
-        image_array = np.zeros(dim)
-        cimage_array = c_int * dim
-        cimage = cimage_array()
+        # a kinetic series is stored in the acquisition buffer if one was set
+        if out is None and len(shape) == 3 and self._acquisition_buffer is not None:
+            out, self._acquisition_buffer = self._acquisition_buffer, None  # the buffer is used only once
+            if out.shape != shape or out.dtype != np.dtype(self._data_type):
+                self.log.warning('The acquisition buffer does not match the acquired data. Data is stored in memory.')
+                out = None
+
+        # the data is returned in a new array, it may still be in use (e.g. saved in the background)
+        image_array = self._get_buffer(None, shape, out)
+        if image_array is None:
+            return
 
         if self._acquisition_mode == 'RUN_TILL_ABORT':
             # error_code = self.dll.GetOldestImage(pointer(cimage), dim)
             # new version: we avoid a delay between what the sensor sees and what is displayed on the GUI
-            error_code = self.dll.GetMostRecentImage(pointer(cimage), dim)
+            function = self._dll_function('GetMostRecentImage')
         else:
-            error_code = self.dll.GetAcquiredData(pointer(cimage), dim)
+            function = self._dll_function('GetAcquiredData')
+        error_code = function(self._buffer_pointer(image_array), image_array.size)
         if ERROR_DICT[error_code] != 'DRV_SUCCESS':
             self.log.warning('Couldn\'t retrieve an image. {0}'.format(ERROR_DICT[error_code]))
-        else:
-            # self.log.debug('image length {0}'.format(len(cimage)))  # commented for tests fb 20 jan 
-            for i in range(len(cimage)):
-                # could be problematic for 'FVB' or 'SINGLE_TRACK' readmode
-                image_array[i] = cimage[i]
-
-        if self._scans > 1:  # not sure if it matters if we add artifically a 3rd dim, so use if-else structure
-            image_array = np.reshape(image_array,
-                                     (self._scans, self._height, self._width))  # row major, so, height comes before width
-        else:
-            image_array = np.reshape(image_array, (self._height, self._width))
 
         self._cur_image = image_array
         return image_array
 
+    def set_acquisition_buffer(self, buffer):
+        """ Set the array in which the next kinetic series is stored by get_acquired_data.
+
+        The data is read by the dll directly into this array, which can be a numpy.memmap so that the series does not
+        need to fit into the memory. The array must be of the configured data type.
+
+        @param numpy ndarray buffer: C-contiguous array of shape (n_frames, height, width), or None
+        """
+        self._acquisition_buffer = buffer
+
     def set_exposure(self, exposure):
         """ Set the exposure time in seconds
 
@@ -911,42 +941,29 @@ class IxonUltra(Base, CameraInterface):
         self._kinetic = kinetic.value
         return ERROR_DICT[error_code]
 
-    def _get_oldest_image(self):
-        """ Return an array of last acquired image.
+    def _get_oldest_image(self, out=None):
+        """ Return an array of the oldest image in the circular buffer of the camera.
 
-        @return numpy array: image data in format [[row],[row]...]
+        @param numpy ndarray out: optional C-contiguous array of shape (height, width) (image read mode) or (width, )
+                                  (single track or FVB read mode) and of the configured data type
 
-        Each pixel might be a float, integer or sub pixels
+        @return numpy array: image data in format [[row],[row]...], in a new array if out is not given
         """
-
-        width = self._width
-        height = self._height
-
         if self._read_mode == 'IMAGE':
-            if self._acquisition_mode == 'SINGLE_SCAN':
-                dim = width * height / self._hbin / self._vbin
-            elif self._acquisition_mode == 'KINETICS':
-                dim = width * height / self._hbin / self._vbin * self._scans
+            # width and height are the size of the binned image (see _set_image)
+            shape = (self._height, self._width)
         elif self._read_mode == 'SINGLE_TRACK' or self._read_mode == 'FVB':
-            if self._acquisition_mode == 'SINGLE_SCAN':
-                dim = width
-            elif self._acquisition_mode == 'KINETICS':
-                dim = width * self._scans
+            shape = (self._width, )
+        else:
+            self.log.error('Your read mode is not covered currently')
+            return
+        image_array = self._get_buffer(None, shape, out)
+        if image_array is None:
+            return
 
-        dim = int(dim)
-        image_array = np.zeros(dim)
-        cimage_array = c_int * dim
-        cimage = cimage_array()
-        error_code = self.dll.GetOldestImage(pointer(cimage), dim)
+        error_code = self._dll_function('GetOldestImage')(self._buffer_pointer(image_array), image_array.size)
         if ERROR_DICT[error_code] != 'DRV_SUCCESS':
             self.log.warning('Couldn\'t retrieve an image')
-        else:
-            self.log.debug('image length {0}'.format(len(cimage)))
-            for i in range(len(cimage)):
-                # could be problematic for 'FVB' or 'SINGLE_TRACK' readmode
-                image_array[i] = cimage[i]
-
-        image_array = np.reshape(image_array, (int(self._width / self._hbin), int(self._height / self._vbin)))
         return image_array
 
     def _get_number_amp(self):
@@ -1006,44 +1023,91 @@ class IxonUltra(Base, CameraInterface):
 
         return first.value, last.value
 
-    # not working properly (only for n_scans = 1)  # method from original qudi. Currently not used
-    def _get_images(self, first_img, last_img, n_scans):
-        """ Return an array of last acquired image.
+    def _get_images(self, first_img, last_img, n_scans, out=None):
+        """ Return the images first_img to last_img (inclusive, 1-based indices of the circular buffer).
 
-        @return numpy array: image data in format [[row],[row]...]
+        @param int first_img: index of the first image
+        @param int last_img: index of the last image
+        @param int n_scans: number of images (last_img - first_img + 1)
+        @param numpy ndarray out: optional C-contiguous array of shape (n_scans, height, width) and of the configured
+                                  data type
 
-        Each pixel might be a float, integer or sub pixels
+        @return numpy array: image data in format [[[row],[row]...], ...]
         """
-
-        width = self._width
-        height = self._height
-
         # first_img, last_img = self._get_number_new_images()
-        # n_scans = last_img - first_img
-        dim = width * height * n_scans
-
-        dim = int(dim)
-        image_array = np.zeros(dim)
-        cimage_array = c_int * dim
-        cimage = cimage_array()
+        # n_scans = last_img - first_img + 1
+        shape = (n_scans, self._height, self._width)
+        image_array = self._get_buffer(None, shape, out)
+        if image_array is None:
+            return
 
         first_img = c_long(first_img)
         last_img = c_long(last_img)
-        size = c_ulong(width * height)
+        size = c_ulong(image_array.size)  # the size of the complete array, not of a single image
         val_first = c_long()
         val_last = c_long()
-        error_code = self.dll.GetImages(first_img, last_img, pointer(cimage),
-                                        size, byref(val_first), byref(val_last))
+        error_code = self._dll_function('GetImages')(first_img, last_img, self._buffer_pointer(image_array),
+                                                     size, byref(val_first), byref(val_last))
         if ERROR_DICT[error_code] != 'DRV_SUCCESS':
             self.log.warning('Couldn\'t retrieve an image. {0}'.format(ERROR_DICT[error_code]))
-        else:
-            for i in range(len(cimage)):
-                # could be problematic for 'FVB' or 'SINGLE_TRACK' readmode
-                image_array[i] = cimage[i]
 
         self._cur_image = image_array
         return image_array
 
+    # helper functions for the image retrieval
+    def _dll_function(self, name):
+        """ Returns the dll function corresponding to the configured data type.
+
+        The 16 bit variants (such as GetAcquiredData16) fill an array of unsigned shorts, the standard variants
+        an array of 32 bit integers.
+
+        @param str name: name of the 32 bit dll function, such as 'GetAcquiredData'
+
+        @return: dll function
+        """
+        if self._data_type == 'uint16':
+            name = name + '16'
+        return getattr(self.dll, name)
+
+    def _buffer_pointer(self, array):
+        """ Returns a ctypes pointer on the data of a numpy array, to be handed over to the dll.
+
+        @param numpy ndarray array: C-contiguous array of the configured data type
+
+        @return: ctypes pointer
+        """
+        if self._data_type == 'uint16':
+            return array.ctypes.data_as(POINTER(c_uint16))
+        return array.ctypes.data_as(POINTER(c_int32))
+
+    def _get_buffer(self, buffer_name, shape, out=None):
+        """ Returns an array the dll can write the image data into.
+
+        If out is given, it is checked and used. Otherwise, the buffer stored in the attribute buffer_name is reused
+        if it has the right shape and is (re)allocated if not. If buffer_name is None, a new array is allocated.
+
+        @param str buffer_name: '_frame_buffer', or None for a new array
+        @param tuple shape: shape of the image data
+        @param numpy ndarray out: optional user supplied array
+
+        @return numpy ndarray: buffer, or None if out is not suitable
+        """
+        dtype = np.dtype(self._data_type)
+        if out is not None:
+            if out.shape != shape or out.dtype != dtype or not out.flags['C_CONTIGUOUS'] or not out.flags['WRITEABLE']:
+                self.log.error('The array to store the image data must be a writeable C-contiguous array of shape {} '
+                               'and type {}.'.format(shape, dtype))
+                return
+            return out
+
+        if buffer_name is None:
+            return np.empty(shape, dtype=dtype)
+        buffer = getattr(self, buffer_name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            setattr(self, buffer_name, buffer)
+        return buffer
+
     # new functions concerning gain settings
     def _get_em_gain_range(self):
         """ Retrieves the minimum and maximum values of the current selected electron multiplying gain mode
@@ -21,6 +21,7 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import numpy as np
 import time
+import threading
 from core.module import Base
 from core.configoption import ConfigOption
 from interface.camera_interface import CameraInterface
@@ -29,6 +30,18 @@ from interface.camera_interface import CameraInterface
 class CameraDummy(Base, CameraInterface):
     """ Dummy hardware for camera interface
 
+    The dummy simulates a camera acquiring a fluorescent sample: a background thread produces uint16 frames at the
+    frame rate given by the exposure time and the readout time, and stores them in a circular buffer (live mode)
+    or in a stack (fixed length acquisitions, i.e. movies and task acquisitions). The frames show gaussian spots on
+    a background, with photon (poisson) noise, readout noise and a baseline offset. The signal scales with the
+    exposure time and the gain. A frame becomes available readout_latency seconds after the end of its exposure.
+    To reach high frame rates, a pool of frame_pool_size frames is simulated in advance (for the current exposure
+    time, gain and image size) and the acquisition cycles through it. Set frame_pool_size to 0 to simulate each frame
+    individually.
+
+    Acquisitions are free-running (trigger mode 'INTERNAL') or triggered (trigger mode 'SOFTWARE_TRIGGER' or
+    'EXTERNAL'): each call of send_software_trigger then starts the exposure of one frame.
+
     Example config for copy-paste:
 
     camera_dummy:
@@ -36,8 +49,14 @@ class CameraDummy(Base, CameraInterface):
         support_live: True
         camera_name: 'Dummy camera'
         resolution: (720, 1280)
-        exposure: 0.1 
+        exposure: 0.1
         gain: 1.0
+        max_frame_rate: 100  # in frames per second, limited by the readout time of the sensor
+        readout_latency: 0.002  # in s
+        ring_buffer_size: 100  # in frames
+        num_spots: 200
+        frame_pool_size: 16
+        seed: None
     """
 
     _support_live = ConfigOption('support_live', True)
@@ -51,6 +70,19 @@ class CameraDummy(Base, CameraInterface):
     _has_temp = False
     _has_shutter = False
 
+    # simulation parameters
+    _max_frame_rate = ConfigOption('max_frame_rate', 100)  # frame rate for exposure times shorter than the readout
+    _readout_latency = ConfigOption('readout_latency', 0.002)  # delay between end of exposure and frame availability
+    _ring_buffer_size = ConfigOption('ring_buffer_size', 100)  # number of frames kept in live mode
+    _num_spots = ConfigOption('num_spots', 200)
+    _spot_flux = ConfigOption('spot_flux', 20000.)  # in photons per second at the center of a spot
+    _spot_sigma = ConfigOption('spot_sigma', 1.5)  # in pixels
+    _background_flux = ConfigOption('background_flux', 500.)  # in photons per second and pixel
+    _readout_noise = ConfigOption('readout_noise', 2.)  # in counts (rms)
+    _baseline = ConfigOption('baseline', 100)  # offset in counts
+    _frame_pool_size = ConfigOption('frame_pool_size', 16)  # number of frames simulated in advance, 0: no pool
+    _seed = ConfigOption('seed', None)  # seed of the random generator, for reproducible data
+
     # uncomment if _has_temp = True
     # temperature = 17
     # _default_temperature = 12
@@ -61,15 +93,32 @@ class CameraDummy(Base, CameraInterface):
     _full_width = 0
     _full_height = 0
 
-    _progress = 0
+    _frames_retrieved = 0  # number of frames of the current acquisition already returned by get_new_frames
+    _frames_dropped = 0  # number of frames overwritten in the circular buffer before they were retrieved
+    _acquisition_buffer = None  # array in which the next fixed length acquisition is stored, see set_acquisition_buffer
 
     _frame_transfer = False
+    _trigger_mode = 'INTERNAL'
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
         """
         self._full_width = self._resolution[1]
         self._full_height = self._resolution[0]
+        self.image_size = (self._resolution[0], self._resolution[1])
+
+        self._rng = np.random.default_rng(self._seed)
+        self._lock = threading.Lock()  # protects the buffer and the frame counter
+        self._triggers = threading.Semaphore(0)  # one release per software trigger
+        self._stop_event = threading.Event()
+        self._producer = None
+        self._buffer = np.zeros((1,) + self.image_size, dtype=np.uint16)  # circular buffer or stack
+        self._frames_acquired = 0  # number of frames produced in the current acquisition
+        self._last_frame_time = None  # time.perf_counter() at which the most recent frame became available
+        self._fixed_length = False
+        self._frame_pool = None
+        self._frame_pool_key = None  # exposure, gain and image size used for the frame pool
+        self._create_sample()
 
     def on_deactivate(self):
         """ Deinitialisation performed during deactivation of the module.
@@ -103,8 +152,11 @@ class CameraDummy(Base, CameraInterface):
         @return bool: Success ?
         """
         if self._support_live:
+            self._start_producer(None)
             self._live = True
             self._acquiring = False
+            return True
+        return False
 
     def start_single_acquisition(self):
         """ Start a single acquisition
@@ -115,7 +167,8 @@ class CameraDummy(Base, CameraInterface):
             return False
         else:
             self._acquiring = True
-            time.sleep(float(self._exposure+10/1000))
+            self._start_producer(1)
+            self.wait_until_finished()
             self._acquiring = False
             return True
 
@@ -124,21 +177,32 @@ class CameraDummy(Base, CameraInterface):
 
         @return bool: Success ?
         """
+        self._stop_producer()
         self._live = False
         self._acquiring = False
+        return True
 
     def get_acquired_data(self):
         """ Return an array of last acquired image.
 
         @return numpy array: image data in format [[row],[row]...]
 
-        Each pixel might be a float, integer or sub pixels
+        In case of a fixed length acquisition of several frames, the complete stack is returned (in the array
+        set by set_acquisition_buffer if there was one). The stack is new for each acquisition, it is not overwritten.
         """
-        if self.n_frames > 1:
-            data = self._data_generator(size=(self.n_frames, self.image_size[0], self.image_size[1]))  # * self._exposure * self._gain
-        else:
-            data = self._data_generator(size=self.image_size)  # * self._exposure * self._gain
-        return data
+        if self._fixed_length and len(self._buffer) > 1:
+            if self._trigger_mode == 'INTERNAL':
+                self.wait_until_finished()
+            return self._buffer
+        return self.get_most_recent_image()
+
+    def set_acquisition_buffer(self, buffer):
+        """ Set the array in which the next fixed length acquisition is stored. The frames are written directly into
+        this array. It is used for one acquisition only.
+
+        @param numpy ndarray buffer: uint16 array of shape (n_frames, height, width), or None
+        """
+        self._acquisition_buffer = buffer
 
     def set_exposure(self, exposure):
         """ Set the exposure time in seconds
@@ -226,11 +290,11 @@ class CameraDummy(Base, CameraInterface):
 
         @return bool: Success ?
         """
-        # handle the variables indicating the status
-        if self.support_live_acquisition():
-            self._live = True
-            self._acquiring = False
         self.n_frames = n_frames
+        self._start_producer(n_frames)
+        # handle the variables indicating the status
+        self._live = True
+        self._acquiring = False
         self.log.info('started movie acquisition')
         return True
 
@@ -239,6 +303,7 @@ class CameraDummy(Base, CameraInterface):
 
         @return bool: Success ?
         """
+        self._stop_producer()
         self._live = False
         self._acquiring = False
         self.n_frames = 1
@@ -250,15 +315,41 @@ class CameraDummy(Base, CameraInterface):
 
         @return None
         """
-        time.sleep(1)
+        producer = self._producer
+        if producer is not None and self._fixed_length:
+            if self._trigger_mode == 'INTERNAL':
+                remaining = self.n_frames - self._frames_acquired
+                timeout = remaining * self._frame_period() + self._readout_latency + 1
+            else:
+                timeout = None
+            producer.join(timeout)
+            self._live = False
+
+    def get_new_frames(self):
+        """ Return the frames acquired since the last call, during a movie acquisition.
+
+        In live mode, frames that were overwritten in the circular buffer before they were retrieved are lost
+        (they are counted in get_dropped_frames).
+
+        @return numpy array: image data of the new frames in format [[[row],[row]...], ...].
+        """
+        with self._lock:
+            n_acquired = self._frames_acquired
+            first = max(self._frames_retrieved, n_acquired - len(self._buffer))
+            self._frames_dropped += first - self._frames_retrieved
+            indices = np.arange(first, n_acquired) % len(self._buffer)
+            frames = self._buffer[indices]  # fancy indexing returns a copy
+            self._frames_retrieved = n_acquired
+        return frames
 
     def get_most_recent_image(self):
         """ Returns an np array of the most recent image.
 
         Used for live display on gui during save procedures"""
-        data = np.random.normal(size=self.image_size)  # * self._exposure * self._gain
-        # data = data.astype(np.int16)  # type conversion
-        return data
+        with self._lock:
+            if self._frames_acquired == 0:
+                return np.zeros(self.image_size, dtype=np.uint16)
+            return self._buffer[(self._frames_acquired - 1) % len(self._buffer)].copy()
 
     def set_image(self, hbin, vbin, hstart, hend, vstart, vend):
         """ Allows to reduce the actual sensor size
@@ -272,18 +363,44 @@ class CameraDummy(Base, CameraInterface):
         @param int vend: End row (inclusive).
         """
         self.image_size = (abs(vend-vstart)+1, abs(hend-hstart)+1, )  # rows, cols
+        self._create_sample()
         return 0
 
-    # helper method to get data which is equivalent to kinetic series (n_frames > 1 allowed)
-    def _data_generator(self, size):
-        """ Allows to generate 2D or 3D data
-        @param: int tuple size (width, height) or (depth, width, height)
-        @return: np.array(float) data
+    # non interface functions
+    def send_software_trigger(self):
+        """ Start the exposure of one frame, if the trigger mode is 'SOFTWARE_TRIGGER' or 'EXTERNAL'.
+        Triggers sent while a frame is exposed or read out are handled one after the other.
+        """
+        self._triggers.release()
+
+    def get_dropped_frames(self):
+        """ Return the number of frames lost in the circular buffer during the current acquisition
+
+        @return int: number of dropped frames
+        """
+        return self._frames_dropped
+
+    def get_last_frame_time(self):
+        """ Return the time at which the most recent frame became available, for latency measurements
+
+        @return float: time in the reference of time.perf_counter, None if no frame was acquired yet
+        """
+        return self._last_frame_time
+
+    def generate_frames(self, n_frames):
+        """ Return simulated frames without frame timing, using the current exposure time and gain.
+        Useful to prepare test data.
+
+        @param int n_frames: number of frames
+
+        @return numpy array: uint16 frames of shape (n_frames, height, width)
         """
-        data = np.random.normal(size=size)
-        return data
+        frames = np.empty((n_frames,) + self.image_size, dtype=np.uint16)
+        for frame in frames:
+            frame[:] = self._render_frame()
+        return frames
 
-    # just for tests of the gui  # pseudo-interface functions specific to andor camera
+    # pseudo-interface functions specific to andor camera
     def _set_spool(self, active, mode, filenamestem, framebuffer):
         """ Simulates the spooling functionality of the andor camera.
          This function must be available if camera name is set to iXon Ultra 897
@@ -298,24 +415,15 @@ class CameraDummy(Base, CameraInterface):
     def get_kinetic_time(self):
         """ Simulates kinetic time method of andor camera
         This function must be available if camera name is set to iXon Ultra 897"""
-        if self._frame_transfer:
-            return self._exposure + 0.123
-        else:
-            return self._exposure + 0.7654321
+        return self._frame_period()
 
     def get_progress(self):
         """ retrieves the total number of acquired images during a movie acquisition"""
-        n_frames = self.n_frames
-        self._progress += 1
-        progress = self._progress
-        if progress == n_frames:
-            self._live = False
-            self._progress = 0
-            return n_frames
-        return progress
+        return self._frames_acquired
 
     def _set_frame_transfer(self, transfer_mode):
-        """ set the frame transfer mode
+        """ set the frame transfer mode. With frame transfer, the readout of a frame overlaps the exposure of the
+        next one.
 
         @param: int tranfer_mode: 0: off, 1: on
         @returns: int error code 0 = ok, -1 = error
@@ -332,10 +440,150 @@ class CameraDummy(Base, CameraInterface):
             self.log.info('Camera dummy: specify the transfer_mode to set frame transfer, transfer_mode {}'.format(transfer_mode))
             err = -1
         return err
-    
-    
+
+    def _set_trigger_mode(self, mode):
+        """ Set the trigger mode
+
+        @param str mode: 'INTERNAL' (free-running), 'SOFTWARE_TRIGGER' or 'EXTERNAL' (one frame per call of
+                         send_software_trigger)
+        @return int check_val: ok: 0, not ok: -1
+        """
+        if mode not in ['INTERNAL', 'SOFTWARE_TRIGGER', 'EXTERNAL']:
+            self.log.warning('{0} mode is not supported'.format(mode))
+            return -1
+        self._trigger_mode = mode
+        return 0
+
+    def _start_acquisition(self):
+        """ Start a fixed length acquisition of n_frames frames (set by prepare_camera_for_multichannel_imaging) """
+        self._acquiring = True
+        self._start_producer(self.n_frames)
+
+    def _abort_acquisition(self):
+        """ Abort the current acquisition """
+        self.stop_acquisition()
+
     def prepare_camera_for_multichannel_imaging(self, frames, exposure, gain, save_path, file_format):
-        pass
+        self.stop_acquisition()
+        self.set_exposure(exposure)
+        if gain is not None:
+            self.set_gain(gain)
+        self.n_frames = frames
     
     def reset_camera_after_multichannel_imaging(self):
-        pass
+        self.stop_acquisition()
+        self.n_frames = 1
+        self._set_trigger_mode('INTERNAL')
+
+    # simulation engine
+    def _frame_period(self):
+        """ Return the time between two frames of a free-running acquisition, in seconds. """
+        readout_time = 1 / self._max_frame_rate
+        if self._frame_transfer:
+            return max(self._exposure, readout_time)
+        return self._exposure + readout_time
+
+    def _create_sample(self):
+        """ Create the photon flux (photons per second and pixel) of the simulated sample: gaussian spots at random
+        positions on a constant background. """
+        height, width = self.image_size
+        flux = np.full((height, width), self._background_flux, dtype=np.float32)
+        radius = int(np.ceil(4 * self._spot_sigma))
+        offsets = np.arange(-radius, radius + 1)
+        for _ in range(self._num_spots):
+            y, x = self._rng.uniform(0, height), self._rng.uniform(0, width)
+            rows = np.clip(int(y) + offsets, 0, height - 1)
+            cols = np.clip(int(x) + offsets, 0, width - 1)
+            profile_y = np.exp(-(rows - y) ** 2 / (2 * self._spot_sigma ** 2))
+            profile_x = np.exp(-(cols - x) ** 2 / (2 * self._spot_sigma ** 2))
+            brightness = self._spot_flux * self._rng.uniform(0.5, 1.5)
+            flux[np.ix_(rows, cols)] += (brightness * np.outer(profile_y, profile_x)).astype(np.float32)
+        self._flux = flux
+        self._frame_pool_key = None
+
+    def _render_frame(self):
+        """ Simulate the exposure and readout of one frame.
+
+        @return numpy array: frame (float32 counts, not yet clipped to the uint16 range)
+        """
+        photons = self._rng.poisson(self._flux * self._exposure).astype(np.float32)
+        frame = photons * max(self._gain, 1)
+        frame += self._readout_noise * self._rng.standard_normal(self.image_size, dtype=np.float32)
+        frame += self._baseline
+        return np.clip(frame, 0, 65535, out=frame)
+
+    def _update_frame_pool(self):
+        """ Simulate the frame pool if it does not correspond to the current settings. """
+        key = (self._exposure, self._gain, self.image_size)
+        if self._frame_pool_size > 0 and key != self._frame_pool_key:
+            self._frame_pool = self.generate_frames(self._frame_pool_size)
+            self._frame_pool_key = key
+
+    def _start_producer(self, n_frames):
+        """ Stop a running acquisition and start the thread producing the frames.
+
+        @param int n_frames: number of frames of a fixed length acquisition, None for live mode
+        """
+        self._stop_producer()
+        self._update_frame_pool()
+        if n_frames is None:
+            buffer = np.zeros((self._ring_buffer_size,) + self.image_size, dtype=np.uint16)
+        else:
+            shape = (n_frames,) + self.image_size
+            buffer, self._acquisition_buffer = self._acquisition_buffer, None  # the buffer is used only once
+            if buffer is None or buffer.shape != shape:
+                buffer = np.zeros(shape, dtype=np.uint16)  # new stack for each acquisition
+        with self._lock:
+            self._buffer = buffer
+            self._frames_acquired = 0
+            self._frames_retrieved = 0
+            self._frames_dropped = 0
+            self._fixed_length = n_frames is not None
+        self._triggers = threading.Semaphore(0)
+        self._stop_event.clear()
+        self._producer = threading.Thread(target=self._produce_frames, args=(n_frames,), daemon=True)
+        self._producer.start()
+
+    def _stop_producer(self):
+        """ Stop the thread producing the frames, if it is running. """
+        if self._producer is not None:
+            self._stop_event.set()
+            self._triggers.release()  # wake up the producer if it waits for a trigger
+            self._producer.join()
+            self._producer = None
+
+    def _produce_frames(self, n_frames):
+        """ Body of the producer thread: produces n_frames frames (or frames until stopped if n_frames is None)
+        at the frame rate, or one frame per trigger.
+
+        @param int n_frames: number of frames, None for live mode
+        """
+        period = self._frame_period()
+        start = time.perf_counter()
+        sensor_free = start  # time at which the sensor can start the next exposure
+        frame_number = 0
+        while n_frames is None or frame_number < n_frames:
+            if self._trigger_mode == 'INTERNAL':
+                exposure_start = start + frame_number * period
+            else:
+                self._triggers.acquire()
+                if self._stop_event.is_set():
+                    break
+                exposure_start = max(time.perf_counter(), sensor_free)
+                sensor_free = exposure_start + period
+            if self._frame_pool_size > 0:
+                frame = self._frame_pool[frame_number % self._frame_pool_size]
+            else:
+                frame = self._render_frame()
+            available = exposure_start + self._exposure + self._readout_latency
+            if self._stop_event.wait(max(0., available - time.perf_counter())):
+                break
+            with self._lock:
+                self._buffer[frame_number % len(self._buffer)] = frame
+                self._frames_acquired = frame_number + 1
+                self._last_frame_time = time.perf_counter()
+            frame_number += 1
+        if n_frames is not None:
+            # fixed length acquisition finished
+            self._live = False
+            self._acquiring = False
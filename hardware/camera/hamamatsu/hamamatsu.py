@@ -16,12 +16,14 @@ class HCam(Base, CameraInterface):
         camera_id: 0
         default_exposure: 0.01
         default_acquisition_mode: 'run_till_abort'
+        stack_acquisition: True  # store movies and multichannel acquisitions in one preallocated array
 
     """
     # attributes from config
     _default_exposure = ConfigOption('default_exposure', 0.01)  # in seconds
     _default_acquisition_mode = ConfigOption('default_acquisition_mode', 'run_till_abort')
     camera_id = ConfigOption('camera_id', 0)
+    _stack_acquisition = ConfigOption('stack_acquisition', True)
 
     # Initialize attributes
     _width = 0  # current width
@@ -134,6 +136,10 @@ class HCam(Base, CameraInterface):
         """
         acq_mode = self.get_acquisition_mode()
 
+        if acq_mode == 'fixed_length_stack':
+            # the frames are already stored in one preallocated array of shape (n_frames, height, width)
+            return self.camera.getStack()
+
         image_array = []  # or should this be initialized as an np array ??
         [frames,
          dim] = self.camera.getFrames()  # frames is a list of HCamData objects, dim is a list [image_width, image_height]
@@ -238,7 +244,7 @@ class HCam(Base, CameraInterface):
         """
         self.n_frames = n_frames  # needed to choose the correct case in get_acquired_data method
         try:
-            self.camera.setACQMode('fixed_length', n_frames)
+            self.camera.setACQMode(self._fixed_length_mode(n_frames), n_frames)
             self.camera.startAcquisition()
             return True
         except:
@@ -263,6 +269,28 @@ class HCam(Base, CameraInterface):
         """
         pass
 
+    def get_new_frames(self):
+        """ Return the frames acquired since the last call, during a movie acquisition.
+
+        @return numpy array: image data of the new frames in format [[[row],[row]...], ...].
+                             The first dimension has length 0 if no new frame is available.
+        """
+        [frames, dim] = self.camera.getFrames()  # HCamData objects, or views of the stack in fixed_length_stack mode
+        if not frames:
+            return np.zeros((0, dim[1], dim[0]), dtype=np.uint16)
+        if self.get_acquisition_mode() == 'fixed_length_stack':
+            return np.stack(frames)
+        return np.stack([np.reshape(frame.getData(), (dim[1], dim[0])) for frame in frames])
+
+    def set_acquisition_buffer(self, buffer):
+        """ Set the array in which the next fixed length acquisition is stored (fixed_length_stack mode only,
+        see config option stack_acquisition). The frames of the array are attached as camera buffers, so that the
+        camera writes directly into it. The buffer is used for one acquisition only.
+
+        @param numpy ndarray buffer: C-contiguous uint16 array of shape (n_frames, height, width), or None
+        """
+        self.camera.stack_buffer = buffer
+
     def get_most_recent_image(self):
         """ Return an array of last acquired image.
 
@@ -317,7 +345,7 @@ class HCam(Base, CameraInterface):
     def prepare_camera_for_multichannel_imaging(self, frames, exposure, gain, save_path, file_format):
         self.stop_acquisition()
         self.set_exposure(exposure)
-        self._set_acquisition_mode('fixed_length', frames)
+        self._set_acquisition_mode(self._fixed_length_mode(frames), frames)
         self.n_frames = frames  # this ensures that the data retrieval format is correct
         # external trigger mode, positive polarity
         self._set_trigger_source('EXTERNAL')
@@ -387,6 +415,20 @@ class HCam(Base, CameraInterface):
         trigger_polarity = self.camera.setPropertyValue(f'output_trigger_polarity[{channel}]', output_trigger_polarity)
         print(trigger_polarity)
 
+    def _fixed_length_mode(self, n_frames):
+        """ Returns the acquisition mode to use for a fixed number of frames.
+
+        If stack acquisition is activated in the config, a series of frames is stored in one preallocated array
+        (acquisition mode 'fixed_length_stack') instead of being copied frame by frame and stacked afterwards.
+
+        @param int n_frames: number of frames
+
+        @return str: acquisition mode
+        """
+        if self._stack_acquisition and n_frames > 1:
+            return 'fixed_length_stack'
+        return 'fixed_length'
+
     def _set_acquisition_mode(self, mode, n_frames=None):
         self.camera.setACQMode(mode, n_frames)
         # add error handling etc.
@@ -299,6 +299,7 @@ class HamamatsuCamera(object):
         self.debug = False
         self.encoding = 'utf-8'
         self.frame_bytes = 0
+        self.frame_rowbytes = 0
         self.frame_x = 0
         self.frame_y = 0
         self.last_frame_number = 0
@@ -309,6 +310,12 @@ class HamamatsuCamera(object):
         self.acquisition_mode = "run_till_abort"
         self.number_frames = 0
 
+        # fixed_length_stack acquisition mode: all frames are stored in one preallocated array
+        self.stack = None
+        self.stack_ptr = False  # array of pointers on the frames of the stack if it is attached as camera buffer
+        self.stack_frames = 0  # number of frames available in the stack
+        self.stack_buffer = None  # optional array supplied by the caller to hold the next stack (e.g. numpy.memmap)
+
         # Get camera model.
         self.camera_model = self.getModelInfo(camera_id)
 
@@ -351,6 +358,7 @@ class HamamatsuCamera(object):
         self.frame_x = self.getPropertyValue("image_width")[0]
         self.frame_y = self.getPropertyValue("image_height")[0]
         self.frame_bytes = self.getPropertyValue("image_framebytes")[0]
+        self.frame_rowbytes = self.getPropertyValue("image_rowbytes")[0]
 
     def checkStatus(self, fn_return, fn_name="unknown"):
         """
@@ -446,26 +454,81 @@ class HamamatsuCamera(object):
 
         This will block waiting for new frames even if
         there new frames available when it is called.
+
+        In fixed_length_stack acquisition mode, the new frames are stored in the preallocated stack (copied into it
+        if the stack is not directly used as camera buffer) and the returned list contains views of the stack
+        (numpy arrays of shape (height, width)) instead of HCamData objects.
         """
         frames = []
         for n in self.newFrames():
-            paramlock = DCAMBUF_FRAME(
-                0, 0, 0, n, None, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-            paramlock.size = ctypes.sizeof(paramlock)
+            if self.acquisition_mode == "fixed_length_stack":
+                if not self.stack_ptr:
+                    self.copyFrameToStack(n)
+                frames.append(self.stack[n])
+                continue
 
             # Lock the frame in the camera buffer & get address.
-            self.checkStatus(self.dcam.dcambuf_lockframe(self.camera_handle,
-                                                    ctypes.byref(paramlock)),
-                             "dcambuf_lockframe")
+            address = self.lockFrame(n)
 
             # Create storage for the frame & copy into this storage.
             hc_data = HCamData(self.frame_bytes)
-            hc_data.copyData(paramlock.buf)
+            hc_data.copyData(address)
 
             frames.append(hc_data)
 
         return [frames, [self.frame_x, self.frame_y]]
 
+    def lockFrame(self, n):
+        """
+        Lock the frame n in the camera buffer and return its address.
+        """
+        paramlock = DCAMBUF_FRAME(
+            0, 0, 0, n, None, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        paramlock.size = ctypes.sizeof(paramlock)
+        self.checkStatus(self.dcam.dcambuf_lockframe(self.camera_handle,
+                                                ctypes.byref(paramlock)),
+                         "dcambuf_lockframe")
+        return paramlock.buf
+
+    def copyFrameToStack(self, n):
+        """
+        Copy the frame n from the camera buffer into the stack (internal use only).
+
+        The rows of the camera frame are padded to image_rowbytes, hence the
+        frame is read through a strided view of the locked buffer.
+        """
+        address = self.lockFrame(n)
+        frame_buffer = (ctypes.c_uint8 * (self.frame_rowbytes * self.frame_y)).from_address(address)
+        frame = numpy.ndarray((self.frame_y, self.frame_x), dtype=numpy.uint16, buffer=frame_buffer,
+                              strides=(self.frame_rowbytes, numpy.dtype(numpy.uint16).itemsize))
+        self.stack[n][...] = frame
+
+    def getStack(self):
+        """
+        Returns the frames acquired in fixed_length_stack mode as an array of
+        shape (number of acquired frames, height, width), without copying the data.
+        """
+        if self.stack is None:
+            return numpy.zeros((0, self.frame_y, self.frame_x), dtype=numpy.uint16)
+        if self.number_image_buffers > 0:  # camera buffers not yet released
+            self.updateStack()
+        return self.stack[:self.stack_frames]
+
+    def updateStack(self):
+        """
+        Make sure that all frames acquired so far are stored in the stack and
+        update the number of available frames (internal use only).
+        """
+        if not self.stack_ptr:
+            # copy the frames that were not yet retrieved into the stack, without waiting for a new frame
+            for n in self.newFrames(wait=False):
+                self.copyFrameToStack(n)
+        paramtransfer = DCAMCAP_TRANSFERINFO(0, DCAMCAP_TRANSFERKIND_FRAME, 0, 0)
+        paramtransfer.size = ctypes.sizeof(paramtransfer)
+        self.checkStatus(self.dcam.dcamcap_transferinfo(self.camera_handle, ctypes.byref(paramtransfer)),
+                         "dcamcap_transferinfo")
+        self.stack_frames = min(paramtransfer.nFrameCount, self.number_frames)
+
 ### for tests ###  # add documentation !!!!
     def getMostRecentFrame(self):
         #  it is important to make sure that the program does not try to access the same location in memory multiple times
@@ -677,13 +740,13 @@ class HamamatsuCamera(object):
         else:
             return False
 
-    def newFrames(self):
+    def newFrames(self, wait=True):
         """
         Return a list of the ids of all the new frames since the last check.
         Returns an empty list if the camera has already stopped and no frames
         are available.
 
-        This will block waiting for at least one new frame.
+        This will block waiting for at least one new frame, unless wait is False.
         """
 
         captureStatus = ctypes.c_int32(0)
@@ -691,7 +754,7 @@ class HamamatsuCamera(object):
             self.camera_handle, ctypes.byref(captureStatus)))
 
         # Wait for a new frame if the camera is acquiring.
-        if captureStatus.value == DCAMCAP_STATUS_BUSY:
+        if wait and captureStatus.value == DCAMCAP_STATUS_BUSY:
             paramstart = DCAMWAIT_START(
                 0,
                 0,
@@ -798,15 +861,15 @@ class HamamatsuCamera(object):
         '''
         Set the acquisition mode to either run until aborted or to
         stop after acquiring a set number of frames.
-        mode should be either "fixed_length" or "run_till_abort"
-        if mode is "fixed_length", then number_frames indicates the number
-        of frames to acquire.
+        mode should be either "fixed_length", "fixed_length_stack" or "run_till_abort"
+        if mode is "fixed_length" or "fixed_length_stack", then number_frames indicates the number
+        of frames to acquire. In "fixed_length_stack" mode, the frames are stored in one
+        preallocated array of shape (number_frames, height, width), see getStack.
         '''
 
         self.stopAcquisition()
 
-        if self.acquisition_mode is "fixed_length" or \
-                self.acquisition_mode is "run_till_abort":
+        if mode in ["fixed_length", "fixed_length_stack", "run_till_abort"]:
             self.acquisition_mode = mode
             self.number_frames = number_frames
         else:
@@ -823,31 +886,80 @@ class HamamatsuCamera(object):
         # We allocate enough to buffer 2 seconds of data or the specified
         # number of frames for a fixed length acquisition
         #
-        if self.acquisition_mode is "run_till_abort":
+        if self.acquisition_mode == "run_till_abort":
             n_buffers = int(2.0 * self.getPropertyValue("internal_frame_rate")[0])
-        elif self.acquisition_mode is "fixed_length":
+        else:  # fixed_length or fixed_length_stack
             n_buffers = self.number_frames
 
         self.number_image_buffers = n_buffers
 
-        self.checkStatus(self.dcam.dcambuf_alloc(self.camera_handle,
-                                            ctypes.c_int32(self.number_image_buffers)),
-                         "dcambuf_alloc")
+        if self.acquisition_mode == "fixed_length_stack":
+            self.stackSetup()
+        else:
+            self.stack = None
+            self.stack_ptr = False
+
+        if self.stack_ptr:
+            # the camera writes the frames directly into the stack
+            paramattach = DCAMBUF_ATTACH(0, DCAMBUF_ATTACHKIND_FRAME,
+                                         self.stack_ptr, self.number_image_buffers)
+            paramattach.size = ctypes.sizeof(paramattach)
+            self.checkStatus(self.dcam.dcambuf_attach(self.camera_handle,
+                                                 paramattach),
+                             "dcambuf_attach")
+        else:
+            self.checkStatus(self.dcam.dcambuf_alloc(self.camera_handle,
+                                                ctypes.c_int32(self.number_image_buffers)),
+                             "dcambuf_alloc")
 
         # Start acquisition.
-        if self.acquisition_mode is "run_till_abort":
+        if self.acquisition_mode == "run_till_abort":
             self.checkStatus(self.dcam.dcamcap_start(self.camera_handle,
                                                 DCAMCAP_START_SEQUENCE),
                              "dcamcap_start")
-        if self.acquisition_mode is "fixed_length":
+        else:  # fixed_length or fixed_length_stack
             self.checkStatus(self.dcam.dcamcap_start(self.camera_handle,
                                                 DCAMCAP_START_SNAP),
                              "dcamcap_start")
 
+    def stackSetup(self):
+        """
+        Allocate the array that holds all frames of a fixed_length_stack
+        acquisition (internal use only).
+
+        A new array is allocated for each acquisition so that the data returned
+        by getStack for the previous acquisition is never overwritten, unless
+        an array of the right shape was supplied in stack_buffer (used only once).
+        If the frames are stored contiguously in memory (no row padding), the
+        frames of the stack are attached as camera buffers, hence the camera
+        writes directly into the stack. Otherwise, the frames are copied from
+        the camera buffer into the stack as they arrive (see getFrames).
+        """
+        shape = (self.number_frames, self.frame_y, self.frame_x)
+        buffer, self.stack_buffer = self.stack_buffer, None
+        if (buffer is not None and buffer.shape == shape and buffer.dtype == numpy.uint16
+                and buffer.flags['C_CONTIGUOUS'] and buffer.flags['WRITEABLE']):
+            self.stack = buffer
+        else:
+            if buffer is not None:
+                print("stack buffer does not match the acquisition, using memory")
+            self.stack = numpy.empty(shape, dtype=numpy.uint16)
+        self.stack_frames = 0
+        if self.frame_bytes == self.stack[0].nbytes:
+            ptr_array = ctypes.c_void_p * self.number_frames
+            self.stack_ptr = ptr_array()
+            for i in range(self.number_frames):
+                self.stack_ptr[i] = self.stack[i].ctypes.data
+        else:
+            self.stack_ptr = False
+
     def stopAcquisition(self):
         """
         Stop data acquisition.
         """
+        # Keep the frames of a fixed_length_stack acquisition accessible after the buffers are released.
+        if self.stack is not None and self.number_image_buffers > 0:
+            self.updateStack()
 
         # Stop acquisition.
         self.checkStatus(self.dcam.dcamcap_stop(self.camera_handle),
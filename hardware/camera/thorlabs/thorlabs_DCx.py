@@ -392,6 +392,17 @@ class CameraThorlabs(Base, CameraInterface):
         """
         pass
 
+    def get_new_frames(self):
+        """ Return the frames acquired since the last call, during a movie acquisition.
+
+        @return numpy array: image data of the new frames in format [[[row],[row]...], ...].
+        """
+        pass
+
+    def set_acquisition_buffer(self, buffer):
+        """ Fixed length acquisitions are not available for this camera, the buffer is not used. """
+        pass
+
     def get_most_recent_image(self):
         """ Return an array of last acquired image.
 
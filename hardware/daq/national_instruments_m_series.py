@@ -10,6 +10,10 @@ This file contains a class for the NI-DAQ M series.
 It is used to control the analog output channels of the DAQ
 and allows to set up a digital output that can be used as trigger for a connected device.
 
+The analog output and digital output tasks are started once and kept running, so that a write is a single driver call.
+The fire signal of the camera (analog input) is monitored by a finite acquisition with an analog reference trigger on
+its falling edge: the DAQ detects the end of the exposure, instead of a software loop reading the input every ms.
+
 This module is an extension to the hardware code base of Qudi software 
 obtained from <https://github.com/Ulm-IQO/qudi/> 
 """
@@ -48,6 +52,7 @@ class NIDAQMSeries(Base, LaserControlInterface, DaqInterface):
             read_write_timeout: 10
             do_channel: '/Dev1/port0/line2'  # 'Dev1/port0/line2'
             ai_channel: '/Dev1/AI0'
+            fire_sample_rate: 10000  # in Hz, sampling of the camera fire signal on the analog input
             
             # please indicate belonging elements in the same order in each category wavelengths, ao_channels, voltage_ranges
             # order preferentially by increasing wavelength (this will result in an ordered gui)
@@ -61,6 +66,11 @@ class NIDAQMSeries(Base, LaserControlInterface, DaqInterface):
     _ai_channel = ConfigOption('ai_channel', missing='warn')
     # timeout for the Read or/and write process in s
     _RWTimeout = ConfigOption('read_write_timeout', default=10)
+    _fire_sample_rate = ConfigOption('fire_sample_rate', 10000)
+
+    _fire_threshold = 2.5  # in V, the fire signal varies between 0 and 5 V
+    _fire_pretrigger_samples = 10  # samples kept before the falling edge of the fire signal
+    _fire_samples = 20  # total number of samples of the fire acquisition
 
     # def __init__(self, config, **kwargs):
     #     super().__init__(config=config, **kwargs)
@@ -72,6 +82,7 @@ class NIDAQMSeries(Base, LaserControlInterface, DaqInterface):
         self.ao_taskhandles = list()
         self.digital_out_taskhandle = None
         self.analog_in_taskhandle = None
+        self.fire_taskhandle = None
         
         # control if the config was correctly specified
         if (len(self._ao_channels) != len(self._ao_voltage_ranges)) or (len(self._ao_channels) != len(self._wavelengths)):
@@ -105,6 +116,8 @@ class NIDAQMSeries(Base, LaserControlInterface, DaqInterface):
             for n, channel in enumerate(self._ao_channels):
                 daq.DAQmxCreateTask('', daq.byref(taskhandles[channel])) 
                 daq.DAQmxCreateAOVoltageChan(taskhandles[channel], channel, '', self._ao_voltage_ranges[n][0], self._ao_voltage_ranges[n][1], daq.DAQmx_Val_Volts, None) 
+                # the task is kept running: each call of apply_voltage then only writes the new value
+                daq.DAQmxStartTask(taskhandles[channel])
             self.ao_taskhandles = taskhandles
         except:
             self.log.exception('Error starting analog output task.')
@@ -135,8 +148,6 @@ class NIDAQMSeries(Base, LaserControlInterface, DaqInterface):
         @returns: None
         """
         daq.WriteAnalogScalarF64(self.ao_taskhandles[channel], autostart, timeout, voltage, None)  # parameters passed in: taskHandle, autoStart, timeout, value, reserved
-        daq.DAQmxStartTask(self.ao_taskhandles[channel])
-        daq.DAQmxStopTask(self.ao_taskhandles[channel])
 
     def get_dict(self):
         """ Retrieves the channel name and the corresponding voltage range for each analog output from the
@@ -173,6 +184,7 @@ class NIDAQMSeries(Base, LaserControlInterface, DaqInterface):
             task = daq.TaskHandle()
             daq.DAQmxCreateTask('DigitalOut', daq.byref(task))
             daq.DAQmxCreateDOChan(task, self._do_channel, '', daq.DAQmx_Val_ChanForAllLines)  # last argument: line grouping
+            daq.DAQmxStartTask(task)  # kept running until close_do_task
             self.digital_out_taskhandle = task  # keep the taskhandle accessible
             return 0
         
@@ -195,7 +207,6 @@ class NIDAQMSeries(Base, LaserControlInterface, DaqInterface):
         num_samples_per_channel = daq.c_int32(num_samp)   # write 2 samples per channel
 #        digital_write1 = np.array([1,1,1,1,1,1,1,1], dtype=np.uint8)
         digital_read = daq.c_int32()
-        daq.DAQmxStartTask(self.digital_out_taskhandle)
         daq.DAQmxWriteDigitalLines(self.digital_out_taskhandle,  # taskhandle
                                 num_samples_per_channel,   # number of samples to write per channel
                                 True,   # autostart 
@@ -204,7 +215,6 @@ class NIDAQMSeries(Base, LaserControlInterface, DaqInterface):
                                 digital_write,   # array of 32 bit integer samples to write to the task  
                                 daq.byref(digital_read),  # samples per channel successfully written
                                 None)  # reserved for futur use       
-        daq.DAQmxStopTask(self.digital_out_taskhandle)
         
     def send_trigger(self):
         """ sends a sequence of digital output values [0, 1, 0] as trigger
@@ -234,6 +244,14 @@ class NIDAQMSeries(Base, LaserControlInterface, DaqInterface):
             daq.DAQmxCreateTask('AnalogIn', daq.byref(task))
             daq.DAQmxCreateAIVoltageChan(task, self._ai_channel, '' ,daq.DAQmx_Val_RSE, 0.0, 10.0, daq.DAQmx_Val_Volts, None) 
             self.analog_in_taskhandle = task  # keep the taskhandle accessible
+
+            # finite acquisition on the same channel, ending after the falling edge of the camera fire signal
+            fire_task = daq.TaskHandle()
+            daq.DAQmxCreateTask('FireIn', daq.byref(fire_task))
+            daq.DAQmxCreateAIVoltageChan(fire_task, self._ai_channel, '', daq.DAQmx_Val_RSE, 0.0, 10.0, daq.DAQmx_Val_Volts, None)
+            daq.DAQmxCfgSampClkTiming(fire_task, '', self._fire_sample_rate, daq.DAQmx_Val_Rising, daq.DAQmx_Val_FiniteSamps, self._fire_samples)
+            daq.DAQmxCfgAnlgEdgeRefTrig(fire_task, self._ai_channel, daq.DAQmx_Val_FallingSlope, self._fire_threshold, self._fire_pretrigger_samples)
+            self.fire_taskhandle = fire_task
             return 0
         
     def close_ai_task(self):
@@ -245,6 +263,9 @@ class NIDAQMSeries(Base, LaserControlInterface, DaqInterface):
                 daq.DAQmxStopTask(task)
                 daq.DAQmxClearTask(task)
                 self.analog_in_taskhandle = None
+                if self.fire_taskhandle is not None:
+                    daq.DAQmxClearTask(self.fire_taskhandle)
+                    self.fire_taskhandle = None
             except:
                 self.log.exception('Could not close analog input task')
         else:
@@ -292,3 +313,39 @@ class NIDAQMSeries(Base, LaserControlInterface, DaqInterface):
                 sleep(0.001)  # waiting time in s
                 return -1
 
+    def send_trigger_and_wait_for_fire(self, timeout):
+        """ sends a trigger pulse to the camera and waits until the end of the exposure (falling edge of the fire signal)
+
+        The acquisition of the fire signal is armed before the trigger is sent. It ends a few samples after the fire
+        signal falls below the threshold, this is detected by the analog reference trigger of the DAQ.
+
+        @param: float timeout: maximum waiting time in s (exposure time and a margin)
+
+        @return: int error code: ok = 0, error = -1 (fire not received)
+        """
+        if self.fire_taskhandle is None:
+            self.log.info('No analog input task configured')
+            return -1
+
+        data = np.zeros((self._fire_samples,), dtype=np.float64)
+        read = daq.c_int32()
+        daq.DAQmxStartTask(self.fire_taskhandle)
+        try:
+            self.write_to_do_channel(1, np.array([1], dtype=np.uint8))
+            sleep(0.001)  # waiting time in s
+            self.write_to_do_channel(1, np.array([0], dtype=np.uint8))
+            daq.DAQmxWaitUntilTaskDone(self.fire_taskhandle, timeout)
+            daq.DAQmxReadAnalogF64(self.fire_taskhandle, self._fire_samples, self._RWTimeout,
+                                   daq.DAQmx_Val_GroupByChannel, data, self._fire_samples, daq.byref(read), None)
+        except daq.DAQError:
+            # timeout of the acquisition: no falling edge of the fire signal
+            self.log.info('fire not received')
+            return -1
+        finally:
+            daq.DAQmxStopTask(self.fire_taskhandle)
+            self.write_to_do_channel(1, np.array([0], dtype=np.uint8))
+
+        if read.value == 0 or data[:read.value].max() <= self._fire_threshold:
+            self.log.info('fire not received')
+            return -1
+        return 0
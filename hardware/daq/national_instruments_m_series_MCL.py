@@ -9,6 +9,11 @@ This file contains a class for the NI-DAQ M series.
 
 It is used to control the MCL piezo from the DAQ and read its position.
 
+The on-demand tasks (piezo write and read, DIO3, DIO4, pump) are created once and started on first use. They are then
+kept running, so that a read or write is a single driver call. They are only stopped when their lines are needed by the
+hardware-timed tasks (trajectories and z stacks). The end of the FPGA acquisition ('acquisition done', DIO4) can be
+awaited with a change detection task, which blocks until the rising edge instead of polling the line.
+
 This module is an extension to the hardware code base of Qudi software 
 obtained from <https://github.com/Ulm-IQO/qudi/> 
 """
@@ -16,8 +21,9 @@ obtained from <https://github.com/Ulm-IQO/qudi/>
 import PyDAQmx as daq  # this only runs on systems where the niDAQmx library is available
 from core.module import Base
 from core.configoption import ConfigOption
+from core.util.mutex import RecursiveMutex
 import numpy as np
-from time import sleep
+from time import sleep, time
 
 
 class NIDAQMSeries(Base):
@@ -50,6 +56,9 @@ class NIDAQMSeries(Base):
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
+        self._running_tasks = {}  # task handle value: task handle, for the started on-demand tasks
+        self._task_lock = RecursiveMutex()  # the on-demand tasks are started and stopped from several threads
+        self.DIO4_edge_taskhandle = None
 
     def on_activate(self):
         """ Initialization steps when module is called.
@@ -124,9 +133,33 @@ class NIDAQMSeries(Base):
             taskhandles.value = None
         return taskhandles
 
+    def _start_task(self, task):
+        """ Start an on-demand task if it is not yet running. It then stays running until _stop_tasks is called. """
+        with self._task_lock:
+            if task.value not in self._running_tasks:
+                daq.DAQmxStartTask(task)
+                self._running_tasks[task.value] = task
+
+    def _stop_task(self, task):
+        """ Stop an on-demand task if it is running. """
+        with self._task_lock:
+            if self._running_tasks.pop(task.value, None) is not None:
+                daq.DAQmxStopTask(task)
+
+    def _stop_tasks(self):
+        """ Stop all running on-demand tasks, to free their lines for hardware-timed tasks. They are started again on
+        their next use. """
+        with self._task_lock:
+            for task in list(self._running_tasks.values()):
+                self._stop_task(task)
+
     def on_deactivate(self):
         """ Shut down the NI card.
         """
+        self._stop_tasks()
+        if self.DIO4_edge_taskhandle is not None:
+            daq.DAQmxClearTask(self.DIO4_edge_taskhandle)
+            self.DIO4_edge_taskhandle = None
         # clear the task
         try:
             daq.DAQmxClearTask(self.piezo_write_taskhandles)
@@ -143,7 +176,7 @@ class NIDAQMSeries(Base):
         """
         data = np.zeros((1,), dtype=np.float64)
         read = daq.c_int32()
-        daq.DAQmxStartTask(self.piezo_read_taskhandle)
+        self._start_task(self.piezo_read_taskhandle)
         daq.DAQmxReadAnalogF64(self.piezo_read_taskhandle,   # taskhandle
                            1,  # num_samples per channel # default value -1: all available samples
                            self._RWTimeout,  # timeout
@@ -152,7 +185,6 @@ class NIDAQMSeries(Base):
                            1,  # the size of the array in samples into which samples are read
                            daq.byref(read), # the actual number of samples read from each channel
                            None)  # reserved
-        daq.DAQmxStopTask(self.piezo_read_taskhandle)
         return data[0]
 
     def move_piezo(self, pos, autostart=True, timeout=10):
@@ -167,13 +199,118 @@ class NIDAQMSeries(Base):
 
         if pos>=0 and pos<=90:
             voltage = pos/10
+            self._start_task(self.piezo_write_taskhandles)
             daq.WriteAnalogScalarF64(self.piezo_write_taskhandles, autostart, timeout, voltage, None)  # parameters passed in: taskHandle, autoStart, timeout, value, reserved
-            daq.DAQmxStartTask(self.piezo_write_taskhandles)
-            daq.DAQmxStopTask(self.piezo_write_taskhandles)
         else:
             self.log.exception('Position out of boundaries')
 
 
+    def move_piezo_trajectory(self, positions, point_time):
+        """ Move the piezo along a trajectory, as a waveform timed by the sample clock of the DAQ (a single call
+        instead of one software-timed write per position). Returns when the waveform is completed.
+
+        @params: np.ndarray positions: successive positions of the piezo (in um)
+        @params: float point_time: time per position in s
+
+        @returns: bool: True if the trajectory was executed
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        if len(positions) == 0 or np.min(positions) < 0 or np.max(positions) > 90:
+            self.log.warning('Trajectory not executed: position out of boundaries')
+            return False
+        voltages = positions / 10
+
+        # a separate finite task is used: the on-demand piezo write task keeps its (software) timing
+        with self._task_lock:  # no on-demand task is restarted during the trajectory
+            self._stop_tasks()
+            taskhandle = daq.TaskHandle()
+            try:
+                daq.DAQmxCreateTask('', daq.byref(taskhandle))
+                daq.DAQmxCreateAOVoltageChan(taskhandle, self._piezo_write_channel, '', self._ao_voltage_range[0],
+                                             self._ao_voltage_range[1], daq.DAQmx_Val_Volts, None)
+                daq.DAQmxCfgSampClkTiming(taskhandle, '', 1 / point_time, daq.DAQmx_Val_Rising,
+                                          daq.DAQmx_Val_FiniteSamps, len(voltages))
+                written = daq.int32()
+                daq.DAQmxWriteAnalogF64(taskhandle, len(voltages), False, self._RWTimeout, daq.DAQmx_Val_GroupByChannel,
+                                        voltages, daq.byref(written), None)
+                daq.DAQmxStartTask(taskhandle)
+                daq.DAQmxWaitUntilTaskDone(taskhandle, len(voltages) * point_time + self._RWTimeout)
+                return True
+            except Exception as e:
+                self.log.warning(f'Trajectory not executed: {e}')
+                return False
+            finally:
+                if taskhandle.value is not None:
+                    daq.DAQmxStopTask(taskhandle)
+                    daq.DAQmxClearTask(taskhandle)
+
+    def run_zstack_waveforms(self, z_waveform, trigger_waveform, sample_rate):
+        """ Output the piezo positions and the 'piezo ready' trigger (DIO3) of a complete z stack as waveforms sharing
+        the analog output sample clock, while sampling the piezo position (AI) and the 'acquisition done' line (DIO4)
+        of the FPGA with the same clock. Returns when all samples are written.
+
+        @params: np.ndarray z_waveform: piezo position (in um) for each sample
+        @params: np.ndarray trigger_waveform: state (0 or 1) of the DIO3 line for each sample
+        @params: float sample_rate: in Hz
+
+        @returns: tuple (np.ndarray positions in um, np.ndarray DIO4 states, one value per sample, float time.time()
+                  when the analog output task (sample clock master) was started, time base of the samples)
+        """
+        n_samples = len(z_waveform)
+        if np.min(z_waveform) < 0 or np.max(z_waveform) > 90:
+            raise ValueError('Position out of boundaries')
+        device = self._piezo_write_channel.strip('/').split('/')[0]
+        clock = f'/{device}/ao/SampleClock'
+        voltages = np.ascontiguousarray(z_waveform, dtype=np.float64) / 10
+        triggers = np.ascontiguousarray(trigger_waveform, dtype=np.uint8)
+        positions = np.zeros((n_samples,), dtype=np.float64)
+        ready = np.zeros((n_samples,), dtype=np.uint8)
+        timeout = n_samples / sample_rate + self._RWTimeout
+
+        # the on-demand tasks (piezo write and read, DIO3, DIO4) are stopped: their lines can be used by these tasks
+        with self._task_lock:  # no on-demand task is restarted during the waveforms
+            self._stop_tasks()
+            ao_task, do_task, ai_task, di_task = [daq.TaskHandle() for _ in range(4)]
+            try:
+                for task in [ao_task, do_task, ai_task, di_task]:
+                    daq.DAQmxCreateTask('', daq.byref(task))
+                daq.DAQmxCreateAOVoltageChan(ao_task, self._piezo_write_channel, '', self._ao_voltage_range[0],
+                                             self._ao_voltage_range[1], daq.DAQmx_Val_Volts, None)
+                daq.DAQmxCreateDOChan(do_task, self._do_start_acquisition_DIO3, '', daq.DAQmx_Val_ChanPerLine)
+                daq.DAQmxCreateAIVoltageChan(ai_task, self._piezo_read_channel, '', daq.DAQmx_Val_RSE, 0.0, 10.0,
+                                             daq.DAQmx_Val_Volts, None)
+                daq.DAQmxCreateDIChan(di_task, self._do_acquisition_done_DIO4, '', daq.DAQmx_Val_ChanPerLine)
+                daq.DAQmxCfgSampClkTiming(ao_task, '', sample_rate, daq.DAQmx_Val_Rising, daq.DAQmx_Val_FiniteSamps,
+                                          n_samples)
+                for task in [do_task, ai_task, di_task]:  # slaved to the analog output sample clock
+                    daq.DAQmxCfgSampClkTiming(task, clock, sample_rate, daq.DAQmx_Val_Rising, daq.DAQmx_Val_FiniteSamps,
+                                              n_samples)
+
+                written = daq.int32()
+                daq.DAQmxWriteAnalogF64(ao_task, n_samples, False, self._RWTimeout, daq.DAQmx_Val_GroupByChannel,
+                                        voltages, daq.byref(written), None)
+                daq.DAQmxWriteDigitalLines(do_task, n_samples, False, self._RWTimeout, daq.DAQmx_Val_GroupByChannel,
+                                           triggers, daq.byref(written), None)
+                # start the slaved tasks first, they wait for the first edge of the clock
+                for task in [do_task, ai_task, di_task]:
+                    daq.DAQmxStartTask(task)
+                daq.DAQmxStartTask(ao_task)
+                start_time = time()
+
+                read = daq.int32()
+                bytes_per_sample = daq.int32()
+                daq.DAQmxReadAnalogF64(ai_task, n_samples, timeout, daq.DAQmx_Val_GroupByChannel, positions, n_samples,
+                                       daq.byref(read), None)
+                daq.DAQmxReadDigitalLines(di_task, n_samples, timeout, daq.DAQmx_Val_GroupByChannel, ready, n_samples,
+                                          daq.byref(read), daq.byref(bytes_per_sample), None)
+                daq.DAQmxWaitUntilTaskDone(ao_task, timeout)
+            finally:
+                for task in [ao_task, do_task, ai_task, di_task]:
+                    if task.value is not None:
+                        daq.DAQmxStopTask(task)
+                        daq.DAQmxClearTask(task)
+        return positions * 10, ready, start_time
+
     def write_to_pump_ao_channel(self, voltage, autostart=True, timeout=10):
         """ Start / Stop the needle rinsing pump
 
@@ -184,10 +321,9 @@ class NIDAQMSeries(Base):
         @returns: None
         """
         if voltage > -10 and voltage < 10:  # read limits from config
+            self._start_task(self.pump_write_taskhandle)
             daq.WriteAnalogScalarF64(self.pump_write_taskhandle, autostart, timeout, voltage,
                                      None)  # parameters passed in: taskHandle, autoStart, timeout, value, reserved
-            daq.DAQmxStartTask(self.pump_write_taskhandle)
-            daq.DAQmxStopTask(self.pump_write_taskhandle)
         else:
             self.log.warning('Voltage not in allowed range.')
 
@@ -197,7 +333,7 @@ class NIDAQMSeries(Base):
         num_samples_per_channel = daq.c_int32(num_samp)
         #        digital_write1 = np.array([1,1,1,1,1,1,1,1], dtype=np.uint8)
         digital_read = daq.c_int32()
-        daq.DAQmxStartTask(channel)
+        self._start_task(channel)
         daq.DAQmxWriteDigitalLines(channel,  # taskhandle
                                    num_samples_per_channel,  # number of samples to write per channel
                                    True,  # autostart
@@ -207,15 +343,60 @@ class NIDAQMSeries(Base):
                                    digital_write,  # array of 32 bit integer samples to write to the task
                                    daq.byref(digital_read),  # samples per channel successfully written
                                    None)  # reserved for futur use
-        daq.DAQmxStopTask(channel)
 
     def read_do_channel(self, num_samp, channel):
         num_samples_per_channel = daq.c_int32(num_samp)
         sampsPerChanRead = daq.c_int32()
         numBytesPerSamp = daq.c_int32()
         data = np.zeros((num_samp,), dtype=np.uint8)
-        daq.DAQmxStartTask(channel)
+        if self.DIO4_edge_taskhandle is not None and channel.value == self.DIO4_taskhandle.value:
+            self._stop_task(self.DIO4_edge_taskhandle)  # the DIO4 line is used either statically or for edge detection
+        self._start_task(channel)
         daq.DAQmxReadDigitalLines(channel, num_samples_per_channel, self._RWTimeout, daq.DAQmx_Val_GroupByChannel, data,
                                   num_samp, sampsPerChanRead, numBytesPerSamp, None)
-        daq.DAQmxStopTask(channel)
         return data
+
+    def arm_di_edge_detection(self):
+        """ Prepare the wait for the next rising edge of the 'acquisition done' line (DIO4) of the FPGA. Call this
+        method before sending the trigger, so that an edge occurring before wait_for_di_edge is called is not missed.
+
+        The change detection task is created on first use and then kept running: each rising edge is stored by the
+        DAQ as a sample. Samples of edges that occurred before arming are discarded.
+        """
+        if self.DIO4_edge_taskhandle is None:
+            task = daq.TaskHandle()
+            daq.DAQmxCreateTask('', daq.byref(task))
+            daq.DAQmxCreateDIChan(task, self._do_acquisition_done_DIO4, '', daq.DAQmx_Val_ChanPerLine)
+            daq.DAQmxCfgChangeDetectionTiming(task, self._do_acquisition_done_DIO4, '', daq.DAQmx_Val_ContSamps, 1000)
+            self.DIO4_edge_taskhandle = task
+        self._stop_task(self.DIO4_taskhandle)
+        self._start_task(self.DIO4_edge_taskhandle)
+
+        available = daq.uInt32()
+        daq.DAQmxGetReadAvailSampPerChan(self.DIO4_edge_taskhandle, daq.byref(available))
+        if available.value > 0:
+            data = np.zeros((available.value,), dtype=np.uint8)
+            read = daq.int32()
+            bytes_per_sample = daq.int32()
+            daq.DAQmxReadDigitalLines(self.DIO4_edge_taskhandle, available.value, 0, daq.DAQmx_Val_GroupByChannel,
+                                      data, available.value, daq.byref(read), daq.byref(bytes_per_sample), None)
+
+    def wait_for_di_edge(self, timeout):
+        """ Block until a rising edge of the 'acquisition done' line (DIO4) was detected since arm_di_edge_detection
+        was called.
+
+        @params: float timeout: maximum waiting time in s
+
+        @returns: bool: True if the edge was detected, False in case of timeout
+        """
+        data = np.zeros((1,), dtype=np.uint8)
+        read = daq.int32()
+        bytes_per_sample = daq.int32()
+        try:
+            daq.DAQmxReadDigitalLines(self.DIO4_edge_taskhandle, 1, timeout, daq.DAQmx_Val_GroupByChannel, data, 1,
+                                      daq.byref(read), daq.byref(bytes_per_sample), None)
+        except daq.DAQError as e:
+            if e.error == daq.DAQmxErrorSamplesNotYetAvailable:
+                return False
+            raise
+        return read.value == 1
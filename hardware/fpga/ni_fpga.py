@@ -14,7 +14,7 @@ obtained from <https://github.com/Ulm-IQO/qudi/>
 from nifpga import Session
 # import numpy as np
 # import ctypes
-from time import sleep
+from time import sleep, time
 
 from core.module import Base
 from interface.lasercontrol_interface import LaserControlInterface
@@ -22,6 +22,11 @@ from interface.fpga_interface import FPGAInterface
 from core.configoption import ConfigOption
 
 
+# keys of the registers in the register groups, in the order of the config lists registers_qpd and registers_autofocus
+QPD_REGISTER_KEYS = ['x', 'y', 'sum', 'counter', 'duration']
+PID_REGISTER_KEYS = ['setpoint', 'p', 'i', 'reset', 'autofocus', 'ref_axis', 'output']
+
+
 class Nifpga(Base, LaserControlInterface, FPGAInterface):
     """ National Instruments FPGA that controls the lasers via an OTF.
 
@@ -47,6 +52,10 @@ class Nifpga(Base, LaserControlInterface, FPGAInterface):
 
             # registers represent something like the channels.
             # The link between registers and the physical channel is made in the labview file from which the bitfile is generated.
+
+    Registers which are used together are accessed as groups (read_registers, write_registers):
+    'laser' (laser intensities, followed by a single update strobe), 'qpd' (x, y, sum, counter, duration) and 'pid'.
+    A read of the 'qpd' group returns a coherent snapshot: all values belong to the same FPGA iteration.
     """
     # config
     resource = ConfigOption('resource', None, missing='error')
@@ -57,8 +66,11 @@ class Nifpga(Base, LaserControlInterface, FPGAInterface):
     _registers_autofocus = ConfigOption('registers_autofocus', None, missing='warn')
     _registers_general = ConfigOption('registers_general', None, missing='warn')
 
+    _snapshot_retries = 3  # maximum number of repeated reads when the FPGA iteration changed during a group read
+
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
+        self._register_groups = {}
 
     def on_activate(self):
         """ Required initialization steps when module is called."""
@@ -92,8 +104,6 @@ class Nifpga(Base, LaserControlInterface, FPGAInterface):
             self.laser4_control = self.session.registers[self._registers_laser[3]]
             self.update = self.session.registers[self._registers_laser[4]]
             self.session.reset()
-            for i in range(len(self._registers_laser)-1):
-                self.apply_voltage(0, self._registers_laser[i])  # set initial value to each channel
 
         if self._registers_qpd is not None:
 
@@ -117,46 +127,96 @@ class Nifpga(Base, LaserControlInterface, FPGAInterface):
 
             self.Stop.write(False)
             self.Integration_time_us.write(10)
+        self._init_register_groups(laser=self._wavelengths is not None)
+        if self._wavelengths is not None:
+            self.apply_voltages({channel: 0 for channel in self._registers_laser[:-1]})  # initial value of each channel
         self.session.run()
 
     def on_deactivate(self):
         """ Required deactivation steps. """
-        for i in range(len(self._registers_laser)-1):
-            self.apply_voltage(0, self._registers_laser[i])   # make sure to switch the lasers off before closing the session
+        self.apply_voltages({channel: 0 for channel in self._registers_laser[:-1]})  # switch the lasers off before closing the session
 
         self.Stop.write(True)
         self.session.close()
 
+    def _init_register_groups(self, laser=True):
+        """ Collect the registers of the current session in the groups used by read_registers and write_registers.
+        The register objects are resolved once here, so that a group access does not search them by name.
+
+        @param bool laser: add the laser group (only available with the default bitfile)
+        """
+        self._register_groups = {}
+        if laser and self._registers_laser is not None:
+            self._register_groups['laser'] = {channel: self.session.registers[channel]
+                                              for channel in self._registers_laser[:-1]}
+        if self._registers_qpd is not None:
+            self._register_groups['qpd'] = {key: self.session.registers[name]
+                                            for key, name in zip(QPD_REGISTER_KEYS, self._registers_qpd)}
+        if self._registers_autofocus is not None:
+            self._register_groups['pid'] = {key: self.session.registers[name]
+                                            for key, name in zip(PID_REGISTER_KEYS, self._registers_autofocus)}
+
+    def read_registers(self, group):
+        """ Read all registers of a group and return them as a snapshot.
+
+        If the group contains the iteration counter of the FPGA, the counter is read before and after the other
+        registers, and the group is read again (up to _snapshot_retries times) if a new iteration started in between.
+        All values of the snapshot then belong to the same iteration.
+
+        @param str group: 'qpd', 'pid' or 'laser'
+
+        @return dict: register values by key, and 'timestamp' (time.time() of the read) and 'coherent' (False if the
+                      FPGA iteration changed during each of the reads)
+        """
+        registers = self._register_groups[group]
+        counter = registers.get('counter')
+        for _ in range(self._snapshot_retries + 1):
+            start = counter.read() if counter is not None else None
+            snapshot = {key: register.read() for key, register in registers.items() if register is not counter}
+            if counter is None:
+                snapshot['coherent'] = True
+                break
+            snapshot['counter'] = counter.read()
+            snapshot['coherent'] = snapshot['counter'] == start
+            if snapshot['coherent']:
+                break
+        snapshot['timestamp'] = time()
+        return snapshot
+
+    def write_registers(self, group, values):
+        """ Write several registers of a group. For the laser group, the update strobe is written once after all
+        values, so that the new intensities are applied at the same time.
+
+        @param str group: 'laser' or 'pid'
+        @param dict values: register key (laser group: register name of the channel): value to write (register units)
+        """
+        registers = self._register_groups[group]
+        for key, value in values.items():
+            registers[key].write(value)
+        if group == 'laser':
+            self.update.write(True)
+
     def read_qpd(self):
         """ read QPD signal and return a list containing the X,Y position of the spot, the SUM signal,
-        the number of counts (iterations) since the session was launched and the duration of each iteration
+        the number of counts (iterations) since the session was launched and the duration of each iteration.
+        All values belong to the same FPGA iteration (see read_registers).
         """
-        X = self.QPD_X_read.read()
-        Y = self.QPD_Y_read.read()
-        I = self.QPD_I_read.read()
-        count = self.Counter.read()
-        d = self.Duration_ms.read()
-
-        return [X, Y, I,count, d]
+        qpd = self.read_registers('qpd')
+        return [qpd['x'], qpd['y'], qpd['sum'], qpd['counter'], qpd['duration']]
 
     def reset_qpd_counter(self):
         self.Reset_counter.write(True)
 
     def update_pid_gains(self, p_gain, i_gain):
-        self.P.write(p_gain)
-        self.I.write(i_gain)
+        self.write_registers('pid', {'p': p_gain, 'i': i_gain})
 
     def init_pid(self, p_gain, i_gain, setpoint, ref_axis):
         self.reset_qpd_counter()
-        self.setpoint.write(setpoint)
-        self.P.write(p_gain)
-        self.I.write(i_gain)
-        if ref_axis == 'X':
-            self.ref_axis.write(True)
-        elif ref_axis == 'Y':
-            self.ref_axis.write(False)
-        self.reset.write(True)
-        self.autofocus.write(True)
+        values = {'setpoint': setpoint, 'p': p_gain, 'i': i_gain}
+        if ref_axis in ['X', 'Y']:
+            values['ref_axis'] = ref_axis == 'X'
+        values.update({'reset': True, 'autofocus': True})  # dicts keep the order: reset and start after the settings
+        self.write_registers('pid', values)
         sleep(0.1)
         self.reset.write(False)
 
@@ -178,20 +238,22 @@ class Nifpga(Base, LaserControlInterface, FPGAInterface):
 
         @returns: None
         """
-        # maybe think of replacing the hardcoded version of comparing channels with registers by something more dynamic
-        value = max(0, voltage)
-        conv_value = self.convert_value(value)
-        if channel == self._registers_laser[0]:  # '405'
-            self.laser1_control.write(conv_value)
-        elif channel == self._registers_laser[1]:  # '488'
-            self.laser2_control.write(conv_value)
-        elif channel == self._registers_laser[2]:  # '561'
-            self.laser3_control.write(conv_value)
-        elif channel == self._registers_laser[3]:  # '640'
-            self.laser4_control.write(conv_value)
-        else:
-            pass
-        self.update.write(True)
+        self.apply_voltages({channel: voltage})
+
+    def apply_voltages(self, voltages):
+        """ Writes the voltages of several channels, followed by a single update of the outputs.
+
+        @param: dict voltages: register name of the channel (example '405'): percent of maximal volts to be applied.
+                               Values are rescaled to the allowed range, unknown channels are ignored.
+                               Nothing is written if the laser registers are not available in the current bitfile.
+
+        @returns: None
+        """
+        lasers = self._register_groups.get('laser')
+        if not lasers:
+            return
+        self.write_registers('laser', {channel: self.convert_value(max(0, voltage))
+                                       for channel, voltage in voltages.items() if channel in lasers})
 
     def convert_value(self, value):
         """ helper function: fpga needs int16 (-32768 to + 32767) data format: do rescaling of value to apply in percent of max value
@@ -232,8 +294,7 @@ class Nifpga(Base, LaserControlInterface, FPGAInterface):
 
         (in this version it actually does the same as on_deactivate (we could also just call this method ..  but this might evolve)
         """
-        for i in range(len(self._registers_laser)):
-            self.apply_voltage(0, self._registers_laser[i])   # make sure to switch the lasers off before closing the session
+        self.apply_voltages({channel: 0 for channel in self._registers_laser[:-1]})  # switch the lasers off before closing the session
         self.session.close()
 
     def restart_default_session(self):
@@ -303,6 +364,7 @@ class Nifpga(Base, LaserControlInterface, FPGAInterface):
 
         self.Stop.write(False)
         self.Integration_time_us.write(10)
+        self._init_register_groups(laser=False)  # the laser registers are not available in this bitfile
 
         self.session.reset()
 
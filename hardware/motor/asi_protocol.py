@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the serial command protocol of the ASI MS2000 controller (motor_asi_ms2000.py).
+
+The controller answers each command (terminated by a carriage return) with one line: ':A ...' in case of success,
+':N-<error code>' in case of error, or only the status letter for the status command '/'. The controller executes the
+commands in the order of reception, so that the replies are matched to the commands by their order. This allows to:
+- batch the axes of a command in a single controller line ('W X Y Z' instead of 'W X', 'W Y', 'W Z'),
+- pipeline several commands: up to max_pending commands are written before the first reply is read.
+
+Every reply is read, also the ':A' of the commands without data (movements, settings), so that the input buffer does
+not need to be flushed before each command. It is only flushed to resynchronize after a missing reply.
+
+Example:
+    protocol = ASIProtocol(serial.Serial('COM4', baudrate=9600, timeout=1))
+    positions = protocol.get_axes('W', ['X', 'Y'])  # in controller units (0.1 um)
+    protocol.set_axes('R', {'Z': 10})
+    status, positions = protocol.transact(['/', 'W X Y'])
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+
+class ASIProtocol:
+    """ Pipelined command / reply exchange with an ASI controller. Not thread safe: the position service of the
+    hardware module executes all exchanges in its thread. """
+
+    def __init__(self, connection, max_pending=8):
+        """
+        @param serial.Serial connection: open serial connection, with a read timeout
+        @param int max_pending: maximum number of commands written before their reply is read (the input buffer of the
+                                controller is small)
+        """
+        self._connection = connection
+        self.max_pending = max_pending
+        self.round_trips = 0  # number of writes to the serial port, for diagnostics
+
+    def transact(self, commands):
+        """ Send the commands and return their replies, in the same order.
+
+        @param list commands: commands without the terminating carriage return, for example ['W X Y', '/']
+
+        @return list: decoded replies (str)
+        """
+        replies = []
+        sent = 0
+        try:
+            while len(replies) < len(commands):
+                if sent < len(commands) and sent - len(replies) < self.max_pending:
+                    burst = commands[sent:len(replies) + self.max_pending]
+                    self._connection.write(''.join(f'{command}\r' for command in burst).encode())
+                    self.round_trips += 1
+                    sent += len(burst)
+                line = self._connection.readline()
+                if not line.endswith(b'\n'):
+                    raise TimeoutError(f'No reply of the ASI controller to {commands[len(replies)]}')
+                replies.append(line.decode().strip())
+        except Exception:
+            self.resynchronize()  # the replies still on their way would be matched to the next commands
+            raise
+        return replies
+
+    def command(self, command):
+        """ Send a single command and return its reply. Raise a ValueError if the controller reports an error. """
+        return self.check(self.transact([command])[0], command)
+
+    def get_axes(self, command, axes):
+        """ Query a value of several axes in one controller line.
+
+        'W' (position) is written 'W X Y', the other commands (such as 'S', velocity) are written 'S X? Y?'.
+
+        @param str command: command shortcut
+        @param list axes: axis labels
+
+        @return list: float values in the order of axes, in controller units
+        """
+        if command == 'W':
+            line = f"W {' '.join(axes)}"
+        else:
+            line = f"{command} {' '.join(f'{axis}?' for axis in axes)}"
+        return self.parse_values(self.command(line), len(axes))
+
+    def set_axes(self, command, values):
+        """ Send a command with a value for several axes in one controller line, for example 'M X=10 Y=20'.
+
+        @param str command: command shortcut ('M', 'R', 'S', ...)
+        @param dict values: {axis label: value in controller units}
+        """
+        arguments = ' '.join(f'{axis}={value}' for axis, value in values.items())
+        self.command(f'{command} {arguments}')
+
+    def resynchronize(self):
+        """ Discard the replies waiting in the input buffer. """
+        self._connection.reset_input_buffer()
+
+    @staticmethod
+    def check(reply, command=''):
+        """ Return the reply, or raise a ValueError if it is an error reply (':N-<code>'). """
+        if reply.startswith(':N'):
+            raise ValueError(f'ASI controller error {reply[2:]} for command {command}')
+        return reply
+
+    @staticmethod
+    def parse_values(reply, count):
+        """ Values of an ':A' reply, written as '123.4' or as 'X=123.4'.
+
+        @param str reply: for example ':A 12.0 -5.5' or ':A X=5.745920 Y=5.745920'
+        @param int count: expected number of values
+
+        @return list: float values
+        """
+        tokens = reply[2:].split()  # remove the leading ':A'
+        values = [float(token.split('=')[-1]) for token in tokens]
+        if len(values) != count:
+            raise ValueError(f'Unexpected reply of the ASI controller: {reply}')
+        return values
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the completion handles returned by the non-blocking movements of the motor hardware modules
+(start_move_abs, start_move_rel).
+
+A MotionHandle is resolved when the device reports that the movement is finished. The caller can:
+- wait for it with a timeout (handle.wait(timeout)),
+- check it without blocking (handle.done()),
+- register a callback (handle.add_done_callback(function)),
+- await it in a coroutine (await handle).
+
+Each device has a single MotionPoller which queries the status of the device in a background thread while handles
+are pending. The polling interval starts short, so that short movements are detected with a small latency, and
+increases during long movements, so that the (serial) connection of the device is not saturated. The poller stops
+when no handle is pending. Several modules waiting for the same device therefore share one status query.
+
+Example:
+    poller = MotionPoller(lambda: self.get_status() == 'N')  # in the hardware module
+    handle = poller.track(MotionHandle(target={'x': 100}))
+    if not handle.wait(timeout=10):
+        print('timeout')
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+import asyncio
+import logging
+import threading
+from time import perf_counter, sleep
+
+logger = logging.getLogger(__name__)
+
+
+class MotionHandle:
+    """ Completion handle of a movement. """
+
+    def __init__(self, target=None):
+        """
+        @param dict target: target positions of the movement {axis_label: position} (for information)
+        """
+        self.target = target
+        self.start_time = perf_counter()
+        self.end_time = None
+        self.timed_out = False  # True if the poller gave up before the end of the movement
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def completed(cls, target=None):
+        """ Handle of a movement that is already finished (blocking movement, or nothing to move). """
+        handle = cls(target)
+        handle._set_done()
+        return handle
+
+    def done(self):
+        """ @return bool: True if the movement is finished """
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """ Block until the movement is finished.
+
+        @param float timeout: maximum waiting time in s. None: wait without limit
+
+        @return bool: True if the movement is finished, False in case of timeout
+        """
+        return self._event.wait(timeout)
+
+    @property
+    def duration(self):
+        """ Duration of the movement in s, None while it is running. """
+        return None if self.end_time is None else self.end_time - self.start_time
+
+    def add_done_callback(self, function):
+        """ Call function(handle) when the movement is finished, immediately if it is already finished. The callback
+        is called in the thread of the poller: use a Qt signal to pass the information to a logic module.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(function)
+                return
+        function(self)
+
+    def _set_done(self, timed_out=False):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.end_time = perf_counter()
+            self.timed_out = timed_out
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for function in callbacks:
+            try:
+                function(self)
+            except Exception:
+                logger.exception('Error in the callback of a motion handle')
+
+    def __await__(self):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def resolve(handle):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(handle))
+
+        self.add_done_callback(resolve)
+        return (yield from future.__await__())
+
+
+class MotionPoller:
+    """ Status poller of a device, resolving the pending handles when the device is idle. """
+
+    def __init__(self, is_idle, min_interval=0.01, max_interval=0.2, growth=1.5, timeout=60):
+        """
+        @param callable is_idle: returns True when no movement is running on the device
+        @param float min_interval: in s, interval between the first status queries of a movement
+        @param float max_interval: in s, maximum interval between two status queries
+        @param float growth: factor by which the interval increases after each query reporting a movement
+        @param float timeout: in s, pending handles are resolved as timed out after this time
+        """
+        self._is_idle = is_idle
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.growth = growth
+        self.timeout = timeout
+        self._pending = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, handle):
+        """ Resolve handle at the end of the movement. The movement command must have been sent before.
+
+        @param MotionHandle handle: new handle
+
+        @return MotionHandle: handle
+        """
+        with self._lock:
+            self._pending.append(handle)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return handle
+
+    def new_handle(self, target=None):
+        """ Create a handle for a movement that was just started, and track it. """
+        return self.track(MotionHandle(target))
+
+    def release(self):
+        """ Resolve all pending handles immediately (after an abort, or when the module is deactivated). """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for handle in pending:
+            handle._set_done()
+
+    def _run(self):
+        interval = self.min_interval
+        while True:
+            query_time = perf_counter()
+            try:
+                idle = self._is_idle()
+            except Exception:
+                logger.exception('Could not read the status of the device')
+                idle = False
+            with self._lock:
+                # a status query started before a movement command cannot report the end of this movement
+                finished = [h for h in self._pending if idle and h.start_time <= query_time]
+                expired = [h for h in self._pending if h not in finished and query_time - h.start_time > self.timeout]
+                self._pending = [h for h in self._pending if h not in finished and h not in expired]
+                stop = not self._pending
+                if stop:  # the next call of track starts a new thread
+                    self._thread = None
+            for handle in finished:
+                handle._set_done()
+            for handle in expired:
+                logger.warning(f'End of movement to {handle.target} not detected within {self.timeout} s')
+                handle._set_done(timed_out=True)
+            if stop:
+                return
+            if finished:  # a new movement was started during the query
+                interval = self.min_interval
+            sleep(interval)
+            interval = min(interval * self.growth, self.max_interval)
@@ -6,17 +6,34 @@ Created on Mon Oct 26 14:33:09 2020
 
 This file contains a class for the ASI MS2000 translation stage. 
 
+Movements can be started without blocking (start_move_abs, start_move_rel): they return a MotionHandle which is
+resolved by a single status poller of the stage (see motion_handle.py). The blocking movements wait on such a handle.
+
+The serial port is owned by a position service (see position_service.py): the commands are executed from a single
+queue, and the position and status are read on request, or polled in the background if position_poll_interval is set.
+The snapshots are published with sigPositionUpdated and answer the position reads (get_pos) as long as they are younger
+than position_max_age.
+
+The commands are exchanged with the ASI protocol (see asi_protocol.py): the axes of a command are batched in a single
+controller line, several commands can be pipelined, and every reply is read so that the port is not flushed before
+each command.
+
 It is an extension to the hardware code base of Qudi software 
 obtained from <https://github.com/Ulm-IQO/qudi/> 
 """
 
 import serial
 from time import sleep, time
+from functools import partial
+from qtpy import QtCore
 
 from core.module import Base
 from interface.motor_interface import MotorInterface
 from interface.brightfield_interface import BrightfieldInterface
 from core.configoption import ConfigOption
+from hardware.motor.motion_handle import MotionHandle, MotionPoller
+from hardware.motor.position_service import PositionService, PRIORITY_URGENT, PRIORITY_COMMAND
+from hardware.motor.asi_protocol import ASIProtocol
 
 
 class MS2000(Base, MotorInterface, BrightfieldInterface):
@@ -31,7 +48,11 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         second_axis_label: 'y'
         third_axis_label: 'z'
         LED connected: False
+        position_poll_interval: 0  # in s, 0 to read the position only on request
+        position_max_age: 0.25  # in s
     """
+    # signals
+    sigPositionUpdated = QtCore.Signal(dict)  # {'time': float (perf_counter), 'position': dict, 'status': str}
 
     _com_port = ConfigOption("com_port", missing="error")
     _baud_rate = ConfigOption("baud_rate", 9600, missing="warn")
@@ -41,12 +62,17 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
     _third_axis_label = ConfigOption("third_axis_label", None)  # default case is intended for 2 axes stage, for 3 axes specify in config
    
     _conversion_factor = 10.0  # user will send positions in um, stage uses 0.1 um
+    _serial_timeout = 1  # in s, maximum waiting time for a reply of the controller
     axis_list = None
+    _service = None
 
     _has_led = ConfigOption("LED connected", False, missing="warn")
+    _poll_interval = ConfigOption("position_poll_interval", 0)
+    _max_position_age = ConfigOption("position_max_age", 0.25)
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
+        self._poller = MotionPoller(self._is_idle, max_interval=0.05)  # end of the z sweeps detected within 50 ms
 
     def on_activate(self):
         """ Initialization: opening serial port and setting internal attributes
@@ -55,8 +81,10 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         """
         try:
             self._serial_connection = serial.Serial(
-                self._com_port, baudrate=self._baud_rate, bytesize=8, parity="N", stopbits=1, xonxoff=True
+                self._com_port, baudrate=self._baud_rate, bytesize=8, parity="N", stopbits=1, xonxoff=True,
+                timeout=self._serial_timeout, write_timeout=self._serial_timeout
             )
+            self._protocol = ASIProtocol(self._serial_connection)
 
             # add here the setting of private attributes
             self._timeout = 15
@@ -67,12 +95,20 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
             for item in axis_list:
                 if isinstance(item, str):
                     self.axis_list.append(item)
+
+            self._service = PositionService(self._read_snapshot, poll_interval=self._poll_interval,
+                                            max_age=self._max_position_age, publish=self.sigPositionUpdated.emit,
+                                            timeout=self._timeout)
+            self._service.start()
         except Exception:
             self.log.error(f'ASI MS2000 automated stage not connected. Check if device is switched on.')
 
     def on_deactivate(self):
         """ Close serial port when deactivating the module.
         """
+        self._poller.release()
+        if self._service is not None:
+            self._service.stop()
         self._serial_connection.close()
         # safety check  # to explore when problem with stage arises again ..
         port_open = self._serial_connection.is_open
@@ -97,31 +133,12 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         @ returns dict pos: Dictionary with the axis name and the current position in µm
         
         """
-        pos = {} 
-
         try:
-            for axis_label in param_dict:
-                if (
-                    axis_label in self.axis_list
-                ):  # to ensure that only configured axes are taken into account in case param_dict indicates other axes
-                    step = param_dict[axis_label] * self._conversion_factor
-                    cmd = f"R {axis_label}={step}\r"
-                    self.write(cmd)
-                    # eventually: add here read_error function to be implemented
-                    self.wait_for_idle()  # this timer is necessary to correctly handle write followed by query method. otherwise the serial port is still busy. replace eventually by wait_for_idle method to be implemented
-                    # see get_pos method. it cannot be called directly because we would again iterate over the axis_list.
-                    cmd = f"W {axis_label}\r"
-                    pos[axis_label] = (
-                        float(self.query(cmd)[3:]) / self._conversion_factor
-                    )  # [3:] -> remove the leading 'A: '
-
-                else:
-                    self.log.warn(f"axis {axis_label} is not configured")
+            handle = self.start_move_rel(param_dict)
+            return self._wait_and_get_pos(handle)
         except:
             self.log.error("relative movement of ASI MS2000 translation stage is not possible")
-            pos = {}
-            
-        return pos
+            return {}
         # pos contains only the axes that were moved. Should the others also be returned ?
 
     def move_abs(self, param_dict):
@@ -132,60 +149,84 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         @ returns dict pos: Dictionary with axis name and current position in µm
         
         """
-        pos = {}
-
         try:
-            for axis_label in param_dict:
-                if (
-                    axis_label in self.axis_list
-                ):  # to ensure that only configured axes are taken into account in case param_dict indicates other axes
-                    new_pos = param_dict[axis_label] * self._conversion_factor
-                    cmd = f"M {axis_label}={new_pos}\r"
-                    self.write(cmd)
-                    # eventually: add here read_error function to be implemented
-                    self.wait_for_idle()  # this timer is necessary to correctly handle write followed by query method. otherwise the serial port is still busy. replace eventually by wait_for_idle method to be implemented
-                    # see get_pos method. it cannot be called directly because we would again iterate over the axis_list.
-                    cmd = f"W {axis_label}\r"
-                    pos[axis_label] = (
-                        float(self.query(cmd)[3:]) / self._conversion_factor
-                    )  # [3:] -> remove the leading 'A: '
-
-                else:
-                    self.log.warn(f"axis {axis_label} is not configured")
-
+            handle = self.start_move_abs(param_dict)
+            return self._wait_and_get_pos(handle)
         except:
-            self.log.error("relative movement of ASI MS2000 translation stage is not possible")
-            pos = {}
+            self.log.error("absolute movement of ASI MS2000 translation stage is not possible")
+            return {}
+
+    def start_move_rel(self, param_dict):  # not on the interface
+        """ Start a relative movement of all given axes at once and return without waiting for its end.
+
+        @ param dict param_dict: Dictionary with axis name and relative movement in units of µm
+
+        @ returns MotionHandle: resolved when the stage is idle
+        """
+        return self._start_move('R', param_dict)
+
+    def start_move_abs(self, param_dict):  # not on the interface
+        """ Start an absolute movement of all given axes at once and return without waiting for its end.
+
+        @ param dict param_dict: Dictionary with axis name and absolute position in units of µm
+
+        @ returns MotionHandle: resolved when the stage is idle
+        """
+        return self._start_move('M', param_dict)
+
+    def _start_move(self, command, param_dict):
+        """ Send a movement command (M: absolute, R: relative) for all configured axes of param_dict. """
+        targets = {}
+        for axis_label in param_dict:
+            if axis_label in self.axis_list:
+                targets[axis_label] = param_dict[axis_label]
+            else:
+                self.log.warn(f"axis {axis_label} is not configured")
+        if not targets:
+            return MotionHandle.completed(targets)
+        arguments = ' '.join(f"{axis_label}={value * self._conversion_factor}" for axis_label, value in targets.items())
+        self.write(f"{command} {arguments}\r")
+        return self._poller.new_handle(targets)
+
+    def _wait_and_get_pos(self, handle):
+        """ Wait for the end of a movement and read the position of the moved axes.
+
+        @ param MotionHandle handle: handle of the movement
 
-        return pos
+        @ returns dict pos: Dictionary with the axis name and the current position in µm
+        """
+        if not handle.wait(self._timeout):
+            self.log.error("ASI MS2000 translation stage timeout occurred")
+        return self._service.call(partial(self._read_positions, list(handle.target)))
 
     def abort(self):
         """ Stops all active motors, stops a movement of the stage if ongoing. 
         
-        Attention, the (following) command N+1 is not performed! The N+2 command is again performed.
-        new tests on RAMM: following command is perfomed normally ..
+        The halt command is '\\' terminated by a carriage return. (It was formerly sent without the carriage return,
+        so that it was merged with the following command N+1, which was then not performed.)
         
         @ returns: error code (ok: 0)
         """
-        cmd = "\\r"
-        self.write(cmd)
-        # self._serial_connection.flush() # tried this, also flushInput(), to enable command N+1. does not work.... to be improved
+        # executed before the waiting commands. The controller replies with an error code if a movement was stopped
+        self._service.call(partial(self._send, "\\\r"), PRIORITY_URGENT)
         return 0
 
-    def get_pos(self):
+    def get_pos(self, max_age=None):
         """ Gets current position of the translation stage.
+
+        @ param float max_age: optional, in s. Maximum age of a cached position, read from the stage if the cached
+                               position is older. None: position_max_age from the config, 0: always read from the stage
         
         @ returns: dict pos: Dictionary with axis name and current position of the translation stage
         """
-        pos = {}
+        return dict(self._service.read(max_age)['position'])
 
-        for (
-            axis_label
-        ) in self.axis_list:  # this list is generated above to generalize more easily in case that more axes are added
-            cmd = f"W {axis_label}\r"
-            pos[axis_label] = float(self.query(cmd)[3:]) / self._conversion_factor  # [3:] -> remove the leading 'A: '
+    def is_position_polled(self):
+        """ Indicates if the position is polled in the background and published regularly with sigPositionUpdated.
 
-        return pos
+        @ returns: bool: False if the position is only read on request (position_poll_interval: 0)
+        """
+        return self._service is not None and bool(self._service.poll_interval)
 
     def get_status(self):
         """ Queries if any motors are still busy moving following a serial command. 
@@ -213,15 +254,9 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         
         @ returns dict velo: Dictionary with axis name and current velocity of the specified axis. 
         """
-        velo = {}
-
-        for axis_label in self.axis_list:
-            cmd = f"S {axis_label}?\r"
-            velo[axis_label] = float(
-                self.query(cmd)[5:]
-            )  # format from query ':A X=5.745920', remove leading X= and convert to float
-
-        return velo
+        # one query for all axes, format of the answer ':A X=5.745920 Y=5.745920'
+        velocities = self._service.call(partial(self._protocol.get_axes, "S", self.axis_list))
+        return dict(zip(self.axis_list, velocities))
 
     def set_velocity(self, param_dict):
         """ Sets the velocity at which the stage moves. 
@@ -231,21 +266,19 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
         
         @ returns dict: velo: Dictionary with axis name and current velocity in mm/s 
         """
-        velo = {}
+        new_velo = {}
+        for axis_label in param_dict:
+            if axis_label in self.axis_list:
+                new_velo[axis_label] = param_dict[axis_label]
+            else:
+                self.log.warn(f"specified axis {axis_label} not available")
+        if not new_velo:
+            return {}
 
         try:
-            for axis_label in param_dict:
-                if axis_label in self.axis_list:
-                    new_velo = param_dict[axis_label]
-                    cmd = f"S {axis_label}={new_velo}\r"
-                    self.write(cmd)
-                    self.wait_for_idle()  # this timer is necessary to correctly handle write followed by query methods. otherwise the serial port is still busy. replace eventually by wait_for_idle method to be implemented
-                    cmd = f"S {axis_label}?\r"
-                    velo[axis_label] = float(self.query(cmd)[5:])
-
-                else:
-                    self.log.warn("specified axis {axis_label} not available")
-
+            # setting and read back in one exchange with the controller
+            velocities = self._service.call(partial(self._set_and_get_velocity, new_velo))
+            velo = dict(zip(new_velo, velocities))
         except:
             self.log.error("could not set new velocity")
             velo = {}
@@ -255,6 +288,48 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
     ##################
 
     # other custom functions not defined in the MotorInterface
+    def _is_idle(self):
+        """ Status query used by the motion poller. """
+        return self._service.call(self._read_idle)
+
+    def _read_idle(self):
+        """ Status query executed by the position service. The positions cached during a movement are discarded at
+        its end. """
+        idle = self._protocol.transact(["/"])[0] == "N"
+        if idle:
+            self._service.invalidate()
+        return idle
+
+    def _read_snapshot(self):
+        """ Position and status of the stage, read by the position service.
+
+        @ returns: tuple (dict pos: Dictionary with axis name and current position, str status: 'N' or 'B')
+        """
+        # position of all axes and status in a single pipelined exchange
+        position, status = self._protocol.transact([f"W {' '.join(self.axis_list)}", "/"])
+        values = self._protocol.parse_values(self._protocol.check(position), len(self.axis_list))
+        pos = {axis_label: value / self._conversion_factor for axis_label, value in zip(self.axis_list, values)}
+        return pos, status
+
+    def _read_positions(self, axes):
+        """ Position of the given axes in µm, read in one controller line by the position service. """
+        values = self._protocol.get_axes("W", axes)
+        return {axis_label: value / self._conversion_factor for axis_label, value in zip(axes, values)}
+
+    def _set_and_get_velocity(self, param_dict):
+        """ Set the velocities and read them back, executed by the position service.
+
+        @ param dict param_dict: Dictionary with axis name and target velocity in mm/s
+
+        @ returns list: new velocities in the order of param_dict
+        """
+        axes = list(param_dict)
+        set_reply, get_reply = self._protocol.transact(
+            ["S " + " ".join(f"{axis_label}={value}" for axis_label, value in param_dict.items()),
+             "S " + " ".join(f"{axis_label}?" for axis_label in axes)])
+        self._protocol.check(set_reply, "S")
+        return self._protocol.parse_values(get_reply, len(axes))
+
     def wait_for_idle(self):
         """ Checks every 1 s until timeout if a motor is running from a serial command 'B' or not 'N'
         
@@ -305,21 +380,30 @@ class MS2000(Base, MotorInterface, BrightfieldInterface):
     # helper functions
 
     def query(self, command):
-        """ Clears the input buffer and queries an utf-8 encoded command
+        """ Queries an utf-8 encoded command and returns the answer of the controller
         
         @ param string: command: message to send to the serial port, typically in the format 'COMMANDSHORTCUT [AXIS=value]\r'
         
         @ returns string: answer: formatted and decoded response from serial port
         """
-        self._serial_connection.flushInput()
-        self._serial_connection.write(command.encode())
-        answer = self._serial_connection.readline().decode().strip()
-        return answer
+        return self._service.call(partial(self._transfer, command))
 
-    def write(self, command):
-        """ Clears the input buffer and writes an utf-8 encoded command to the serial port 
+    def write(self, command, priority=PRIORITY_COMMAND):
+        """ Writes an utf-8 encoded command to the serial port and reads the acknowledgement of the controller
         
         @ param string: command: message to send to the serial port, typically in the format 'COMMANDSHORTCUT [AXIS=value]\r'
+        @ param int priority: position in the command queue of the position service (PRIORITY_URGENT for an abort)
         """
-        self._serial_connection.flushInput()
-        self._serial_connection.write(command.encode())
+        reply = self._service.call(partial(self._send, command), priority)
+        if reply.startswith(":N"):
+            self.log.warning(f"ASI MS2000 error {reply[2:]} for command {command.strip()}")
+
+    def _transfer(self, command):
+        """ Serial round trip, executed in the thread of the position service. """
+        return self._protocol.transact([command.rstrip("\r")])[0]
+
+    def _send(self, command):
+        """ Command without data in the answer, executed in the thread of the position service. A command can change
+        the position (movement, zeroing): the cached position is discarded. """
+        self._service.invalidate()
+        return self._transfer(command)
@@ -3,6 +3,9 @@
 """
 This file contains the dummy for a motorized stage interface.
 
+The non-blocking movements (start_move_abs, start_move_rel) return a MotionHandle, resolved after the simulated
+duration of the movement (see motion_handle.py).
+
 Qudi is free software: you can redistribute it and/or modify
 it under the terms of the GNU General Public License as published by
 the Free Software Foundation, either version 3 of the License, or
@@ -25,6 +28,7 @@ import time
 
 from core.module import Base
 from interface.motor_interface import MotorInterface
+from hardware.motor.motion_handle import MotionHandle, MotionPoller
 
 class MotorAxisDummy:
     """ Generic dummy motor representing one axis. """
@@ -41,6 +45,7 @@ class MotorDummy(Base, MotorInterface):
         module.Class: 'motor.motor_dummy.MotorDummy'
 
     """
+    hardware_timed_trajectory = True  # run_trajectory simulates a trajectory timed by the controller
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
@@ -62,6 +67,11 @@ class MotorDummy(Base, MotorInterface):
 
         self._wait_after_movement = 0.5 #in seconds
 
+        # simulated non-blocking movement: target positions and time at which they are reached
+        self._pending_move = {}
+        self._move_end_time = 0
+        self._poller = MotionPoller(self._is_idle)
+
     #TODO: Checks if configuration is set and is reasonable
 
     def on_activate(self):
@@ -86,7 +96,7 @@ class MotorDummy(Base, MotorInterface):
         self._phi_axis.status = 0
 
     def on_deactivate(self):
-        pass
+        self._poller.release()
 
 
     def get_constraints(self):
@@ -556,6 +566,71 @@ class MotorDummy(Base, MotorInterface):
                 self._phi_axis.vel = desired_vel
 
 
+    def run_trajectory(self, axis, positions, point_time):
+        """ Simulate a hardware-timed trajectory: the axis reaches the last position after len(positions) * point_time.
+
+        @param str axis: axis label
+        @param np.ndarray positions: successive target positions
+        @param float point_time: time per position in s
+
+        @return bool: True if the trajectory was executed, False otherwise
+        """
+        axes = {ax.label: ax for ax in [self._x_axis, self._y_axis, self._z_axis, self._phi_axis]}
+        constr = self.get_constraints().get(axis)
+        if axis not in axes or len(positions) == 0 \
+                or not constr['pos_min'] <= min(positions) <= max(positions) <= constr['pos_max']:
+            self.log.warning('Trajectory on axis "{0}" not possible. Command is ignored!'.format(axis))
+            return False
+        time.sleep(len(positions) * point_time)
+        axes[axis].pos = positions[-1]
+        return True
+
+    def start_move_abs(self, param_dict):
+        """ Start a simulated absolute movement of all given axes, which ends after the waiting time of the dummy.
+
+        @param dict param_dict: {'axis_label': <a-value>}
+
+        @return MotionHandle: resolved when the movement is finished
+        """
+        axes = {ax.label: ax for ax in [self._x_axis, self._y_axis, self._z_axis, self._phi_axis]}
+        constraints = self.get_constraints()
+        target = {}
+        for label, desired_pos in param_dict.items():
+            if label not in axes:
+                continue
+            if not constraints[label]['pos_min'] <= desired_pos <= constraints[label]['pos_max']:
+                self.log.warning('Cannot make absolute movement of the axis "{0}" to possition {1}, since it exceeds '
+                                 'the limits! Command is ignored!'.format(label, desired_pos))
+                continue
+            target[label] = desired_pos
+            axes[label].status = False
+        if not target:
+            return MotionHandle.completed(target)
+        self._pending_move.update(target)
+        self._move_end_time = time.time() + self._wait_after_movement
+        return self._poller.new_handle(target)
+
+    def start_move_rel(self, param_dict):
+        """ Start a simulated relative movement of all given axes (see start_move_abs).
+
+        @param dict param_dict: {'axis_label': <a-step>}
+
+        @return MotionHandle: resolved when the movement is finished
+        """
+        curr_pos_dict = self.get_pos()
+        return self.start_move_abs({label: curr_pos_dict[label] + step for label, step in param_dict.items()
+                                    if label in curr_pos_dict})
+
+    def _is_idle(self):
+        """ Status query used by the motion poller: the simulated movement is applied once its time is over. """
+        if self._pending_move and time.time() >= self._move_end_time:
+            axes = {ax.label: ax for ax in [self._x_axis, self._y_axis, self._z_axis, self._phi_axis]}
+            for label, position in self._pending_move.items():
+                axes[label].pos = position
+                axes[label].status = True
+            self._pending_move = {}
+        return not self._pending_move
+
     def _make_wait_after_movement(self):
         """ Define a time which the dummy should wait after each movement. """
         time.sleep(self._wait_after_movement)
@@ -5,14 +5,20 @@ Created on Mon Feb 1 2021
 
 This file contains a class for the Mad city labs piezo controller.
 
+Movements can be started without blocking (start_move_abs, start_move_rel): they return a MotionHandle which is
+resolved when the position read from the controller is within a tolerance of the target (see motion_handle.py).
+
 It is an extension to the hardware code base of Qudi software
 obtained from <https://github.com/Ulm-IQO/qudi/>
 """
 import ctypes
+import numpy as np
 
 from core.module import Base
 from interface.motor_interface import MotorInterface
 from core.configoption import ConfigOption
+from core.util.mutex import RecursiveMutex
+from hardware.motor.motion_handle import MotionHandle, MotionPoller
 
 
 # error codes  # maybe transform into error dict
@@ -26,6 +32,11 @@ MCL_ARGUMENT_ERROR	    = -6  # An argument is out of range or a required pointer
 MCL_INVALID_AXIS		= -7  # Attempting an operation on an axis that does not exist in the Nano-Drive.
 MCL_INVALID_HANDLE	    = -8  # The handle is not valid.  Or at least is not valid in this instance of the DLL.
 
+# waveform limits of the Nano-Drive (see MCL_LoadWaveFormN in the Madlib documentation)
+MCL_WAVEFORM_MAX_POINTS = 6666
+MCL_WAVEFORM_MIN_POINT_TIME = 1 / 30  # in ms
+MCL_WAVEFORM_MAX_POINT_TIME = 5  # in ms
+
 
 class MCLNanoDrive(Base, MotorInterface):
     """ Class representing the MCL Nano-Drive (Piezo controller).
@@ -38,6 +49,7 @@ class MCLNanoDrive(Base, MotorInterface):
         pos_min: 0  # in um
         pos_max: 80  # in um
         max_step: 1  # in um
+        waveform_axis: 3  # optional, axis number used for the waveforms (X: 1, Y: 2, Z: 3)
 
         found help with return type of MCL_SingleReadZ here:
         https://github.com/ScopeFoundry/HW_mcl_stage/blob/master/mcl_nanodrive.py
@@ -53,9 +65,16 @@ class MCLNanoDrive(Base, MotorInterface):
     _pos_min = ConfigOption('pos_min', 0, missing='warn')  # in um
     _pos_max = ConfigOption('pos_max', 80, missing='warn')  # in um
     _max_step = ConfigOption('max_step', 1, missing='warn')  # in um
+    _waveform_axis = ConfigOption('waveform_axis', 3)
+
+    _on_target_tolerance = 0.05  # in um, the Nano-Drive has no on target status: the position is compared to the target
+    hardware_timed_trajectory = True  # run_trajectory is timed by the Nano-Drive (waveform)
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
+        self._target = None  # target position of the last movement started with start_move_abs or start_move_rel
+        self._device_lock = RecursiveMutex()  # the Nano-Drive is accessed from the motion poller thread
+        self._poller = MotionPoller(self._is_idle, min_interval=0.002, max_interval=0.02, timeout=1)
 
     def on_activate(self):
         self.dll = ctypes.cdll.LoadLibrary(self.dll_location)
@@ -77,8 +96,10 @@ class MCLNanoDrive(Base, MotorInterface):
         self._axis_ID = self.handle  # not really needed .. just for conformity with pifoc get_constraints function. maybe remove ..
 
     def on_deactivate(self):
+        self._poller.release()
         handle = ctypes.c_int(self.handle)
-        self.dll.MCL_ReleaseHandle(handle)
+        with self._device_lock:
+            self.dll.MCL_ReleaseHandle(handle)
 
     def get_constraints(self):
         """ Retrieve the hardware constrains from the motor device.
@@ -115,7 +136,8 @@ class MCLNanoDrive(Base, MotorInterface):
 
         if axis == self._axis_label and abs(step) <= constraints[axis]['max_step'] and constraints[axis]['pos_min'] <= position + step <= constraints[axis]['pos_max']:
             new_pos = ctypes.c_double(position + step)
-            err = self.dll.MCL_SingleWriteZ(new_pos, self.handle)
+            with self._device_lock:
+                err = self.dll.MCL_SingleWriteZ(new_pos, self.handle)
             if err == MCL_SUCCESS:
                 return True
             else:
@@ -137,7 +159,8 @@ class MCLNanoDrive(Base, MotorInterface):
 
         if axis == self._axis_label and constraints[axis]['pos_min'] <= new_pos <= constraints[axis]['pos_max']:
             new_pos = ctypes.c_double(new_pos)
-            err = self.dll.MCL_SingleWriteZ(new_pos, self.handle)
+            with self._device_lock:
+                err = self.dll.MCL_SingleWriteZ(new_pos, self.handle)
             if err == MCL_SUCCESS:
                 return True
             else:
@@ -157,7 +180,8 @@ class MCLNanoDrive(Base, MotorInterface):
 
         @return dict: with keys being the axis labels and item the current position.
         """
-        cur_pos = self.dll.MCL_SingleReadZ(self.handle)
+        with self._device_lock:
+            cur_pos = self.dll.MCL_SingleReadZ(self.handle)
         if cur_pos < 0:  # then this corresponds to an error code
             self.log.warn(f'error reading position: {cur_pos}')
         else:
@@ -217,3 +241,76 @@ class MCLNanoDrive(Base, MotorInterface):
         @return int: error code (0:OK, -1:error)
         """
         self.log.info('set velocity not available')
+
+# not on the interface
+    def start_move_abs(self, param_dict):
+        """ Start an absolute movement and return without waiting until the position is reached.
+
+        @param dict param_dict: Dictionary with axis name and target position (in um units) as key - value pairs
+
+        @return MotionHandle: resolved when the position is reached (immediately if the movement was not possible)
+        """
+        target = dict(param_dict)
+        if not self.move_abs(dict(param_dict)):
+            return MotionHandle.completed(target)
+        self._target = target[self._axis_label]
+        return self._poller.new_handle(target)
+
+    def start_move_rel(self, param_dict):
+        """ Start a relative movement and return without waiting until the position is reached.
+
+        @param dict param_dict: Dictionary with axis name and step (in um units) as key - value pairs
+
+        @return MotionHandle: resolved when the position is reached (immediately if the movement was not possible)
+        """
+        (_, position) = self.get_pos().popitem()
+        step = dict(param_dict)
+        if not self.move_rel(dict(param_dict)):
+            return MotionHandle.completed(step)
+        self._target = position + step[self._axis_label]
+        return self._poller.new_handle({self._axis_label: self._target})
+
+    def _is_idle(self):
+        """ Status query used by the motion poller. """
+        if self._target is None:
+            return True
+        return abs(self.get_pos()[self._axis_label] - self._target) <= self._on_target_tolerance
+
+    def run_trajectory(self, axis, positions, point_time):
+        """ Execute a trajectory in a single call, timed by the Nano-Drive (waveform load). Returns when the waveform
+        is completed.
+
+        @param str axis: axis label
+        @param np.ndarray positions: successive target positions in um. The steps between the positions (and from the
+                                     current position to the first one) must not exceed max_step.
+        @param float point_time: time per position in s
+
+        @return bool: True if the trajectory was executed, False otherwise
+        """
+        constraints = self.get_constraints()[self._axis_label]
+        positions = np.asarray(positions, dtype=np.float64)
+        point_time_ms = point_time * 1000
+        (_, position) = self.get_pos().popitem()
+
+        if axis != self._axis_label:
+            self.log.warning(f'Trajectory not executed: unknown axis {axis}.')
+            return False
+        if not 0 < len(positions) <= MCL_WAVEFORM_MAX_POINTS \
+                or not MCL_WAVEFORM_MIN_POINT_TIME <= point_time_ms <= MCL_WAVEFORM_MAX_POINT_TIME:
+            self.log.warning(f'Trajectory not executed: {len(positions)} points of {point_time_ms} ms are not '
+                             f'supported by the Nano-Drive.')
+            return False
+        if np.min(positions) < constraints['pos_min'] or np.max(positions) > constraints['pos_max'] \
+                or np.max(np.abs(np.diff(positions, prepend=position))) > constraints['max_step'] + 1e-6:
+            self.log.warning('Trajectory not executed: allowed range or maximum step exceeded.')
+            return False
+
+        waveform = np.ascontiguousarray(positions)
+        with self._device_lock:
+            err = self.dll.MCL_LoadWaveFormN(ctypes.c_uint(self._waveform_axis), ctypes.c_uint(len(waveform)),
+                                             ctypes.c_double(point_time_ms),
+                                             waveform.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), self.handle)
+        if err != MCL_SUCCESS:
+            self.log.warning(f'Could not execute the trajectory on axis {axis}: {err}.')
+            return False
+        return True
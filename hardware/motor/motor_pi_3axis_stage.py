@@ -13,6 +13,7 @@ obtained from <https://github.com/Ulm-IQO/qudi/>
 from core.module import Base
 from interface.motor_interface import MotorInterface
 from core.configoption import ConfigOption
+from hardware.motor.motion_handle import MotionPoller
 
 from pipython import GCSDevice, pitools
 
@@ -48,6 +49,7 @@ class PIMotorStage(Base, MotorInterface):
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
+        self._poller = MotionPoller(self._is_idle, min_interval=0.05, max_interval=0.5)
 
     # def __init__(self, *args, **kwargs):
     #     super().__init__()
@@ -110,6 +112,7 @@ class PIMotorStage(Base, MotorInterface):
     def on_deactivate(self):
         """ Required deactivation steps
         """
+        self._poller.release()
         # set position (0, 0, 0)
         # first move z to default position and wait until reached
         self.pidevice_3rd_axis.MOV(self.third_axis_ID, 0.0)
@@ -489,6 +492,32 @@ class PIMotorStage(Base, MotorInterface):
 
             # error code handling
 
+# not on the interface
+    def start_move_abs(self, param_dict):
+        """ Start an absolute movement and return a handle resolved when all axes are on target.
+
+        @param dict param_dict: {'axis_label': <the-abs-pos-value>}
+
+        @return MotionHandle: completion handle of the movement
+        """
+        self.move_abs(param_dict)
+        return self._poller.new_handle(dict(param_dict))
+
+    def start_move_rel(self, param_dict):
+        """ Start a relative movement and return a handle resolved when all axes are on target.
+
+        @param dict param_dict: {'axis_label': <the-rel-pos-value>}
+
+        @return MotionHandle: completion handle of the movement
+        """
+        self.move_rel(param_dict)
+        return self._poller.new_handle(dict(param_dict))
+
+    def _is_idle(self):
+        """ Status query used by the motion poller. """
+        return all(self.get_status().values())
+
+
 # if __name__ == '__main__':
 #     pistage = PIMotorStage()
 #     pistage.on_activate()
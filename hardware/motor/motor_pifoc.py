@@ -6,13 +6,20 @@ Created on Tue Jan 12 12:56:10 2021
 
 This file contains a class for the PIFOC z axis positioning stage.
 
+Movements can be started without blocking (start_move_abs, start_move_rel): they return a MotionHandle which is
+resolved when the axis is on target (see motion_handle.py). The status is then queried from the thread of the motion
+poller: all accesses to the controller are protected by a device lock.
+
 It is an extension to the hardware code base of Qudi software 
 obtained from <https://github.com/Ulm-IQO/qudi/> 
 """
 import numpy as np
+from time import sleep, perf_counter
 from core.module import Base
 from interface.motor_interface import MotorInterface
 from core.configoption import ConfigOption
+from core.util.mutex import RecursiveMutex
+from hardware.motor.motion_handle import MotionHandle, MotionPoller
 
 from pipython import GCSDevice, pitools
 
@@ -45,9 +52,12 @@ class PIFOC(Base, MotorInterface):
     _max_step = ConfigOption('max_step', 5, missing='warn')  # in um
     # _vel_min = ConfigOption('vel_min', ??, missing='warn')
     # _vel_max = ConfigOption('vel_max', ??, missing='warn')
+    hardware_timed_trajectory = False  # run_trajectory is paced by the computer (one MOV command per position)
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
+        self._device_lock = RecursiveMutex()  # the controller is accessed from the motion poller thread
+        self._poller = MotionPoller(self._is_idle)
 
     def on_activate(self):
         """ Initialization
@@ -73,7 +83,9 @@ class PIFOC(Base, MotorInterface):
     def on_deactivate(self):
         """ Required deactivation steps
         """
-        self.pidevice.CloseConnection()
+        self._poller.release()
+        with self._device_lock:
+            self.pidevice.CloseConnection()
 
     def get_constraints(self):
         """ Retrieve the hardware constrains from the motor device.
@@ -117,12 +129,13 @@ class PIFOC(Base, MotorInterface):
                 cur_pos = position[axis]  # returns just the float value of the axis
                 # check if the position stays in allowed range after movement
                 if abs(step) <= constraints[axis]['max_step'] and constraints[axis]['pos_min'] <= cur_pos + step <= constraints[axis]['pos_max']:
-                    self.pidevice.MVR(axis, step)
-                    err = True
-                    if not err:
-                        error_code = self.pidevice.GetError()
-                        error_msg = self.pidevice.TranslateError(error_code)
-                        self.log.warning(f'Could not move axis {axis} by {step}: {error_msg}.')
+                    with self._device_lock:
+                        self.pidevice.MVR(axis, step)
+                        err = True
+                        if not err:
+                            error_code = self.pidevice.GetError()
+                            error_msg = self.pidevice.TranslateError(error_code)
+                            self.log.warning(f'Could not move axis {axis} by {step}: {error_msg}.')
                 else:
                     self.log.warning('Movement not possible. Allowed range exceeded')
         return err
@@ -143,12 +156,13 @@ class PIFOC(Base, MotorInterface):
             target = np.round(target, decimals=3)
             # self.log.info(f'axis: {axis}; target: {target}')
             if axis in self.axes and constraints[axis]['pos_min'] <= target <= constraints[axis]['pos_max']:  # control if the right axis is addressed
-                self.pidevice.MOV(axis, target)  # MOV has no return value
-                err = True  
-                if not err:
-                    error_code = self.pidevice.GetError()
-                    error_msg = self.pidevice.TranslateError(error_code)
-                    self.log.warning(f'Could not move axis {axis} to {target} : {error_msg}.')
+                with self._device_lock:
+                    self.pidevice.MOV(axis, target)  # MOV has no return value
+                    err = True
+                    if not err:
+                        error_code = self.pidevice.GetError()
+                        error_msg = self.pidevice.TranslateError(error_code)
+                        self.log.warning(f'Could not move axis {axis} to {target} : {error_msg}.')
                     # it might be needed to print a pertinent error message in case the movement was not performed because the conditions above were not met,
                     # that is, if the error does not come from the controller but due to the coded conditions 
         return err
@@ -173,7 +187,8 @@ class PIFOC(Base, MotorInterface):
 
         @return OrderedDict: with keys being the axis labels and item the current position.
         """
-        pos = self.pidevice.qPOS(self.axes)  # this returns an OrderedDict
+        with self._device_lock:
+            pos = self.pidevice.qPOS(self.axes)  # this returns an OrderedDict
         return pos
 
     def get_status(self):
@@ -181,7 +196,8 @@ class PIFOC(Base, MotorInterface):
 
         @return bool err
         """
-        err = self.pidevice.IsControllerReady()  
+        with self._device_lock:
+            err = self.pidevice.IsControllerReady()
         return err
 
     def calibrate(self):
@@ -210,21 +226,75 @@ class PIFOC(Base, MotorInterface):
         # should it be possible to set the velocity else just send a message that this function is not available for the controller
 
 # not on the interface
-    def _wait_for_idle(self):
-        """ first draft for a wait for idle function
-        
-        checks if on target 
-        
-        problem: seems to return too fast, so that the position is not yet the right one.. 
-        although this function is actually meant to not wait until the target position is reached.. 
-        
-        it works when the two log entries are activated. this seems to take some additional time, allowing 
-        the stage to reach the target 
+    def start_move_abs(self, param_dict):
+        """ Start an absolute movement and return without waiting for its end.
+
+        @param dict param_dict: Dictionary with axis name and target position (in um units) as key-value pairs
+
+        @return MotionHandle: resolved when the axis is on target (immediately if the movement was not possible)
         """
-        # self.log.info('old position: {}'.format(self.get_pos()))
-        pitools.waitontarget(self.pidevice)
-        # self.log.info('new position: {}'.format(self.get_pos()))
-        return
+        target = dict(param_dict)
+        if not self.move_abs(dict(param_dict)):
+            return MotionHandle.completed(target)
+        return self._poller.new_handle(target)
+
+    def start_move_rel(self, param_dict):
+        """ Start a relative movement and return without waiting for its end.
+
+        @param dict param_dict: Dictionary with axis name and step (in um units) as key-value pairs
+
+        @return MotionHandle: resolved when the axis is on target (immediately if the movement was not possible)
+        """
+        step = dict(param_dict)
+        if not self.move_rel(dict(param_dict)):
+            return MotionHandle.completed(step)
+        return self._poller.new_handle(step)
+
+    def _is_idle(self):
+        """ Status query used by the motion poller. """
+        with self._device_lock:
+            on_target = self.pidevice.qONT(self.axes)
+        return all(on_target.values())
+
+    def _wait_for_idle(self, timeout=None):
+        """ Wait until the axis is on target.
+
+        @param float timeout: maximum waiting time in s. None: wait without limit
+        """
+        self._poller.new_handle().wait(timeout)
+
+    def run_trajectory(self, axis, positions, point_time):
+        """ Execute a trajectory in a single call.
+
+        The E-816 controller has no wave generator: the positions are sent as MOV commands paced by point_time, without
+        reading the position between two points (one USB transfer per point instead of three for move_rel).
+
+        @param str axis: axis label
+        @param np.ndarray positions: successive target positions in um. The steps between the positions (and from the
+                                     current position to the first one) must not exceed max_step.
+        @param float point_time: time per position in s
+
+        @return bool: True if the trajectory was executed, False otherwise
+        """
+        constraints = self.get_constraints()[self._axis_label]
+        positions = np.round(np.asarray(positions, dtype=np.float64), decimals=3)
+        if axis not in self.axes or len(positions) == 0:
+            self.log.warning(f'Trajectory not executed on axis {axis}.')
+            return False
+        position = self.get_pos()[axis]
+        if np.min(positions) < constraints['pos_min'] or np.max(positions) > constraints['pos_max'] \
+                or np.max(np.abs(np.diff(positions, prepend=position))) > constraints['max_step'] + 1e-3:
+            self.log.warning('Trajectory not executed: allowed range or maximum step exceeded.')
+            return False
+
+        start = perf_counter()
+        for n, target in enumerate(positions):
+            with self._device_lock:
+                self.pidevice.MOV(axis, target)
+            remaining = start + (n + 1) * point_time - perf_counter()
+            if remaining > 0:
+                sleep(remaining)
+        return True
 
 
 
@@ -265,14 +335,15 @@ class PIFOCV2(Base, MotorInterface):
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
         self.pidevice = GCSDevice(self._controllername)
+        self._device_lock = RecursiveMutex()  # the controller is accessed from the motion poller thread
+        self._poller = MotionPoller(self._is_idle)
 
     def on_activate(self):
         """ Initialization
         """
-        # open the connection
-        # with GCSDevice(self._controllername) as pidevice:
-
-        with self.pidevice:  # is it possible to use this as context manager and also to call the dll functions therein ??
+        # open the connection. It is kept open until deactivation: the methods called from the motion poller thread
+        # and from the main thread share it (protected by the device lock) instead of connecting again for each call
+        with self._device_lock:
             self.pidevice.ConnectUSB(serialnum=self._serialnum)
             self.log.info('connected: {}'.format(self.pidevice.qIDN().strip()))
 
@@ -288,7 +359,8 @@ class PIFOCV2(Base, MotorInterface):
     def on_deactivate(self):
         """
         """
-        with self.pidevice:
+        self._poller.release()
+        with self._device_lock:
             self.pidevice.CloseConnection()
 
     def get_constraints(self):
@@ -330,8 +402,7 @@ class PIFOCV2(Base, MotorInterface):
             if axis in self.axes:
                 cur_pos = position[axis]  # returns just the float value of the axis
                 if abs(step) <= constraints[axis]['max_step'] and constraints[axis]['pos_min'] <= cur_pos + step <= constraints[axis]['pos_max']:
-                    with self.pidevice:
-                        self.pidevice.ConnectUSB(serialnum=self._serialnum)
+                    with self._device_lock:
                         self.pidevice.MVR(axis, step)
                         err = True
                         if not err:
@@ -359,7 +430,7 @@ class PIFOCV2(Base, MotorInterface):
             # self.log.info(f'axis: {axis}; target: {target}')
             if axis in self.axes and constraints[axis]['pos_min'] <= target <= constraints[axis][
                 'pos_max']:  # control if the right axis is addressed
-                with self.pidevice:
+                with self._device_lock:
                     self.pidevice.MOV(axis, target)  # MOV has no return value
                     err = True
                     if not err:
@@ -399,8 +470,7 @@ class PIFOCV2(Base, MotorInterface):
 
                       update docstring after tests !
         """
-        with self.pidevice:
-            self.pidevice.ConnectUSB(serialnum=self._serialnum)
+        with self._device_lock:
             pos = self.pidevice.qPOS(self.axes)  # this returns an OrderedDict
 
         return pos
@@ -416,7 +486,7 @@ class PIFOCV2(Base, MotorInterface):
 
         @return bool err
         """
-        with self.pidevice:
+        with self._device_lock:
             err = self.pidevice.IsControllerReady()
         return err
 
@@ -470,18 +540,39 @@ class PIFOCV2(Base, MotorInterface):
         # should it be possible to set the velocity else just send a message that this function is not available for the controller
 
     # not on the interface
-    def wait_for_idle(self):
-        """ first draft for a wait for idle function
+    def start_move_abs(self, param_dict):
+        """ Start an absolute movement and return without waiting for its end.
+
+        @param dict param_dict: Dictionary with axis name and target position (in um units) as key - value pairs
+
+        @return MotionHandle: resolved when the axis is on target (immediately if the movement was not possible)
+        """
+        target = dict(param_dict)
+        if not self.move_abs(dict(param_dict)):
+            return MotionHandle.completed(target)
+        return self._poller.new_handle(target)
+
+    def start_move_rel(self, param_dict):
+        """ Start a relative movement and return without waiting for its end.
+
+        @param dict param_dict: Dictionary with axis name and step (in um units) as key - value pairs
+
+        @return MotionHandle: resolved when the axis is on target (immediately if the movement was not possible)
+        """
+        step = dict(param_dict)
+        if not self.move_rel(dict(param_dict)):
+            return MotionHandle.completed(step)
+        return self._poller.new_handle(step)
 
-        checks if on target
+    def _is_idle(self):
+        """ Status query used by the motion poller. """
+        with self._device_lock:
+            on_target = self.pidevice.qONT(self.axes)
+        return all(on_target.values())
 
-        problem: seems to return too fast, so that the position is not yet the right one..
-        although this function is actually meant to not wait until the target position is reached..
+    def wait_for_idle(self, timeout=None):
+        """ Wait until the axis is on target.
 
-        it works when the two log entries are activated. this seems to take some additional time, allowing
-        the stage to reach the target
+        @param float timeout: maximum waiting time in s. None: wait without limit
         """
-        # self.log.info('old position: {}'.format(self.get_pos()))
-        pitools.waitontarget(self.pidevice)
-        # self.log.info('new position: {}'.format(self.get_pos()))
-        return
+        self._poller.new_handle().wait(timeout)
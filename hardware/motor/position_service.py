@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the position service of the stage hardware modules connected by a serial port (motor_asi_ms2000.py).
+
+The service owns the serial port: all transfers are executed one after the other in its thread, taken from a single
+priority queue. An abort is executed before the waiting commands, and the commands of the modules are executed before
+the background polling, so that the position tracking of the GUI cannot delay the movement command of a task.
+
+When no command is waiting, the service reads the position and the status of the stage on a fixed schedule. The
+timestamped snapshot is kept in a cache and published (for example with a Qt signal of the hardware module). Position
+reads are answered from the cache as long as the snapshot is younger than the maximum age, so that the logic modules
+polling the position at the same time share the serial round trips.
+
+Example:
+    service = PositionService(self._read_snapshot, poll_interval=0.2, max_age=0.25)  # in the hardware module
+    service.start()
+    answer = service.call(lambda: self._transfer('W X\r'))
+    position = service.read()['position']
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_URGENT = 0  # abort
+PRIORITY_COMMAND = 1  # commands and queries of the modules
+
+
+class PositionService:
+    """ Command queue and position cache of a serial stage. """
+
+    def __init__(self, read_snapshot, poll_interval=0.2, max_age=0.25, publish=None, timeout=15):
+        """
+        @param callable read_snapshot: returns (dict position {axis_label: position}, str status) of the stage. It is
+                                       called in the thread of the service and may use the serial port directly.
+        @param float poll_interval: in s, interval between the background snapshots. 0: no background polling
+        @param float max_age: in s, default maximum age of a cached snapshot answering a position read
+        @param callable publish: called with each new snapshot {'time': float, 'position': dict, 'status': str}
+        @param float timeout: in s, maximum waiting time for the execution of a command
+        """
+        self._read_snapshot = read_snapshot
+        self.poll_interval = poll_interval
+        self.max_age = max_age
+        self._publish = publish
+        self.timeout = timeout
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()  # keeps the order of the commands of the same priority
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """ Start the thread of the service. """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """ Stop the thread of the service once the waiting commands are executed. """
+        if self._thread is not None:
+            self._queue.put((PRIORITY_COMMAND + 1, next(self._counter), None, None))
+            self._thread.join(self.timeout)
+            self._thread = None
+
+    def submit(self, function, priority=PRIORITY_COMMAND):
+        """ Queue a function using the serial port, for execution in the thread of the service.
+
+        @param callable function: function without argument
+        @param int priority: PRIORITY_URGENT or PRIORITY_COMMAND
+
+        @return concurrent.futures.Future: result of the function
+        """
+        future = Future()
+        self._queue.put((priority, next(self._counter), function, future))
+        return future
+
+    def call(self, function, priority=PRIORITY_COMMAND):
+        """ Execute a function using the serial port in the thread of the service and return its result. """
+        if self._thread is None or threading.current_thread() is self._thread:
+            return function()
+        return self.submit(function, priority).result(self.timeout)
+
+    def cached(self, max_age=None):
+        """ Latest snapshot if it is younger than max_age (default: max_age of the service), else None. """
+        max_age = self.max_age if max_age is None else max_age
+        with self._lock:
+            snapshot = self._snapshot
+        if snapshot is not None and perf_counter() - snapshot['time'] <= max_age:
+            return snapshot
+        return None
+
+    def read(self, max_age=None):
+        """ Snapshot of the stage, from the cache if it is younger than max_age, else read from the stage.
+
+        @param float max_age: in s, None: max_age of the service, 0: always read from the stage
+
+        @return dict: {'time': float, 'position': dict, 'status': str}
+        """
+        snapshot = self.cached(max_age)
+        if snapshot is None:
+            snapshot = self.call(self._take_snapshot)
+        return snapshot
+
+    def invalidate(self):
+        """ Discard the cached snapshot (after a command changing the position, or at the end of a movement). """
+        with self._lock:
+            self._snapshot = None
+
+    def _take_snapshot(self):
+        start = perf_counter()  # the snapshot is dated from the start of the transfers
+        position, status = self._read_snapshot()
+        snapshot = {'time': start, 'position': position, 'status': status}
+        with self._lock:
+            self._snapshot = snapshot
+        if self._publish is not None:
+            self._publish(snapshot)
+        return snapshot
+
+    def _run(self):
+        next_poll = perf_counter()
+        while True:
+            timeout = max(next_poll - perf_counter(), 0) if self.poll_interval else None
+            try:
+                _, _, function, future = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                try:
+                    self._take_snapshot()
+                except Exception:
+                    logger.exception('Could not read the position of the stage')
+                next_poll = perf_counter() + self.poll_interval
+                continue
+            if function is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function())
+            except Exception as error:
+                future.set_exception(error)
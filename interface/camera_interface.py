@@ -91,6 +91,17 @@ class CameraInterface(metaclass=InterfaceMetaclass):
         """
         pass
 
+    @abstract_interface_method
+    def set_acquisition_buffer(self, buffer):
+        """ Set the array in which the frames of the next fixed length acquisition (movie, kinetic series) are stored.
+        This can be a numpy.memmap, so that the size of the acquisition is limited by the disk space instead of the
+        memory. The buffer is used for one acquisition only and is returned by get_acquired_data.
+
+        @param numpy ndarray buffer: C-contiguous uint16 array of shape (n_frames, height, width),
+                                     or None to store the data in memory
+        """
+        pass
+
     @abstract_interface_method
     def set_exposure(self, exposure):
         """ Set the exposure time in seconds
@@ -183,6 +194,18 @@ class CameraInterface(metaclass=InterfaceMetaclass):
         """
         pass
 
+    @abstract_interface_method
+    def get_new_frames(self):
+        """ Return the frames acquired since the last call, during a movie acquisition.
+
+        Each frame is returned only once, in the order of acquisition. This allows to save a movie while it is
+        still being acquired.
+
+        @return numpy array: image data of the new frames in format [[[row],[row]...], ...] (frame index as first
+                             dimension). The first dimension has length 0 if no new frame is available.
+        """
+        pass
+
     @abstract_interface_method
     def get_most_recent_image(self):
         """ Return an array of last acquired image.
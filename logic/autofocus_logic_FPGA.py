@@ -6,8 +6,9 @@
 
 from core.connector import Connector
 from core.configoption import ConfigOption
-from core.util.mutex import Mutex
+from core.util.mutex import Mutex, RecursiveMutex
 from logic.generic_logic import GenericLogic
+from logic.reflection_search import ReflectionSearch
 from qtpy import QtCore
 
 import pyqtgraph as pg
@@ -47,6 +48,11 @@ class AutofocusLogic(GenericLogic):
         proportional_gain : 0.1 # in %%
         integration_gain : 1 # in %%
         exposure = 0.001
+        qpd_threshold: 300  # minimum QPD sum signal of the IR reflection
+        search_velocity: 0.05  # in mm/s, stage velocity of the sweeps searching the reflection
+        fine_velocity: 0.005  # in mm/s, stage velocity of the fine approach to the reflection
+        search_range: 20  # in um, range of the first sweep of the rescue procedure (extended up to 40 um)
+        fine_range: 2  # in um, range of the fine approach
         connect:
             camera : 'thorlabs_camera'
             fpga: 'nifpga'
@@ -69,6 +75,14 @@ class AutofocusLogic(GenericLogic):
     _autofocus_stable = False
     _autofocus_iterations = 0
 
+    # search of the reflection
+    _qpd_threshold = ConfigOption('qpd_threshold', 300)
+    _search_velocity = ConfigOption('search_velocity', 0.05)
+    _fine_velocity = ConfigOption('fine_velocity', 0.005)
+    _search_range = ConfigOption('search_range', 20)
+    _fine_range = ConfigOption('fine_range', 2)
+    _max_search_range = 40  # in um
+
     # pid attributes
     _pid_frequency = 0.2  # in s, frequency for the autofocus PID update
     _P_gain = ConfigOption('proportional_gain', 0, missing='warn')
@@ -84,6 +98,8 @@ class AutofocusLogic(GenericLogic):
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
         # self.threadpool = QtCore.QThreadPool()
+        # the detector is read from the autofocus control loop (worker thread) and from the main thread
+        self._detector_lock = RecursiveMutex()
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -93,6 +109,7 @@ class AutofocusLogic(GenericLogic):
         self._stage = self.stage()
         self._camera = self.camera()
         self._camera.set_exposure(self._exposure)
+        self._reflection_search = ReflectionSearch(self._stage, self._fpga.read_qpd, threshold=self._qpd_threshold)
 
     def on_deactivate(self):
         """ Required deactivation.
@@ -107,23 +124,25 @@ class AutofocusLogic(GenericLogic):
         """ General function returning the reference signal for the autofocus correction. In the case of the
         method using a FPGA, it returns the QPD signal measured along the reference axis.
         """
-        return self.qpd_read_position()
+        with self._detector_lock:
+            return self.qpd_read_position()
 
     # fpga only
     def read_detector_intensity(self):
         """ Function used for the focus search. Measured the intensity of the reflection instead of reading its
         position
         """
-        return self.qpd_read_sum()
+        with self._detector_lock:
+            return self.qpd_read_sum()
 
     def autofocus_check_signal(self):
-        """ Check that the intensity detected by the QPD is above a specific threshold (300). If the signal is too low,
-        the function returns False to indicate that the autofocus signal is lost.
+        """ Check that the intensity detected by the QPD is above a specific threshold (qpd_threshold). If the signal is
+        too low, the function returns False to indicate that the autofocus signal is lost.
         :return bool: True: signal ok, False: signal too low
         """
-        qpd_sum = self.qpd_read_sum()
-        print(qpd_sum)
-        if qpd_sum < 300:
+        with self._detector_lock:
+            qpd_sum = self.qpd_read_sum()
+        if qpd_sum < self._qpd_threshold:
             return False
         else:
             return True
@@ -131,16 +150,22 @@ class AutofocusLogic(GenericLogic):
     def define_pid_setpoint(self):
         """ Initialize the pid setpoint
         """
-        self.qpd_reset()
-        self._setpoint = self.read_detector_signal()
+        with self._detector_lock:
+            self.qpd_reset()
+            self._setpoint = self.read_detector_signal()
         return self._setpoint
 
-    def init_pid(self):
+    def init_pid(self, period=None):
         """ Initialize the pid for the autofocus
+        :param float period: optional, in s. Period of the pid update (autofocus control loop). It can not be shorter
+                             than the iteration time of the FPGA. Default: iteration time of the FPGA
         """
-        self.qpd_reset()
-        self._fpga.init_pid(self._P_gain, self._I_gain, self._setpoint, self._ref_axis)
-        self.set_worker_frequency()
+        with self._detector_lock:
+            self.qpd_reset()
+            self._fpga.init_pid(self._P_gain, self._I_gain, self._setpoint, self._ref_axis)
+            self.set_worker_frequency()
+        if period is not None:
+            self._pid_frequency = max(period, self._pid_frequency)
 
         self._autofocus_stable = False
         self._autofocus_iterations = 0
@@ -148,7 +173,8 @@ class AutofocusLogic(GenericLogic):
     def read_pid_output(self, check_stabilization):
         """ Read the pid output signal in order to adjust the position of the objective
         """
-        pid_output = self._fpga.read_pid()
+        with self._detector_lock:
+            pid_output = self._fpga.read_pid()
 
         if check_stabilization:
             self._autofocus_iterations += 1
@@ -157,6 +183,11 @@ class AutofocusLogic(GenericLogic):
         else:
             return pid_output
 
+    def get_pid_period(self):
+        """ Return the period of the pid update (autofocus control loop) in s
+        """
+        return self._pid_frequency
+
     def check_stabilization(self):
         """ Check for the stabilization of the focus
         """
@@ -206,22 +237,9 @@ class AutofocusLogic(GenericLogic):
             self.rescue_autofocus()
 
         # Look for the position with the maximum intensity - for the QPD the SUM signal is used.
-        max_sum = 0
         z_range = 5  # in µm
-        z_step = 0.1  # in µm
-
-        self.stage_move_z(-z_range/2)
-
-        for n in range(int(z_range/z_step)):
-
-            self.stage_move_z(z_step)
-
-            sum = self.read_detector_intensity()
-            print(sum)
-            if sum > max_sum:
-                max_sum = sum
-            elif sum < max_sum and max_sum > 500:
-                break
+        if not self.search_reflection(z_range):
+            self.log.warning('Offset calibration: no maximum of the QPD sum signal found.')
 
         # Calculate the offset for the stage and move back to the initial position
         offset = self._stage.get_pos()['z'] - z_up
@@ -241,32 +259,51 @@ class AutofocusLogic(GenericLogic):
 
     def rescue_autofocus(self):
         """ When the autofocus signal is lost, launch a rescuing procedure by using the MS2000 translation stage. The
-        z position of the stage is moved until the piezo signal is found again.
+        stage is swept over a range centered on the current position until the reflection is found. The range is
+        extended up to 40 um if needed.
         """
-        success = False
-        z_range = 20
-        while not self.autofocus_check_signal() and z_range <= 40:
-
-            self.stage_move_z(-z_range/2)
-
-            for z in range(z_range):
-                step = 1
-                self.stage_move_z(step)
-
-                if self.autofocus_check_signal():
-                    success = True
-                    print("autofocus signal found!")
-                    return success
-
-            if not self.autofocus_check_signal():
-                self.stage_move_z(-z_range/2)
-                z_range += 10
+        z_range = self._search_range
+        while not self.autofocus_check_signal() and z_range <= self._max_search_range:
+            if self.search_reflection(z_range):
+                self.log.info('Autofocus signal found.')
+                return True
+            z_range += 10
+
+        return self.autofocus_check_signal()
+
+    def search_reflection(self, z_range):
+        """ Search the maximum of the QPD sum signal in a range centered on the current stage position. The stage is
+        swept continuously over the range while the QPD is sampled, the reflection is located on the recorded profile,
+        and its position is refined by a short, slow sweep. The stage stays at the reflection if it was found,
+        otherwise it goes back to the initial position.
+
+        :param float z_range: search range in um
+        :return bool: True if the reflection was found
+        """
+        search = self._reflection_search
+        z_start = self._stage.get_pos()['z']
+        self.stage_move_z(-z_range / 2)
+        profile = search.sweep(z_range, self._search_velocity)
+        z_peak, max_sum = search.find_peak(profile)
+        self.log.debug(f'Reflection search over {z_range} um: {len(profile[1])} samples in {profile[2]:.2f} s, '
+                       f'maximum QPD sum {max_sum:.0f}')
+        if z_peak is None:
+            self._stage.move_abs({'z': z_start})
+            return False
 
-        return success
+        # fine approach
+        self._stage.move_abs({'z': z_peak - self._fine_range / 2})
+        z_fine, _ = search.find_peak(search.sweep(self._fine_range, self._fine_velocity))
+        self._stage.move_abs({'z': z_fine if z_fine is not None else z_peak})
+        return True
 
     def stage_move_z(self, step):
         self._stage.move_rel({'z': step})
 
+    def get_stage_z(self):
+        """ Return the z position of the 3 axes stage in µm (cached by the stage position service if recent). """
+        return self._stage.get_pos()['z']
+
     def do_position_correction(self, step):
         self._stage.set_velocity({'z': 0.01})
         sleep(1)
@@ -319,30 +356,29 @@ class AutofocusLogic(GenericLogic):
 
     def qpd_read_position(self):
         """ Read the QPD signal from the FPGA. The signal is read from X/Y positions. In order to make sure we are
-        always reading from the latest piezo position, the method is waiting for a new count.
+        always reading from the latest piezo position, the method is waiting for a new count. The position is taken
+        from a coherent snapshot of the QPD registers (all values from the same FPGA iteration).
         """
-        qpd = self._fpga.read_qpd()
-        last_count = qpd[3]
-        while last_count == qpd[3]:
-            qpd = self._fpga.read_qpd()
-            sleep(0.01)
+        qpd = self._fpga.read_registers('qpd')
+        last_count = qpd['counter']
+        while last_count == qpd['counter']:
+            sleep(0.001)
+            qpd = self._fpga.read_registers('qpd')
 
         if self._ref_axis == 'X':
-            return qpd[0]
+            return qpd['x']
         elif self._ref_axis == 'Y':
-            return qpd[1]
+            return qpd['y']
 
     def qpd_read_sum(self):
         """ Read the SUM signal from the QPD. Returns an indication whether there is a detected signal or not
         """
-        qpd = self._fpga.read_qpd()
-        return qpd[2]
+        return self._fpga.read_registers('qpd')['sum']
 
     def set_worker_frequency(self):
         """ Update the worker frequency according to the iteration time of the fpga
         """
-        qpd = self._fpga.read_qpd()
-        self._pid_frequency = qpd[4] / 1000 + 0.01
+        self._pid_frequency = self._fpga.read_registers('qpd')['duration'] / 1000 + 0.01
 
     def qpd_reset(self):
         """ Reset the QPD counter
@@ -6,8 +6,9 @@
 
 from core.connector import Connector
 from core.configoption import ConfigOption
-from core.util.mutex import Mutex
+from core.util.mutex import Mutex, RecursiveMutex
 from logic.generic_logic import GenericLogic
+from logic.centroid_tracker import CentroidTracker
 from qtpy import QtCore
 
 import numpy as np
@@ -27,6 +28,7 @@ class AutofocusLogic(GenericLogic):
         proportional_gain : 0.1 # in %%
         integration_gain : 1 # in %%
         exposure = 0.001
+        centroid_window : 64 # in pixels, size of the window in which the IR reflection is tracked
         connect:
             camera : 'thorlabs_camera'
     """
@@ -38,6 +40,7 @@ class AutofocusLogic(GenericLogic):
     _exposure = ConfigOption('exposure', 0.001, missing='warn')
     _camera_acquiring = False
     _threshold = 150
+    _centroid_window = ConfigOption('centroid_window', 64)
 
     # autofocus attributes
     _focus_offset = 0  # defaults to zero for a 2 axes system
@@ -60,6 +63,8 @@ class AutofocusLogic(GenericLogic):
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
+        # the camera is read from the autofocus control loop (worker thread) and from the main thread (live display)
+        self._detector_lock = RecursiveMutex()
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -70,8 +75,7 @@ class AutofocusLogic(GenericLogic):
         # initialize the camera
         self._camera.set_exposure(self._exposure)
         self._im_size = self._camera.get_size()
-        self._idx_X = np.linspace(0, self._im_size[0] - 1, self._im_size[0])
-        self._idx_Y = np.linspace(0, self._im_size[1] - 1, self._im_size[1])
+        self._centroid_tracker = CentroidTracker(window_size=self._centroid_window)
         self.init_pid()
 
     def on_deactivate(self):
@@ -87,9 +91,9 @@ class AutofocusLogic(GenericLogic):
         """ General function returning the reference signal for the autofocus correction. In the case of the
         method using a FPGA, it returns the QPD signal measured along the reference axis.
         """
-        im = self.get_latest_image()
-        mask = self.calculate_threshold_image(im)
-        x0, y0 = self.calculate_centroid(im, mask)
+        with self._detector_lock:
+            im = self.get_latest_image()
+            x0, y0 = self.calculate_centroid(im)
 
         if self._ref_axis == 'X':
             return x0
@@ -101,10 +105,12 @@ class AutofocusLogic(GenericLogic):
         the function returns False to indicate that the autofocus signal is lost.
         :return bool: True: signal ok, False: signal too low
         """
-        im = self.get_latest_image()
-        im_threshold = self.calculate_threshold_image(im)
+        with self._detector_lock:
+            im = self.get_latest_image()
+            self.calculate_centroid(im)
+            n_pixels = self._centroid_tracker.n_pixels
 
-        if np.sum(im_threshold) < 50:
+        if n_pixels == 0:
             return False
         else:
             return True
@@ -115,9 +121,12 @@ class AutofocusLogic(GenericLogic):
         self._setpoint = self.read_detector_signal()
         return self._setpoint
 
-    def init_pid(self):
+    def init_pid(self, period=None):
         """ Initialize the pid for the autofocus
+        :param float period: optional, in s. Period of the pid update (autofocus control loop)
         """
+        if period is not None:
+            self._pid_frequency = period
         self._pid = PID(self._P_gain, self._I_gain, 0, setpoint=self._setpoint)
         self._pid.sample_time = self._pid_frequency
 
@@ -137,6 +146,11 @@ class AutofocusLogic(GenericLogic):
         else:
             return pid_output
 
+    def get_pid_period(self):
+        """ Return the period of the pid update (autofocus control loop) in s
+        """
+        return self._pid_frequency
+
     def check_stabilization(self):
         """ Check for the stabilization of the focus
         """
@@ -166,7 +180,8 @@ class AutofocusLogic(GenericLogic):
         """ Get the latest acquired image from the camera. This function returns the raw image as well as the
         threshold image
         """
-        im = self._camera.get_acquired_data()
+        with self._detector_lock:
+            im = self._camera.get_acquired_data()
         return im
 
 # ================================================================================
@@ -187,6 +202,10 @@ class AutofocusLogic(GenericLogic):
     def stage_move_z(self, step):
         self.log.warning('stage movement is not supported on this setup')
 
+    def get_stage_z(self):
+        """ There is no stage z axis on this setup: the focus position is given by the piezo only. """
+        return 0
+
     def do_position_correction(self):
         self.log.warning('stage movement is not supported on this setup')
 
@@ -204,25 +223,20 @@ class AutofocusLogic(GenericLogic):
 # private methods for camera-based autofocus
 # =================================================================
     def calculate_threshold_image(self, im):
-        """ Calculate the threshold image according to the threshold value
+        """ Calculate the threshold image according to the threshold value. Only used for the display, the
+        centroid is calculated without it.
         """
-        mask = np.copy(im)
-        mask[mask > self._threshold] = 254
-        mask[mask <= self._threshold] = 0
-        return mask
+        return np.where(im > self._threshold, np.uint8(254), np.uint8(0))
 
-    def calculate_centroid(self, im, mask):
-        """ Calculate the centroid of the raw image using the threshold image as mask
-        """
-        im_x = np.sum(im * mask, 0)  # Calculate the projection along the X axis
-        im_y = np.sum(im * mask, 1)  # Calculate the projection along the Y axis
-        if sum(im_x) != 0 and sum(im_y) != 0:
-            x0 = sum(self._idx_X * im_x) / sum(im_x)
-            y0 = sum(self._idx_Y * im_y) / sum(im_y)
-        else:
-            x0 = 0 
-            y0 = 0
+    def calculate_centroid(self, im, mask=None):
+        """ Calculate the centroid of the pixels above threshold of the raw image, weighted by their intensity.
+        The IR reflection is tracked in a small window around its last position (see logic/centroid_tracker.py), the
+        full image is only searched when the reflection is lost.
 
-        return x0, y0
+        @param im: raw image
+        @param mask: not used, kept for compatibility
+        @return tuple: x0, y0 (0, 0 if no pixel is above threshold)
+        """
+        return self._centroid_tracker.locate(im, self._threshold)
 
 
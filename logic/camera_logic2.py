@@ -22,10 +22,12 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 import numpy as np
 from time import sleep
 import os
-from PIL import Image
+import tempfile
 from astropy.io import fits
 import yaml
 
+from logic.image_writers import TiffWriter, FitsWriter, ChunkedDatasetWriter, to_uint16
+from logic.frame_metadata import FrameMetadataRecorder
 from core.connector import Connector
 from core.configoption import ConfigOption
 from core.util.mutex import Mutex
@@ -55,6 +57,26 @@ class LiveImageWorker(QtCore.QRunnable):
         self.signals.sigFinished.emit()
 
 
+class SaveWorker(QtCore.QRunnable):
+    """ Worker thread to save image data in the background
+
+    The worker calls the save function and frees its place in the save queue when the data is written """
+
+    def __init__(self, save_function, args, queue_slots):
+        super(SaveWorker, self).__init__()
+        self.save_function = save_function
+        self.args = args
+        self.queue_slots = queue_slots
+
+    @QtCore.Slot()
+    def run(self):
+        """ """
+        try:
+            self.save_function(*self.args)
+        finally:
+            self.queue_slots.release()
+
+
 class CameraLogic(GenericLogic):
     """
     Control a camera.
@@ -63,6 +85,12 @@ class CameraLogic(GenericLogic):
     # declare connectors
     hardware = Connector(interface='CameraInterface')
     _max_fps = ConfigOption('default_exposure', 20)
+    _stream_video = ConfigOption('stream_video', False)  # write movies to disk while they are acquired
+    _save_queue_size = ConfigOption('save_queue_size', 4)  # max number of data sets waiting or being saved in background
+    _save_threads = ConfigOption('save_threads', 2)  # number of threads writing the queued data sets
+    _dataset_compression = ConfigOption('dataset_compression', 'lzf')  # h5 container: 'lzf', 'gzip' or None
+    _memmap_directory = ConfigOption('memmap_directory', None)  # directory for disk-resident acquisition buffers
+    _memmap_threshold = ConfigOption('memmap_threshold', 1024)  # in MB: larger acquisitions are stored on disk
     _fps = 20
 
     # signals
@@ -108,6 +136,13 @@ class CameraLogic(GenericLogic):
         super().__init__(config=config, **kwargs)
 
         self.threadpool = QtCore.QThreadPool()
+        # separate threadpool for the background saving so that the live display is not blocked by a long save
+        self.save_threadpool = QtCore.QThreadPool()
+        self._save_queue_slots = None
+        self._containers = {}  # open h5 containers (ChunkedDatasetWriter instances), indexed by path
+        self._acquisition_frames = 0  # number of frames of the acquisitions started by a task (0: no task running)
+        self._memmap_files = {}  # files of the memory-mapped acquisition buffers: number of pending background saves
+        self._memmap_lock = Mutex()
 
         # uncomment if needed:
         # self.threadlock = Mutex()
@@ -129,6 +164,10 @@ class CameraLogic(GenericLogic):
         self.get_gain()
         self.get_temperature()
 
+        # background saving: a slot is taken for each data set handed over and released when it is written
+        self.save_threadpool.setMaxThreadCount(max(1, self._save_threads))
+        self._save_queue_slots = QtCore.QSemaphore(max(1, self._save_queue_size))
+
         # timer is used for refreshing the display of the camera image at rate fps
         # self.timer = QtCore.QTimer()
         # self.timer.setSingleShot(True)
@@ -136,7 +175,9 @@ class CameraLogic(GenericLogic):
 
     def on_deactivate(self):
         """ Perform required deactivation. """
-        pass
+        self.flush()
+        self.close_dataset_container()
+        self.release_acquisition_buffers()
 
     def get_name(self):
         name = self._hardware.get_name()
@@ -258,9 +299,13 @@ class CameraLogic(GenericLogic):
     # make these interface functions and remove the low level functions instead
     def prepare_camera_for_multichannel_imaging(self, frames, exposure, gain, save_path, file_format):
         self._hardware.prepare_camera_for_multichannel_imaging(frames, exposure, gain, save_path, file_format)
+        # without save_path, the data is retrieved using get_acquired_data and may be stored in a memory-mapped buffer
+        self._acquisition_frames = frames if save_path is None else 0
 
     def reset_camera_after_multichannel_imaging(self):
         self._hardware.reset_camera_after_multichannel_imaging()
+        self._acquisition_frames = 0
+        self.release_acquisition_buffers()
 
     def get_progress(self):
         return self._hardware.get_progress()
@@ -272,6 +317,8 @@ class CameraLogic(GenericLogic):
         self._hardware.stop_acquisition()
 
     def start_acquisition(self):
+        if self._acquisition_frames > 1:
+            self.create_acquisition_buffer(self._acquisition_frames)
         self._hardware._start_acquisition()
         
     def abort_acquisition(self):
@@ -405,11 +452,11 @@ class CameraLogic(GenericLogic):
             image_data = self._last_image
 
             complete_path = self._create_generic_filename(path, '_Image', 'image', fileformat, addfile=False)
-            self._save_to_tiff(1, complete_path, image_data)
+            self._save_to_tiff(1, complete_path, image_data, metadata)
             self._save_metadata_txt_file(path, '_Image', metadata)
 
 
-    def save_video(self, filenamestem, fileformat, n_frames, display, metadata, emit_signal=True):
+    def save_video(self, filenamestem, fileformat, n_frames, display, metadata, emit_signal=True, streaming=None):
         """ Saves n_frames to disk as a tiff stack
 
         @param: str filenamestem, such as /home/barho/images/2020-12-16/samplename
@@ -420,7 +467,15 @@ class CameraLogic(GenericLogic):
         @param: bool emit_signal: can be set to false to avoid sending the signal for gui interaction,
                 for example when function is called from ipython console or in a task
                 #leave the default value True when function is called from gui
+        @param: bool streaming: if True, the frames are written to disk while the movie is acquired instead of
+                retrieving all frames at the end. None: use the value of the config option stream_video
         """
+        if streaming is None:
+            streaming = self._stream_video
+        if fileformat not in ['.tiff', '.fits']:
+            self.log.info(f'Your fileformat {fileformat} is currently not covered')
+            streaming = False
+
         if self.enabled:  # live mode is on
             # self.timer.stop()  # display is handled differently during video saving
             self._hardware.stop_acquisition()
@@ -431,28 +486,36 @@ class CameraLogic(GenericLogic):
         n_proxy = int(250/(self._exposure*1000))  # the factor 250 is chosen arbitrarily to give a reasonable number
         # of displayed images (every 5th for an exposure time of 50 ms for example)
         n_proxy = max(1, n_proxy)  # if n_proxy is less than 1 (long exposure time), display every image
+        complete_path = self._create_generic_filename(filenamestem, '_Movie', 'movie', fileformat, addfile=False)
+
+        if not streaming:
+            self.create_acquisition_buffer(n_frames)
         err = self._hardware.start_movie_acquisition(n_frames)
         if not err:
             self.log.warning('Video acquisition did not start')
-            
-        ready = self._hardware.get_ready_state()
-        while not ready:
-            progress = self._hardware.get_progress()
-            self.sigProgress.emit(progress)
-            ready = self._hardware.get_ready_state()
-            if display:
-                if progress % n_proxy == 0:  # to limit the number of displayed images 
-                    self._last_image = self._hardware.get_most_recent_image()
-                    self.sigUpdateDisplay.emit()
-                    # sleep(0.0001)  # this is used to force enough time for a signal to be transmitted. maybe there
-                    # is a better way to do this ? not needed in case the modulo operation is used to take only every
-                    # n'th image
 
-        self._hardware.wait_until_finished()  # this is important especially if display is disabled
-        self.sigSaving.emit()  # for info message on statusbar of GUI
-        
-        image_data = self._hardware.get_acquired_data()  # first get the data before resetting the acquisition mode
-        # of the camera
+        if streaming:
+            image_data = None
+            self._stream_video_to_file(complete_path, fileformat, n_frames, display, n_proxy, metadata)
+        else:
+            ready = self._hardware.get_ready_state()
+            while not ready:
+                progress = self._hardware.get_progress()
+                self.sigProgress.emit(progress)
+                ready = self._hardware.get_ready_state()
+                if display:
+                    if progress % n_proxy == 0:  # to limit the number of displayed images
+                        self._last_image = self._hardware.get_most_recent_image()
+                        self.sigUpdateDisplay.emit()
+                        # sleep(0.0001)  # this is used to force enough time for a signal to be transmitted. maybe there
+                        # is a better way to do this ? not needed in case the modulo operation is used to take only every
+                        # n'th image
+
+            self._hardware.wait_until_finished()  # this is important especially if display is disabled
+            self.sigSaving.emit()  # for info message on statusbar of GUI
+
+            image_data = self._hardware.get_acquired_data()  # first get the data before resetting the acquisition mode
+            # of the camera
         self._hardware.finish_movie_acquisition()  # reset the attributes and the default acquisition mode
         self.saving = False
 
@@ -461,22 +524,73 @@ class CameraLogic(GenericLogic):
             self.start_loop()
 
         # data handling
-        complete_path = self._create_generic_filename(filenamestem, '_Movie', 'movie', fileformat, addfile=False)
-        # create the PIL.Image object and save it to tiff
         if fileformat == '.tiff':
-            self._save_to_tiff(n_frames, complete_path, image_data)
+            if not streaming:
+                self._save_to_tiff(n_frames, complete_path, image_data, metadata)
             self._save_metadata_txt_file(filenamestem, '_Movie', metadata)
-
         elif fileformat == '.fits':
-            fits_metadata = self.convert_to_fits_metadata(metadata)
-            self._save_to_fits(complete_path, image_data, fits_metadata)
-        else:
-            self.log.info(f'Your fileformat {fileformat} is currently not covered')
+            if not streaming:
+                fits_metadata = self.convert_to_fits_metadata(metadata)
+                self._save_to_fits(complete_path, image_data, fits_metadata)
+        image_data = None
+        self.release_acquisition_buffers()
         if emit_signal:
             self.sigVideoSavingFinished.emit()
         else:  # needed to clean up the info on statusbar when gui is opened without calling video_saving_finished
             self.sigCleanStatusbar.emit()
 
+    def _stream_video_to_file(self, path, fileformat, n_frames, display, n_proxy, metadata):
+        """ helper function for save_video: retrieves the new frames from the camera while the movie is acquired and
+        appends them to the file. Only a few frames are held in memory at a time.
+
+        @param: str path: complete path of the file, including the suffix
+        @param: str fileformat: '.tiff' or '.fits'
+        @param: int n_frames: number of frames of the movie
+        @param: bool display: show images on live display on gui
+        @param: int n_proxy: display every n_proxy'th frame
+        @param: dict metadata: meta information, written to the header in case of fits format
+        """
+        width, height = self._hardware.get_size()
+        if fileformat == '.fits':
+            writer = FitsWriter(path, n_frames, height, width, self.convert_to_fits_metadata(metadata))
+        else:
+            writer = TiffWriter(path, expected_size=n_frames * width * height * 2, metadata=metadata)
+
+        try:
+            ready = False
+            while not ready:
+                # check the state before retrieving the frames, so that the frames acquired in the meantime are not lost
+                ready = self._hardware.get_ready_state()
+                progress = self._hardware.get_progress()
+                self.sigProgress.emit(progress)
+                frames = self._hardware.get_new_frames()
+                if frames is None:
+                    self.log.warning('Camera does not support streaming. No frames saved')
+                    break
+                if len(frames) > 0:
+                    n_before = writer.n_frames
+                    writer.write(frames)
+                    # display the newest frame if a multiple of n_proxy was reached with this block of frames
+                    if display and (writer.n_frames // n_proxy > n_before // n_proxy):
+                        self._last_image = frames[-1]
+                        self.sigUpdateDisplay.emit()
+                else:
+                    sleep(0.001)
+
+            self._hardware.wait_until_finished()
+            self.sigSaving.emit()  # for info message on statusbar of GUI
+            frames = self._hardware.get_new_frames()  # remaining frames
+            while frames is not None and len(frames) > 0:
+                writer.write(frames)
+                frames = self._hardware.get_new_frames()
+        finally:
+            n_saved = writer.n_frames  # before closing, as the fits writer fills up missing frames with zeros
+            writer.close()
+
+        if n_saved < n_frames:
+            self.log.warning(f'Only {n_saved} of {n_frames} frames saved to file {path}')
+        else:
+            self.log.info('Saved data to file {}'.format(path))
 
     # this function is specific for andor ixon ultra camera
     def do_spooling(self, filenamestem, fileformat, n_frames, display, metadata):
@@ -594,73 +708,226 @@ class CameraLogic(GenericLogic):
         complete_path = os.path.join(path, filename)
         return complete_path
 
-    def _save_to_tiff(self, n_frames, path, data):
-        """ helper function to save the image data to a tiff file
+    def _save_to_tiff(self, n_frames, path, data, metadata=None):
+        """ helper function to save the image data to a 16 bit (multi-page) tiff file
 
-        creates the PIL.Image object and saves it to tiff
+        The frames are written directly from the numpy array. The BigTIFF format is used if the file exceeds 4 GB.
 
-        @params int n_frames: number of frames (needed to distinguish between 2D and 3D data)
+        @params int n_frames: number of frames (kept for compatibility, the number of frames is given by the data)
         @params str path: complete path where the object is saved to (including the suffix .tiff)
-        @params data: np.array
+        @params data: np.array (2D or 3D, z stack as first dimension). The data is saved as unsigned 16 bit integers.
+        @params dict metadata: optional, written to the image description of the first page
 
         @returns None
         """
-        # type conversion to int16
-        data = data.astype('int16')
-        # self.log.info('type conversion called')
-        # 2D data case (no stack)
-        if n_frames == 1:
-            try:
-                self.save_u16_to_tiff(data, (data.shape[1], data.shape[0]), path)
-                self.log.info('Saved data to file {}'.format(path))
-            except:
-                self.log.warning('Data not saved')
-            return None
+        try:
+            with TiffWriter(path, expected_size=np.size(data) * 2, metadata=metadata) as writer:
+                writer.write(data)
+            self.log.info('Saved data to file {}'.format(path))
+        except Exception as e:
+            self.log.warning(f'Data not saved: {e}')
 
-        # 3D data (note: z stack is the first dimension)
-        else:
+    def create_acquisition_buffer(self, n_frames):
+        """ Create a disk-resident buffer (numpy.memmap) for the next acquisition, if a memmap_directory is configured
+        and the size of the acquisition exceeds memmap_threshold. The camera stores the frames directly in this
+        buffer, which is returned by get_acquired_data. The size of an acquisition is hence limited by the disk space
+        instead of the memory. The save functions write the data from the buffer frame by frame.
+
+        @params int n_frames: number of frames of the acquisition
+
+        @returns numpy.memmap: buffer of shape (n_frames, height, width), or None if the data is stored in memory
+        """
+        self._delete_acquisition_buffers()  # the buffers of the previous acquisitions which are saved
+        buffer = None
+        width, height = self._hardware.get_size()
+        if self._memmap_directory is not None and n_frames > 1 \
+                and n_frames * width * height * 2 > self._memmap_threshold * 2**20:
             try:
-                size = (data.shape[2], data.shape[1])
-                self.save_u16_to_tiff_stack(n_frames, data, size, path)
-                self.log.info('Saved data to file {}'.format(path))
-            except:
-                self.log.warning('Data not saved')
-            return None
+                os.makedirs(self._memmap_directory, exist_ok=True)
+                handle, path = tempfile.mkstemp(suffix='.dat', prefix='acquisition_', dir=self._memmap_directory)
+                os.close(handle)
+                buffer = np.memmap(path, dtype=np.uint16, mode='w+', shape=(n_frames, height, width))
+                with self._memmap_lock:
+                    self._memmap_files[os.path.abspath(path)] = 0
+            except Exception as e:
+                self.log.warning(f'Could not create a memory-mapped acquisition buffer, data is stored in memory: {e}')
+        self._hardware.set_acquisition_buffer(buffer)
+        return buffer
 
-    def save_u16_to_tiff(self, u16int, size, tiff_filename):
+    def release_acquisition_buffers(self):
+        """ Wait until the queued data is saved and delete the files of the memory-mapped acquisition buffers.
+        The arrays returned by get_acquired_data for these acquisitions must not be used anymore.
         """
-        function found at https://blog.itsayellow.com/technical/saving-16-bit-tiff-images-with-pillow-in-python/#
-        Since Pillow has poor support for 16-bit TIFF, we make our own save function to properly save a 16-bit TIFF.
+        self.flush()
+        self._hardware.set_acquisition_buffer(None)
+        self._delete_acquisition_buffers()
+
+    def _delete_acquisition_buffers(self):
+        """ Delete the files of the memory-mapped buffers which are not waiting for a background save. Files which are
+        still in use (on windows, as long as an array refers to the file) are deleted at a later call. """
+        with self._memmap_lock:
+            for path, pending_saves in list(self._memmap_files.items()):
+                if pending_saves > 0:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                del self._memmap_files[path]
+
+    def _save_buffer(self, save_function, buffer_path, *args):
+        """ helper function for save_async: call the save function and decrement the number of pending saves of the
+        memory-mapped buffer, so that its file can be deleted
+
+        @params save_function: _save_to_tiff, _save_to_fits or _save_to_container
+        @params str buffer_path: file of the memory-mapped buffer containing the data
+        @params args: arguments of the save function
+        """
+        try:
+            save_function(*args)
+        finally:
+            with self._memmap_lock:
+                self._memmap_files[buffer_path] -= 1
+
+    def save_async(self, path, data, metadata=None, file_format='tiff', cycle=0, roi=0, z_positions=None,
+                   frame_metadata=None):
+        """ Hand the image data over to the background save queue and return without waiting for the data to be written.
+
+        If the queue is full, the call blocks until a data set in the queue is written (backpressure), so that the
+        memory used by the queued data is limited. A single frame (2D array) is copied, since it may be the reusable
+        buffer of the camera driver, overwritten by the next image. A stack (3D array) is not copied: it must not be
+        modified by the caller after the call. Use flush to wait until all data is saved.
+
+        @params str path: complete path where the object is saved to (including the suffix .tiff, .fits or .h5).
+                          For the h5 format, the container must have been opened using open_dataset_container.
+        @params data: np.array (2D or 3D, z stack as first dimension)
+        @params dict metadata: tiff: optional, written to the image description of the first page,
+                               fits: fits compatible header entries, h5: optional, attributes of the stack
+        @params str file_format: 'tiff', 'fits' or 'h5'
+        @params int cycle: h5 only: index of the stack on the cycle axis of the container
+        @params int roi: h5 only: index of the stack on the roi axis of the container
+        @params tuple z_positions: h5 only: optional, lists of the target and measured z positions of the planes
+        @params frame_metadata: optional, numpy structured array with per-frame records (see
+                                logic.frame_metadata.FrameMetadataRecorder). tiff and fits: saved next to the image
+                                file as <filename>_frame_metadata.npy, h5: written to the container
 
-        modified version for numpy array only
+        @returns None
+        """
+        if frame_metadata is not None and file_format != 'h5':
+            self._save_frame_metadata(path, frame_metadata)  # a few kB only, written directly
+        if np.ndim(data) == 2 and not isinstance(data, np.memmap):
+            data = np.array(data)  # a single frame is small, copy it so that the camera can reuse its buffer
+        if file_format == 'fits':
+            save_function, args = self._save_to_fits, (path, data, metadata if metadata is not None else {})
+        elif file_format == 'h5':
+            save_function, args = self._save_to_container, (path, data, cycle, roi, metadata, z_positions,
+                                                            frame_metadata)
+        else:  # use tiff as default format
+            n_frames = data.shape[0] if np.ndim(data) == 3 else 1
+            save_function, args = self._save_to_tiff, (n_frames, path, data, metadata)
+        if isinstance(data, np.memmap) and data.filename is not None:
+            buffer_path = os.path.abspath(data.filename)
+            with self._memmap_lock:
+                if buffer_path in self._memmap_files:
+                    # the buffer file can be deleted as soon as the data is saved
+                    self._memmap_files[buffer_path] += 1
+                    save_function, args = self._save_buffer, (save_function, buffer_path) + args
+        self._save_queue_slots.acquire()
+        worker = SaveWorker(save_function, args, self._save_queue_slots)
+        self.save_threadpool.start(worker)
+
+    def flush(self, timeout=None):
+        """ Wait until all data sets handed over to save_async are written.
+
+        @params float timeout: optional, maximum waiting time in seconds. Wait without limit if None.
+
+        @returns bool: True if all data is saved, False if the timeout occurred
+        """
+        msecs = -1 if timeout is None else int(timeout * 1000)
+        done = self.save_threadpool.waitForDone(msecs)
+        if not done:
+            self.log.warning('Background saving not finished after {} s'.format(timeout))
+        return done
+
+    def open_dataset_container(self, path, n_z, n_channels, roi_names=None, cycle_names=None, channel_names=None,
+                               attributes=None):
+        """ Open (or create) a chunked h5 container in which all stacks of an experiment are saved,
+        using save_async with file_format 'h5'. See logic.image_writers.ChunkedDatasetWriter for the layout.
+
+        @params str path: complete path of the container, including the suffix .h5
+        @params int n_z: number of planes per stack
+        @params int n_channels: number of channels per plane
+        @params list roi_names: optional, names of the rois
+        @params list cycle_names: optional, names of the cycles (e.g. probes)
+        @params list channel_names: optional, names of the channels (e.g. laser lines)
+        @params dict attributes: optional, experiment metadata
 
-        @param u16int: np.array with dtype int16 to be saved as tiff. make sure that the data is in int16 format !
-        otherwise the conversion to bytes will not give the right result
-        @param size: size of the data
-        @param str tiff_filename: including the suffix '.tiff'
+        @returns None
         """
-        # write 16-bit TIFF image
-        # PIL interprets mode 'I;16' as "uint16, little-endian"
-        img_out = Image.new('I;16', size)
-        outpil = u16int.astype(u16int.dtype.newbyteorder("<")).tobytes()
-        img_out.frombytes(outpil)
-        img_out.save(tiff_filename)
-
-    def save_u16_to_tiff_stack(self, n_frames, u16int, size, tiff_filename):
-        """ handles saving of 3D image data to 16 bit tiff stacks
-        @param int n_frames: number of frames to be saved (1st dimension of the image data)
-        @param u16int: 3D np.array with dtype int16 to be saved as tiff
-        @param int tuple size: size of an individual image in the stack (x pixel, y pixel)
-        @param str tiff_filename: complete path to the file, including the suffix .tiff """
-
-        imlist = []  # this will be a list of pillow Image objects
-        for i in range(n_frames):
-            img_out = Image.new('I;16', size)  # initialize a new pillow object of the right size
-            outpil = u16int[i].astype(
-                u16int.dtype.newbyteorder("<")).tobytes()  # convert the i-th frame to bytes object
-            img_out.frombytes(outpil)  # create pillow object from bytes
-            imlist.append(img_out)  # create the list of pillow image objects
-        imlist[0].save(tiff_filename, save_all=True, append_images=imlist[1:])
+        if path in self._containers:
+            self.close_dataset_container(path)
+        try:
+            self._containers[path] = ChunkedDatasetWriter(path, n_z, n_channels, roi_names, cycle_names, channel_names,
+                                                          compression=self._dataset_compression,
+                                                          attributes=attributes)
+        except Exception as e:
+            self.log.error(f'Could not open the dataset container {path}: {e}')
+
+    def close_dataset_container(self, path=None):
+        """ Wait until the queued data is saved and close the container.
+
+        @params str path: complete path of the container. All open containers are closed if None.
+
+        @returns None
+        """
+        self.flush()
+        paths = list(self._containers) if path is None else [path]
+        for item in paths:
+            container = self._containers.pop(item, None)
+            if container is not None:
+                container.close()
+                self.log.info('Closed dataset container {}'.format(item))
+
+    def _save_to_container(self, path, data, cycle, roi, metadata=None, z_positions=None, frame_metadata=None):
+        """ helper function to write a stack into an open h5 container
+
+        @params str path: complete path of the container
+        @params data: np.array (3D, frames in acquisition order)
+        @params int cycle: index on the cycle axis
+        @params int roi: index on the roi axis
+        @params dict metadata: optional, attributes of the stack
+        @params tuple z_positions: optional, lists of the target and measured z positions
+        @params frame_metadata: optional, numpy structured array with per-frame records
+
+        @returns None
+        """
+        container = self._containers.get(path)
+        if container is None:
+            self.log.warning(f'Data not saved: dataset container {path} is not open')
+            return
+        z_target, z_actual = z_positions if z_positions is not None else (None, None)
+        try:
+            container.write_stack(cycle, roi, data, metadata, z_target, z_actual, frame_metadata)
+            self.log.info('Saved data to container {} (cycle {}, roi {})'.format(path, cycle, roi))
+        except Exception as e:
+            self.log.warning(f'Data not saved: {e}')
+
+    def _save_frame_metadata(self, path, frame_metadata):
+        """ helper function to save the per-frame records of a stack next to the image file
+
+        @params str path: complete path of the image file (example /home/barho/images/2020-12-16/scan.tif). The
+                          records are saved to /home/barho/images/2020-12-16/scan_frame_metadata.npy
+        @params frame_metadata: numpy structured array, see logic.frame_metadata.FRAME_METADATA_DTYPE
+
+        @returns None
+        """
+        complete_path = os.path.splitext(path)[0] + '_frame_metadata.npy'
+        try:
+            FrameMetadataRecorder.save(complete_path, frame_metadata)
+        except Exception as e:
+            self.log.warning(f'Frame metadata not saved: {e}')
 
     def _save_metadata_txt_file(self, filenamestem, type, metadata):
         """"helper function to save a txt file containing the metadata
@@ -688,7 +955,21 @@ class CameraLogic(GenericLogic):
 
         @returns None
         """
-        data = data.astype(np.int16)  # data conversion because 16 bit image shall be saved
+        if np.ndim(data) == 3:
+            # stacks are written frame by frame, they may be stored in a memory-mapped file and exceed the memory
+            if os.path.exists(path):
+                self.log.warning(f'Data not saved: file {path} already exists')
+                return
+            try:
+                with FitsWriter(path, data.shape[0], data.shape[1], data.shape[2], metadata) as writer:
+                    for frame in data:
+                        writer.write(frame)
+                self.log.info('Saved data to file {}'.format(path))
+            except Exception as e:
+                self.log.warning(f'Data not saved: {e}')
+            return
+
+        data = to_uint16(data)  # data conversion because 16 bit image shall be saved (unsigned, as the camera data)
         hdu = fits.PrimaryHDU(data)  # PrimaryHDU object encapsulates the data
         hdul = fits.HDUList([hdu])
         # add the header
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the centroid engine of the camera based autofocus (logic/autofocus_logic_camera.py).
+
+The position of the IR reflection is measured on every autofocus (PID) step and on every refresh of the live display.
+Instead of processing the full frame, the engine only looks at a small window around the last position of the
+reflection. The threshold-weighted centroid is computed in a single pass over this window (no copy of the frame),
+and the full frame is only searched when the reflection is lost or leaves the window.
+
+Example:
+    tracker = CentroidTracker(window_size=64)
+    x0, y0 = tracker.locate(image, threshold=150)
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+import numpy as np
+
+from core.util.mutex import Mutex
+
+
+def threshold_centroid(im, threshold):
+    """ Calculate the centroid of the pixels above threshold, weighted by their intensity.
+
+    The weights are computed once for the given (sub-)image, the projections are then summed with a float64
+    accumulator so that integer images can not overflow.
+
+    @param numpy.ndarray im: 2D image, or a view on a part of an image
+    @param float threshold: pixels with a value less than or equal to the threshold are ignored
+
+    @return tuple: (x0, y0, n_pixels) sub-pixel position in the coordinates of im, and number of pixels above
+                   threshold. x0 and y0 are None if no pixel is above threshold.
+    """
+    above = im > threshold
+    weights = np.where(above, im, 0)
+    im_x = weights.sum(axis=0, dtype=np.float64)  # projection along the X axis
+    total = im_x.sum()
+    n_pixels = int(np.count_nonzero(above))
+    if total == 0:
+        return None, None, n_pixels
+    im_y = weights.sum(axis=1, dtype=np.float64)  # projection along the Y axis
+    x0 = np.dot(np.arange(im_x.shape[0]), im_x) / total
+    y0 = np.dot(np.arange(im_y.shape[0]), im_y) / total
+    return x0, y0, n_pixels
+
+
+class CentroidTracker:
+    """ Tracks the centroid of a single bright spot (the IR reflection) in successive camera frames.
+
+    The window follows the spot: it is centered on the last measured position for the next frame. A full-frame search
+    is done for the first frame, when no pixel in the window is above threshold, or when the spot comes closer to the
+    border of the window than margin pixels (it may then be cut by the window). The frame size may change between two
+    calls (binning or roi of the camera), the window is then placed again using a full-frame search.
+
+    The tracker is shared by the autofocus loop and the live display, which call locate from different threads: the
+    tracking state is protected by a lock.
+    """
+
+    def __init__(self, window_size=64, margin=8):
+        """
+        @param int window_size: width and height of the tracking window in pixels (of the binned image)
+        @param int margin: minimum distance in pixels between the spot and the border of the window
+        """
+        self.window_size = window_size
+        self.margin = margin
+        self.position = None  # last (x0, y0) position in frame coordinates, None if the spot is lost
+        self.n_pixels = 0  # number of pixels above threshold in the last processed window or frame
+        self.full_frame_searches = 0  # counter, for diagnostics
+        self._frame_shape = None
+        self._lock = Mutex()
+
+    def reset(self):
+        """ Forget the last position, so that the next frame is searched completely. """
+        with self._lock:
+            self.position = None
+            self.n_pixels = 0
+
+    def locate(self, im, threshold):
+        """ Return the position of the spot in the image.
+
+        @param numpy.ndarray im: 2D image
+        @param float threshold: pixels with a value less than or equal to the threshold are ignored
+
+        @return tuple: (x0, y0) sub-pixel position in frame coordinates, or (0, 0) if no pixel is above threshold
+        """
+        with self._lock:
+            if self.position is not None and im.shape == self._frame_shape:
+                position = self._locate_in_window(im, threshold)
+                if position is not None:
+                    return position
+            return self._locate_in_frame(im, threshold)
+
+    def _locate_in_window(self, im, threshold):
+        """ Calculate the centroid inside the window centered on the last position.
+
+        @return tuple: (x0, y0), or None if a full-frame search is needed
+        """
+        height, width = im.shape
+        half = self.window_size // 2
+        x_start = min(max(int(round(self.position[0])) - half, 0), max(width - self.window_size, 0))
+        y_start = min(max(int(round(self.position[1])) - half, 0), max(height - self.window_size, 0))
+        window = im[y_start:y_start + self.window_size, x_start:x_start + self.window_size]  # view, no copy
+
+        x0, y0, n_pixels = threshold_centroid(window, threshold)
+        if x0 is None:
+            return None
+        # spot close to a border of the window which is not a border of the frame: it may be partly outside
+        if ((x0 < self.margin and x_start > 0)
+                or (x0 > window.shape[1] - 1 - self.margin and x_start + window.shape[1] < width)
+                or (y0 < self.margin and y_start > 0)
+                or (y0 > window.shape[0] - 1 - self.margin and y_start + window.shape[0] < height)):
+            return None
+        self.n_pixels = n_pixels
+        self.position = (x0 + x_start, y0 + y_start)
+        return self.position
+
+    def _locate_in_frame(self, im, threshold):
+        """ Calculate the centroid using the full frame and center the window on it.
+
+        @return tuple: (x0, y0), or (0, 0) if no pixel is above threshold
+        """
+        self.full_frame_searches += 1
+        self._frame_shape = im.shape
+        x0, y0, self.n_pixels = threshold_centroid(im, threshold)
+        if x0 is None:
+            self.position = None
+            return 0, 0
+        self.position = (x0, y0)
+        return self.position
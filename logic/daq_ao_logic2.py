@@ -78,6 +78,16 @@ class DAQaoLogic(GenericLogic):
         """
         self._daq.move_piezo(pos, autostart=True, timeout=10)
 
+    def move_piezo_trajectory(self, positions, point_time):
+        """ Move the piezo along a trajectory timed by the DAQ (see hardware move_piezo_trajectory).
+        """
+        return self._daq.move_piezo_trajectory(positions, point_time)
+
+    def run_zstack_waveforms(self, z_waveform, trigger_waveform, sample_rate):
+        """ Run the hardware-timed waveforms of a z stack (see hardware run_zstack_waveforms).
+        """
+        return self._daq.run_zstack_waveforms(z_waveform, trigger_waveform, sample_rate)
+
     def write_to_do_channel(self, num_samp, digital_write, channel):
         """ use the digital output as trigger """
         self._daq.write_to_do_channel(num_samp, digital_write, channel)
@@ -85,6 +95,15 @@ class DAQaoLogic(GenericLogic):
     def read_do_channel(self, num_samp, channel):
         return self._daq.read_do_channel(num_samp, channel)
 
+    def arm_di_edge_detection(self):
+        """ Prepare the wait for the next rising edge of the FPGA 'acquisition done' line (see hardware). """
+        self._daq.arm_di_edge_detection()
+
+    def wait_for_di_edge(self, timeout):
+        """ Block until the rising edge of the FPGA 'acquisition done' line or until timeout (in s).
+        Returns True if the edge was detected. """
+        return self._daq.wait_for_di_edge(timeout)
+
     def write_to_pump_ao_channel(self, voltage, autostart=True, timeout=10):
         self._daq.write_to_pump_ao_channel(voltage, autostart, timeout)
 
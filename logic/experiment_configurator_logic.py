@@ -46,6 +46,7 @@ class ExpConfigLogic(GenericLogic):
         supported fileformats:
             - 'tiff'
             - 'fits'
+            - 'h5'  # single chunked container per experiment (requires h5py)
         default path: '/home/barho'
         connect:
             camera_logic: 'camera_logic'
@@ -6,10 +6,13 @@ This module contains a class to control the focus of the microscope objective ca
 """
 from core.connector import Connector
 from core.configoption import ConfigOption
-# from core.util.mutex import Mutex
+from core.util.mutex import Mutex, RecursiveMutex
 from logic.generic_logic import GenericLogic
+from logic.focus_map import FocusMap
 from qtpy import QtCore
-from time import sleep
+from time import sleep, perf_counter
+from collections import deque
+import threading
 import numpy as np
 from numpy.polynomial import Polynomial as Poly
 from functools import partial
@@ -20,19 +23,90 @@ class WorkerSignals(QtCore.QObject):
     sigFinished = QtCore.Signal()
 
 
-class AutofocusWorker(QtCore.QRunnable):
-    """ Worker thread to monitor the Autofocus signal (QPD or camera) and adjust the piezo position when autofocus in ON
-    The worker handles only the waiting time, and emits a signal that serves to trigger the update indicators. """
-    def __init__(self, dt, *args, **kwargs):
-        super(AutofocusWorker, self).__init__(*args, **kwargs)
-        self.signals = WorkerSignals()
-        self.frequency = dt
+class AutofocusLoopSignals(QtCore.QObject):
+    """ Defines the signals available from the autofocus control loop. """
+    sigFinished = QtCore.Signal(str)  # reason why the loop ended: 'stopped', 'lost', 'out_of_range' or 'stable'
+
+
+class AutofocusLoopWorker(QtCore.QRunnable):
+    """ Worker thread running the autofocus control loop (reading the pid output and correcting the piezo position)
+    until the loop ends. The reason why it ended is emitted with sigFinished. """
+    def __init__(self, loop_function, *args, **kwargs):
+        super(AutofocusLoopWorker, self).__init__(*args, **kwargs)
+        self.signals = AutofocusLoopSignals()
+        self.loop_function = loop_function
 
     @QtCore.Slot()
     def run(self):
         """ """
-        sleep(self.frequency)
-        self.signals.sigFinished.emit()
+        reason = self.loop_function()
+        self.signals.sigFinished.emit(reason)
+
+
+class LoopStatistics:
+    """ Collects the timing of the last iterations of a control loop running on a fixed deadline schedule.
+
+    For each iteration are stored: the period (time since the start of the previous iteration), the jitter (delay of
+    the start of the iteration with respect to its deadline) and the actuation latency (time from the start of the
+    iteration, when the detector is read, until the piezo command is completed; only for iterations with a
+    correction).
+    """
+    def __init__(self, n_samples=1000):
+        """
+        @param int n_samples: number of iterations taken into account
+        """
+        self._lock = Mutex()
+        self._periods = deque(maxlen=n_samples)
+        self._jitters = deque(maxlen=n_samples)
+        self._latencies = deque(maxlen=n_samples)
+        self.target_period = None
+        self.iterations = 0
+        self.corrections = 0
+        self.overruns = 0
+
+    def reset(self, target_period):
+        """ Clear all values, before starting the loop with the given period (in s). """
+        with self._lock:
+            self._periods.clear()
+            self._jitters.clear()
+            self._latencies.clear()
+            self.target_period = target_period
+            self.iterations = 0
+            self.corrections = 0
+            self.overruns = 0
+
+    def add_iteration(self, period, jitter, latency=None, overrun=False):
+        """ Add the timing of an iteration (in s). The period is None for the first iteration. """
+        with self._lock:
+            self.iterations += 1
+            if period is not None:
+                self._periods.append(period)
+            self._jitters.append(jitter)
+            if latency is not None:
+                self._latencies.append(latency)
+                self.corrections += 1
+            if overrun:
+                self.overruns += 1
+
+    def get_statistics(self):
+        """ Return a summary of the collected values, in ms.
+
+        @return dict: target period, number of iterations, corrections and overruns (iterations that started more
+                      than one period late), and for period, jitter and latency: mean, std, p95 and max
+        """
+        with self._lock:
+            statistics = {'target_period_ms': self.target_period * 1000 if self.target_period is not None else None,
+                          'iterations': self.iterations,
+                          'corrections': self.corrections,
+                          'overruns': self.overruns}
+            for name, values in [('period', self._periods), ('jitter', self._jitters), ('latency', self._latencies)]:
+                values = np.array(values) * 1000
+                if len(values) == 0:
+                    statistics[name] = None
+                else:
+                    statistics[name] = {'mean_ms': float(np.mean(values)), 'std_ms': float(np.std(values)),
+                                        'p95_ms': float(np.percentile(values, 95)), 'max_ms': float(np.max(values))}
+        return statistics
 
 
 class CameraImageWorker(QtCore.QRunnable):
@@ -58,22 +132,50 @@ class FocusLogic(GenericLogic):
     focus_logic:
         module.Class: 'focus_logic.FocusLogic'
         setup: 'RAMM'
+        autofocus_loop_period: 0.05  # optional, in s. Period of the autofocus control loop (not shorter than the
+                                     # iteration time of the FPGA for the QPD based autofocus).
+                                     # Default: pid period defined by the autofocus logic
+        ramp_mode: 'hardware'  # optional, 'polled' (default) or 'hardware' (trajectory executed by the piezo hardware,
+                               # or by the daq if it is connected)
+        ramp_point_time: 0.001  # optional, in s. Time per point of the hardware-timed ramps
+        settle_tolerance: 0.02  # optional, in um. Distance to the target below which the piezo is settled
+        settle_timeout: 0.1  # optional, in s. Maximum waiting time for the piezo to settle
+        calibration_mode: 'sweep'  # optional, 'step' (default) or 'sweep' (continuous piezo sweep, needs a piezo
+                                   # supporting hardware-timed trajectories)
+        calibration_sweep_time: 0.4  # optional, in s. Duration of the calibration sweep (up and down)
+        focus_map_order: 1  # optional, maximum order (0, 1 or 2) of the surface fitted to the focus positions of
+                            # the ROIs, used to pre-position the piezo before searching the focus
+        focus_map_stage_direction: -1  # optional, 1 or -1. Sign of the piezo displacement compensating a positive
+                                       # stage z displacement (opposite sign: -1, as in the piezo position correction)
         connect:
             piezo: 'mcl'
             autofocus: 'autofocus_logic'
+            daq: 'nidaq_6259_logic'  # optional, daq driving the analog input of the piezo controller. Used for the
+                                     # hardware-timed trajectories
     """
 
     # declare connectors
     piezo = Connector(interface='MotorInterface')
     autofocus = Connector(interface='AutofocusLogic')
+    daq = Connector(interface='DAQaoLogic', optional=True)
 
     # Config options
     _setup = ConfigOption('setup', missing='error')
     _rescue_autofocus_possible = ConfigOption('rescue_autofocus_possible', False, missing='warn')
+    _autofocus_loop_period = ConfigOption('autofocus_loop_period', None)
+    _ramp_mode = ConfigOption('ramp_mode', 'polled')
+    _ramp_point_time = ConfigOption('ramp_point_time', 0.001)
+    _settle_tolerance = ConfigOption('settle_tolerance', 0.02)
+    _settle_timeout = ConfigOption('settle_timeout', 0.1)
+    _calibration_mode = ConfigOption('calibration_mode', 'step')
+    _calibration_sweep_time = ConfigOption('calibration_sweep_time', 0.4)
+    _focus_map_order = ConfigOption('focus_map_order', 1)
+    _focus_map_stage_direction = ConfigOption('focus_map_stage_direction', -1)
 
     # signals
     sigStepChanged = QtCore.Signal(float)
     sigPositionChanged = QtCore.Signal(float)
+    sigPiezoSettled = QtCore.Signal(float)  # position, emitted when the piezo has settled after a ramp
     sigPiezoInitFinished = QtCore.Signal()
     sigUpdateTimetrace = QtCore.Signal(float)
     sigPlotCalibration = QtCore.Signal(object, object, object, float, float)
@@ -88,6 +190,7 @@ class FocusLogic(GenericLogic):
     sigPiezoPositionCorrectionFinished = QtCore.Signal()
     sigDisableFocusActions = QtCore.Signal()
     sigEnableFocusActions = QtCore.Signal()
+    sigAutofocusLoopStatistics = QtCore.Signal(dict)  # emitted about once per second while autofocus is running
 
     # piezo attributes
     _step = 0.01
@@ -102,7 +205,10 @@ class FocusLogic(GenericLogic):
 
     # autofocus attributes
     _calibration_range = 2  # Autofocus calibration range in µm
+    _sweep_step = 0.01  # in µm, distance between two points of the calibration sweep trajectory
+    _sweep_min_samples = 10  # minimum number of samples needed to fit the calibration sweep
     _slope = None
+    linear_range = None  # (z_min, z_max) in µm, linear range of the autofocus signal found by the sweep calibration
     _z0 = None
     _z_new = None
     _dt = None
@@ -122,8 +228,11 @@ class FocusLogic(GenericLogic):
 
         self.threadpool = QtCore.QThreadPool()
 
-        # uncomment if needed:
-        # self.threadlock = Mutex()
+        # the piezo is commanded from the autofocus control loop and from the main thread (manual focus, timetrace)
+        self._piezo_lock = RecursiveMutex()
+        self._autofocus_loop_stop = threading.Event()
+        self.autofocus_loop_statistics = LoopStatistics()
+        self.focus_map = FocusMap(order=self._focus_map_order)
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -134,6 +243,10 @@ class FocusLogic(GenericLogic):
         self._max_step = self._piezo.get_constraints()[self._axis]['max_step']
         self._min_z = self._piezo.get_constraints()[self._axis]['pos_min']
         self._max_z = self._piezo.get_constraints()[self._axis]['pos_max']
+        self._daq = self.daq()
+        if self._ramp_mode == 'hardware' and not self.trajectory_available():
+            self.log.warning('Hardware-timed ramps are not supported by the piezo. Polled ramps are used.')
+            self._ramp_mode = 'polled'
         self.init_piezo()
 
         # initialize the autofocus class
@@ -172,7 +285,8 @@ class FocusLogic(GenericLogic):
         :param float step: target relative movement (positive value)
         :return None
         """
-        self._piezo.move_rel({self._axis: step})
+        with self._piezo_lock:
+            self._piezo.move_rel({self._axis: step})
         # the wait on target function does not really work yet. so we get the precedent position
         # because the value is read too fast..
         # possible solution is to use the stabilisation time of 30 ms but this could slow down continuous movements (button pressed down on GUI or key shortcuts)
@@ -186,7 +300,8 @@ class FocusLogic(GenericLogic):
         :param float step: target relative movement (positive value, orientation is handled in this method)
         :return None
         """
-        self._piezo.move_rel({self._axis: -step})
+        with self._piezo_lock:
+            self._piezo.move_rel({self._axis: -step})
         sleep(0.03)
         position = self.get_position()
         # self.log.debug('moved down: {0} um. New position: {1}'.format(step, position))
@@ -196,7 +311,8 @@ class FocusLogic(GenericLogic):
         """ Read the current piezo position.
         :return current piezo position
         """
-        return self._piezo.get_pos()[self._axis]
+        with self._piezo_lock:
+            return self._piezo.get_pos()[self._axis]
 
     def abort_movement(self):
         self._piezo.abort()  # this function is not yet implemented
@@ -218,22 +334,99 @@ class FocusLogic(GenericLogic):
         :param float target_pos: target position for piezo
         :return: None
         """
-        constraints = self._piezo.get_constraints()
-        step = constraints[self._axis]['max_step']
-        position = self.get_position()  # check the return format, and reformat it in case it is needed
-        while position < abs(target_pos - step) or position > abs(
-                target_pos + step):  # approach in an interval of step around the target position
-            if position > target_pos:
-                self.move_down(step)
+        if self._ramp_mode == 'hardware':
+            if self.hardware_piezo_ramp(target_pos):
+                return
+            self.log.warning('Hardware-timed ramp failed. Using the polled ramp.')
+
+        with self._piezo_lock:  # the complete ramp, so that no other command is interleaved
+            constraints = self._piezo.get_constraints()
+            step = constraints[self._axis]['max_step']
+            position = self.get_position()  # check the return format, and reformat it in case it is needed
+            while position < abs(target_pos - step) or position > abs(
+                    target_pos + step):  # approach in an interval of step around the target position
+                if position > target_pos:
+                    self.move_down(step)
+                else:
+                    self.move_up(step)
+                position = self.get_position()
+
+            last_step = target_pos - position
+            if last_step > 0:
+                self.move_up(last_step)
             else:
-                self.move_up(step)
-            position = self.get_position()
+                self.move_down(-last_step)
 
-        last_step = target_pos - position
-        if last_step > 0:
-            self.move_up(last_step)
-        else:
-            self.move_down(-last_step)
+    def hardware_piezo_ramp(self, target_pos):
+        """ Go to target_pos using a trajectory computed in advance (steps <= max step) and executed by the piezo
+        hardware in a single call, then wait until the piezo has settled.
+        :param float target_pos: target position for piezo
+        :return bool: True if the trajectory was executed, False if the hardware refused it
+        """
+        with self._piezo_lock:
+            trajectory = self.compute_ramp(self.get_position(), target_pos, self._max_step)
+            if not self.run_trajectory(trajectory, self._ramp_point_time):
+                return False
+            self.wait_for_settled(target_pos)
+        return True
+
+    def trajectory_hardware_timed(self):
+        """ Check if the trajectories are timed by the hardware (daq sample clock or piezo controller), as opposed to
+        a trajectory paced by the computer (one command per position).
+        :return bool: True if the trajectories are hardware-timed
+        """
+        return self._daq is not None or getattr(self._piezo, 'hardware_timed_trajectory', False)
+
+    def trajectory_available(self):
+        """ Check if trajectories can be executed in a single call, by the daq (if connected) or by the piezo.
+        :return bool: True if run_trajectory can be used
+        """
+        return self._daq is not None or hasattr(self._piezo, 'run_trajectory')
+
+    def run_trajectory(self, trajectory, point_time):
+        """ Execute a trajectory in a single call. The daq (if connected) outputs the trajectory as a waveform timed by
+        its sample clock, otherwise the trajectory is executed by the piezo controller.
+        :param np.ndarray trajectory: successive piezo positions in um
+        :param float point_time: time per position in s
+        :return bool: True if the trajectory was executed
+        """
+        if self._daq is not None:
+            return self._daq.move_piezo_trajectory(trajectory, point_time)
+        return self._piezo.run_trajectory(self._axis, trajectory, point_time)
+
+    @staticmethod
+    def compute_ramp(start_pos, target_pos, max_step):
+        """ Compute the positions of a ramp from start_pos to target_pos, with equal steps not larger than max_step.
+        :param float start_pos: current position
+        :param float target_pos: last position of the ramp
+        :param float max_step: maximum step between two positions
+        :return: np.ndarray positions (the start position is not included)
+        """
+        n_steps = max(int(np.ceil(np.round(abs(target_pos - start_pos) / max_step, decimals=6))), 1)
+        return start_pos + (target_pos - start_pos) * np.arange(1, n_steps + 1) / n_steps
+
+    def wait_for_settled(self, target_pos, tolerance=None, timeout=None):
+        """ Wait until the piezo position is within tolerance of target_pos (instead of a fixed waiting time), and
+        emit sigPiezoSettled.
+        :param float target_pos: target position
+        :param float tolerance: optional, in um. Default: settle_tolerance from the config
+        :param float timeout: optional, in s. Default: settle_timeout from the config
+        :return bool: True if settled, False if the timeout occurred
+        """
+        tolerance = self._settle_tolerance if tolerance is None else tolerance
+        timeout = self._settle_timeout if timeout is None else timeout
+        start = perf_counter()
+        position = self.get_position()
+        while abs(position - target_pos) > tolerance:
+            if perf_counter() - start > timeout:
+                self.log.debug(f'piezo not settled after {timeout} s: position {position} um, target {target_pos} um')
+                self.sigPositionChanged.emit(position)
+                return False
+            sleep(0.001)
+            position = self.get_position()
+        self.sigPiezoSettled.emit(position)
+        self.sigPositionChanged.emit(position)
+        return True
 
 # ==============================================================
 # methods for timetrace of piezo position (timetrace dockwidget)
@@ -277,8 +470,8 @@ class FocusLogic(GenericLogic):
         """
         im = self._autofocus_logic.get_latest_image()
         if self._setup == "PALM":
+            x, y = self._autofocus_logic.calculate_centroid(im)
             mask = self._autofocus_logic.calculate_threshold_image(im)
-            x, y = self._autofocus_logic.calculate_centroid(im, mask)
             self.sigDisplayImageAndMask.emit(im, mask, x, y)
         elif self._setup == "RAMM":
             self.sigDisplayImage.emit(im)
@@ -310,6 +503,12 @@ class FocusLogic(GenericLogic):
         """ Calibrate the focus stabilization by performing a quick 2 µm ramp with the piezo and measuring the
         autofocus signal (either camera or QPD) for each position.
         """
+        if self._calibration_mode == 'sweep':
+            if self.trajectory_hardware_timed():
+                self.calibrate_focus_stabilization_sweep()
+                return
+            self.log.warning('Sweep calibration needs hardware-timed trajectories. Step calibration is used.')
+
         if self._setup == 'PALM' and not self.live_display_enabled:
             self._autofocus_logic.start_camera_live()
 
@@ -355,6 +554,119 @@ class FocusLogic(GenericLogic):
         if self._setup == 'PALM' and not self.live_display_enabled:
             self._autofocus_logic.stop_camera_live()
 
+    def calibrate_focus_stabilization_sweep(self):
+        """ Calibrate the focus stabilization using one continuous piezo sweep (from z0 - 1 µm to z0 + 1 µm and back)
+        executed by the piezo hardware, while the autofocus signal is read as fast as possible with timestamps. The
+        trajectory must be timed by the hardware (daq or piezo controller), see trajectory_hardware_timed.
+
+        The piezo position of each sample is interpolated on the trajectory from its timestamp, the time axis being
+        scaled to the measured start and end of the trajectory. Sweeping up and down
+        compensates the delay between command and position. The slope and the linear range of the signal are fitted
+        on this synchronized stream, and the precision is estimated from the residuals of the linear fit, so that no
+        additional measurement at a fixed position is needed.
+        """
+        if self._setup == 'PALM' and not self.live_display_enabled:
+            self._autofocus_logic.start_camera_live()
+
+        z0 = self.get_position()
+        dz = self._calibration_range / 2
+        self.go_to_position(z0 - dz)
+        self.wait_for_settled(z0 - dz)
+
+        # triangle trajectory, executed in a separate thread while the detector is read in this thread
+        up = self.compute_ramp(z0 - dz, z0 + dz, self._sweep_step)
+        down = self.compute_ramp(z0 + dz, z0 - dz, self._sweep_step)
+        trajectory = np.concatenate((up, down))
+        point_time = self._calibration_sweep_time / len(trajectory)
+        sweep_times = []
+        sweep_result = []
+
+        def sweep():
+            with self._piezo_lock:
+                sweep_times.append(perf_counter())
+                try:
+                    sweep_result.append(self.run_trajectory(trajectory, point_time))
+                except Exception:
+                    self.log.exception('Error during the calibration sweep:')
+                    sweep_result.append(False)
+                sweep_times.append(perf_counter())
+
+        thread = threading.Thread(target=sweep)
+        timestamps = []
+        autofocus_signal = []
+        thread.start()
+        while thread.is_alive():
+            autofocus_signal.append(self.read_detector_signal())
+            timestamps.append(perf_counter())
+        thread.join()
+
+        if not sweep_result or not sweep_result[0]:
+            self.log.error('Sweep calibration aborted: the piezo did not execute the trajectory.')
+            self._finish_sweep_calibration(z0)
+            return
+
+        # position of the piezo for each sample. The time axis is scaled so that the trajectory spans the measured
+        # duration of the call, samples before the start and after the end of the trajectory are dropped
+        duration = len(trajectory) * point_time
+        timestamps = (np.array(timestamps) - sweep_times[0]) * duration / (sweep_times[1] - sweep_times[0])
+        autofocus_signal = np.array(autofocus_signal)
+        valid = (timestamps >= 0) & (timestamps <= duration)
+        piezo_position = np.interp(timestamps[valid], np.arange(1, len(trajectory) + 1) * point_time, trajectory,
+                                   left=z0 - dz)
+        autofocus_signal = autofocus_signal[valid]
+        if len(autofocus_signal) < self._sweep_min_samples:
+            self.log.error(f'Sweep calibration aborted: only {len(autofocus_signal)} samples were acquired during '
+                           f'the sweep.')
+            self._finish_sweep_calibration(z0)
+            return
+
+        # linear range: where the derivative of a cubic fit stays within 20% of its value at z0
+        cubic = Poly.fit(piezo_position, autofocus_signal, deg=3)
+        slope_z0 = cubic.deriv()(z0)
+        if not np.isfinite(slope_z0) or np.abs(slope_z0) * 2 * dz <= 0.01 * np.ptp(autofocus_signal):
+            self.log.error('Sweep calibration aborted: the autofocus signal does not depend on the piezo position '
+                           'around the current position.')
+            self._finish_sweep_calibration(z0)
+            return
+        z = np.linspace(z0 - dz, z0 + dz, 201)
+        derivative = cubic.deriv()(z) / slope_z0
+        linear = np.abs(derivative - 1) < 0.2
+        center = np.argmin(np.abs(z - z0))
+        low = center - np.argmin(linear[center::-1]) + 1 if not linear[:center + 1].all() else 0
+        high = center + np.argmin(linear[center:]) - 1 if not linear[center:].all() else len(z) - 1
+        self.linear_range = (z[low], z[high])
+
+        in_range = (piezo_position >= z[low]) & (piezo_position <= z[high])
+        if np.count_nonzero(in_range) < self._sweep_min_samples:
+            self.log.error(f'Sweep calibration aborted: only {np.count_nonzero(in_range)} samples in the linear range '
+                           f'{self.linear_range[0]:.2f} - {self.linear_range[1]:.2f} um.')
+            self._finish_sweep_calibration(z0)
+            return
+        p = Poly.fit(piezo_position[in_range], autofocus_signal[in_range], deg=1)
+        self._slope = p(1) - p(0)
+        self._calibrated = True
+        residuals = autofocus_signal[in_range] - p(piezo_position[in_range])
+        precision = np.std(residuals) * 2*np.sqrt(2*np.log(2))  # the FWHM
+
+        order = np.argsort(piezo_position)
+        self.sigPlotCalibration.emit(piezo_position[order], autofocus_signal[order], p(piezo_position[order]),
+                                     self._slope, precision)
+        self.log.info(f'Sweep calibration: {len(autofocus_signal)} samples, slope {self._slope:.3f}, linear range '
+                      f'{self.linear_range[0]:.2f} - {self.linear_range[1]:.2f} um')
+        self._finish_sweep_calibration(z0)
+
+    def _finish_sweep_calibration(self, z0):
+        """ Bring the piezo back to its initial position after a sweep calibration and stop the camera live if it
+        was only started for the calibration.
+
+        :param: float z0: initial piezo position
+        """
+        self.go_to_position(z0)
+        self.wait_for_settled(z0)
+
+        if self._setup == 'PALM' and not self.live_display_enabled:
+            self._autofocus_logic.stop_camera_live()
+
     def define_autofocus_setpoint(self):
         """ From the present piezo position, read the detector signal and keep the value as reference for the pid
         """
@@ -408,80 +720,131 @@ class FocusLogic(GenericLogic):
         if self._setup == 'PALM' and not self.live_display_enabled:
             self._autofocus_logic.start_camera_live()
 
-        self._autofocus_logic.init_pid()
+        self._autofocus_logic.init_pid(self._autofocus_loop_period)
         self._z0 = self.get_position()
         self._z_new = self._z0  # do we need this ?
-        self._dt = self._autofocus_logic._pid_frequency
-
-        worker = AutofocusWorker(self._dt)
-        worker.signals.sigFinished.connect(partial(self.run_autofocus, stop_when_stable=stop_when_stable, search_focus=search_focus))
+        self._dt = self._autofocus_logic.get_pid_period()
+
+        # a single worker runs the control loop until autofocus is stopped, lost or stable
+        self._autofocus_loop_stop = threading.Event()
+        worker = AutofocusLoopWorker(partial(self.run_autofocus, stop_when_stable, search_focus,
+                                             self._autofocus_loop_stop))
+        worker.signals.sigFinished.connect(partial(self.autofocus_loop_finished, stop_when_stable=stop_when_stable,
+                                                   search_focus=search_focus))
         self.threadpool.start(worker)
 
-    def run_autofocus(self, stop_when_stable, search_focus):
-        """ Based on the pid output, the position of the piezo is corrected in real time. In order to avoid
-        unnecessary movement of the piezo, the corrections are only applied when an absolute displacement >100nm is
-        required.
-        """
-        self.check_autofocus()  # updates self._autofocus_lost
+    def run_autofocus(self, stop_when_stable, search_focus, stop_event):
+        """ Control loop of the autofocus, running in a worker thread. Based on the pid output, the position of the
+        piezo is corrected in real time. In order to avoid unnecessary movement of the piezo, the corrections are only
+        applied when an absolute displacement >100nm is required.
 
-        if self.autofocus_enabled:
+        The iterations start on a fixed deadline schedule (one deadline every self._dt seconds). If an iteration takes
+        longer than a period, the missed deadlines are skipped (and counted as overrun). The timing of the iterations
+        is collected in self.autofocus_loop_statistics.
 
+        @param bool stop_when_stable: end the loop when the focus is stable
+        @param bool search_focus: not used in the loop, see autofocus_loop_finished
+        @param threading.Event stop_event: set by stop_autofocus to end the loop
+
+        @return str: reason why the loop ended: 'stopped', 'lost', 'out_of_range' or 'stable'
+        """
+        statistics = self.autofocus_loop_statistics
+        statistics.reset(self._dt)
+        start = perf_counter()
+        deadline = start + self._dt
+        last_iteration = None
+        last_publication = start
+
+        while True:
+            # wait for the next deadline
+            remaining = deadline - perf_counter()
+            if remaining > 0 and stop_event.wait(remaining):
+                return 'stopped'
+            if stop_event.is_set() or not self.autofocus_enabled:
+                return 'stopped'
+
+            iteration_start = perf_counter()
+            jitter = iteration_start - deadline
+            period = iteration_start - last_iteration if last_iteration is not None else None
+            last_iteration = iteration_start
+            overrun = jitter > self._dt
+            deadline += self._dt * (1 + int(jitter // self._dt) if overrun else 1)
+
+            self.check_autofocus()  # updates self._autofocus_lost
             if self._autofocus_lost:
-                self.log.warning('autofocus lost! in run_autofocus')
-                if self.rescue:
-                    # to verify: add here stop autofocus ?
-                    success = self.rescue_autofocus()
-                    if success:
-                        self.start_autofocus(stop_when_stable=stop_when_stable, search_focus=search_focus)
-                        return
-                    else:
-                        self.autofocus_enabled = False
-                        self.log.warning('autofocus signal not found during rescue autofocus')
-                        self.sigAutofocusError.emit()
-                        return
-                else:
-                    self.autofocus_enabled = False
-                    self.sigAutofocusError.emit()
-                    return
+                return 'lost'
 
             if stop_when_stable:
                 pid, stable = self._autofocus_logic.read_pid_output(True)
                 if stable:
-                    self.log.info('focus is stable')
-                    self.autofocus_enabled = False
-                    self.sigAutofocusStopped.emit()
-                    if search_focus:
-                        self.search_focus_finished()
-                    return
+                    return 'stable'
             else:
                 pid = self._autofocus_logic.read_pid_output(False)
 
             # calculate the necessary movement of piezo dz
             z = self._z0 + pid / self._slope
-            # print(f'z position {z}')
+            if not self._min_z + 1 < z < self._max_z - 1:
+                return 'out_of_range'
 
+            latency = None
             dz = np.absolute(self.get_position() - z)
+            if dz > 0.1:
+                self.go_to_position(z)
+                latency = perf_counter() - iteration_start
+            statistics.add_iteration(period, jitter, latency, overrun)
 
-            if self._min_z + 1 < z < self._max_z - 1:
-                if dz > 0.1:
-                    self.go_to_position(z)
-                else:
-                    pass
+            if iteration_start - last_publication > 1:
+                last_publication = iteration_start
+                self.sigAutofocusLoopStatistics.emit(statistics.get_statistics())
 
+    def autofocus_loop_finished(self, reason, stop_when_stable, search_focus):
+        """ Handle the end of the autofocus control loop (in the main thread).
+
+        @param str reason: 'stopped', 'lost', 'out_of_range' or 'stable'
+        @param bool stop_when_stable: parameter of start_autofocus, used when autofocus is restarted after rescue
+        @param bool search_focus: the loop was started by start_search_focus
+        """
+        self.sigAutofocusLoopStatistics.emit(self.autofocus_loop_statistics.get_statistics())
+
+        if reason == 'lost':
+            self.log.warning('autofocus lost! in run_autofocus')
+            if self.rescue:
+                # to verify: add here stop autofocus ?
+                success = self.rescue_autofocus()
+                if success:
+                    self.start_autofocus(stop_when_stable=stop_when_stable, search_focus=search_focus)
+                else:
+                    self.autofocus_enabled = False
+                    self.log.warning('autofocus signal not found during rescue autofocus')
+                    self.sigAutofocusError.emit()
             else:
-                self.log.warning('piezo position out of constraints')
                 self.autofocus_enabled = False
                 self.sigAutofocusError.emit()
-                return
 
-            worker = AutofocusWorker(self._dt)
-            worker.signals.sigFinished.connect(partial(self.run_autofocus, stop_when_stable=stop_when_stable, search_focus=search_focus))
-            self.threadpool.start(worker)
+        elif reason == 'out_of_range':
+            self.log.warning('piezo position out of constraints')
+            self.autofocus_enabled = False
+            self.sigAutofocusError.emit()
+
+        elif reason == 'stable':
+            self.log.info('focus is stable')
+            self.autofocus_enabled = False
+            self.sigAutofocusStopped.emit()
+            if search_focus:
+                self.search_focus_finished()
+
+    def get_autofocus_loop_statistics(self):
+        """ Return the timing of the autofocus control loop (current or last run).
+
+        @return dict: see LoopStatistics.get_statistics
+        """
+        return self.autofocus_loop_statistics.get_statistics()
 
     def stop_autofocus(self):
         """ Stop the autofocus loop
         """
         self.autofocus_enabled = False
+        self._autofocus_loop_stop.set()
         if self._setup == 'PALM' and not self.live_display_enabled:
             self._autofocus_logic.stop_camera_live()
 
@@ -575,6 +938,68 @@ class FocusLogic(GenericLogic):
         self._stage_is_positioned = True
         self.sigFocusFound.emit()
 
+# ========================================================
+# focus map: prediction of the focus position from the stage position
+# ========================================================
+
+    def reset_focus_map(self):
+        """ Remove all focus positions from the focus map (for example when a new sample is mounted). """
+        self.focus_map.reset()
+
+    def _stage_focus_offset(self):
+        """ Contribution of the stage z axis to the absolute focus position, in µm.
+
+        The stage z axis is moved by the rescue of the autofocus, the offset calibration and the piezo position
+        correction. The focus map stores the absolute focus (piezo and stage), so that these movements do not invalidate
+        the recorded positions. The piezo position correction moves the stage by the distance the piezo has to follow:
+        a stage displacement dz is compensated by a piezo displacement -focus_map_stage_direction * dz.
+        """
+        return -self._focus_map_stage_direction * self._autofocus_logic.get_stage_z()
+
+    def record_focus_position(self, x, y, z=None, name=None):
+        """ Add the focus position found at the stage position (x, y) to the focus map. The surface is fitted again
+        with the new point. The absolute focus position (piezo position corrected by the current stage z position) is
+        stored.
+
+        :param float x: stage x position
+        :param float y: stage y position
+        :param float z: focus (piezo) position. Default: current piezo position
+        :param str name: identifier of the position, typically the ROI name. A new position with the same name
+                         replaces the previous one.
+        :return None
+        """
+        if z is None:
+            z = self.get_position()
+        self.focus_map.add_point(x, y, z + self._stage_focus_offset(), name=name)
+        self.log.debug(f'Focus map: {len(self.focus_map)} positions, order {self.focus_map.current_order}, '
+                       f'rms residual {self.focus_map.residual:.3f} um')
+
+    def predict_focus_position(self, x, y):
+        """ Predict the focus (piezo) position at the stage position (x, y) using the focus map. The absolute focus
+        predicted by the map is converted into a piezo position for the current stage z position.
+
+        :param float x: stage x position
+        :param float y: stage y position
+        :return float: predicted position, clipped to the piezo range. None if the focus map is empty
+        """
+        z = self.focus_map.predict(x, y)
+        if z is None:
+            return None
+        return float(np.clip(z - self._stage_focus_offset(), self._min_z, self._max_z))
+
+    def go_to_predicted_focus_position(self, x, y):
+        """ Move the piezo to the position predicted by the focus map, so that only a small correction is left to the
+        autofocus (search focus). The piezo is not moved if the focus map is empty.
+
+        :param float x: stage x position
+        :param float y: stage y position
+        :return float: predicted position, or None if the piezo was not moved
+        """
+        z = self.predict_focus_position(x, y)
+        if z is not None:
+            self.go_to_position(z)
+        return z
+
     def disable_focus_actions(self):
         """ This method provides a security to avoid all focus / autofocus related toolbar actions from GUI,
         for example during Tasks. """
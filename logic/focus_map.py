@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the focus map used to predict the focus position (absolute z, in µm) at a given stage position.
+
+The sample surface (coverslip) is tilted and slightly curved over the range covered by the ROIs. The focus positions
+found by the autofocus on the visited ROIs are collected, and a low order polynomial surface z(x, y) is fitted to them.
+Before searching the focus on the next ROI, the piezo can be moved to the predicted position, so that the autofocus
+only needs to correct a small residual.
+
+The order of the surface is reduced as long as there are not enough points for the requested order:
+1 point: constant, 3 points: plane, 6 points: second order polynomial.
+
+Example:
+    focus_map = FocusMap(order=2)
+    focus_map.add_point(x, y, z, name='ROI_001')
+    z_predicted = focus_map.predict(x_next, y_next)
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+import numpy as np
+
+
+# number of coefficients of the polynomial surface for each order
+N_COEFFICIENTS = {0: 1, 1: 3, 2: 6}
+
+
+class FocusMap:
+    """ Collection of focus positions and polynomial surface fitted to them.
+
+    The points are identified by a name (typically the ROI name). A new point with an existing name replaces the old
+    one, so that the map follows a slow drift of the sample when the same ROIs are visited again in the next cycle.
+    The fit is updated each time a point is added.
+    """
+
+    def __init__(self, order=1):
+        """
+        @param int order: maximum order of the polynomial surface (0, 1 or 2)
+        """
+        if order not in N_COEFFICIENTS:
+            raise ValueError(f'Order of the focus map must be one of {list(N_COEFFICIENTS)}')
+        self.order = order
+        self._points = {}  # name: (x, y, z)
+        self._coefficients = None
+        self._center = (0, 0)
+        self.current_order = None  # order of the current fit, None if no point available
+        self.residual = None  # rms residual of the current fit
+
+    def __len__(self):
+        return len(self._points)
+
+    def reset(self):
+        """ Remove all points. """
+        self._points = {}
+        self._coefficients = None
+        self.current_order = None
+        self.residual = None
+
+    def add_point(self, x, y, z, name=None):
+        """ Add a focus position and update the fit.
+
+        @param float x: stage x position
+        @param float y: stage y position
+        @param float z: focus position
+        @param str name: optional identifier of the point. Default: new point
+        """
+        if name is None:
+            name = f'point_{len(self._points)}'
+        self._points[name] = (float(x), float(y), float(z))
+        self._fit()
+
+    def get_points(self):
+        """ Return the points as an array of shape (n, 3) with columns x, y, z. """
+        return np.array(list(self._points.values()), dtype=np.float64).reshape(-1, 3)
+
+    def predict(self, x, y):
+        """ Evaluate the fitted surface.
+
+        @param float x: stage x position, or array of positions (for example the tiles of a mosaic)
+        @param float y: stage y position, or array of positions
+
+        @return float: predicted focus position (array for array arguments), or None if the map is empty
+        """
+        if self._coefficients is None:
+            return None
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        terms = self._design_matrix(x.ravel(), y.ravel(), self.current_order)
+        z = (terms @ self._coefficients).reshape(x.shape)
+        return float(z) if z.ndim == 0 else z
+
+    def _fit(self):
+        """ Least squares fit of the surface with the highest order allowed by the number of points. """
+        points = self.get_points()
+        n_points = len(points)
+        order = max(o for o, n in N_COEFFICIENTS.items() if o <= self.order and n <= n_points)
+        # coordinates relative to the center of the points, for a well conditioned fit
+        self._center = (points[:, 0].mean(), points[:, 1].mean())
+        a = self._design_matrix(points[:, 0], points[:, 1], order)
+        # for a degenerate distribution of the points (for example all ROIs on a line), lstsq returns the minimum norm
+        # solution: the slope along the line is kept, and the surface is flat in the perpendicular direction
+        coefficients = np.linalg.lstsq(a, points[:, 2], rcond=None)[0]
+        self._coefficients = coefficients
+        self.current_order = order
+        self.residual = float(np.sqrt(np.mean((a @ coefficients - points[:, 2]) ** 2)))
+
+    def _design_matrix(self, x, y, order):
+        """ Polynomial terms 1, x, y, x², xy, y² (up to the given order) for each point. """
+        x = x - self._center[0]
+        y = y - self._center[1]
+        terms = [np.ones_like(x)]
+        if order >= 1:
+            terms += [x, y]
+        if order >= 2:
+            terms += [x * x, x * y, y * y]
+        return np.stack(terms, axis=1)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains a recorder for per-frame acquisition metadata (timestamps, z positions, illumination, stage
+position and autofocus signal), collected during the acquisition of a stack.
+
+The values are written into a preallocated numpy structured array, so that recording a frame costs only a few
+assignments and does not slow down the acquisition loop. The array is saved next to the image data
+(.npy file, or dataset in the h5 container), and can be used to diagnose timing problems (missed triggers,
+settling times) or to correct a drift in post-processing.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+import numpy as np
+
+# fields of a per-frame record. Missing values are nan (or empty for the laser line).
+FRAME_METADATA_DTYPE = np.dtype([('frame', '<u4'),  # index of the frame in the stack
+                                 ('timestamp', '<f8'),  # time.time() when the acquisition of the frame was triggered
+                                 ('z_target', '<f8'),  # target position of the z stage (um)
+                                 ('z_actual', '<f8'),  # measured position of the z stage (um)
+                                 ('laser_line', 'S16'),  # light source, such as b'488 nm'
+                                 ('intensity', '<f4'),  # intensity of the light source (%)
+                                 ('stage_x', '<f8'),  # position of the xy stage (stage units)
+                                 ('stage_y', '<f8'),
+                                 ('autofocus_signal', '<f8')])  # QPD signal or centroid of the IR reflection
+
+
+class FrameMetadataRecorder:
+    """ Collects the metadata of each frame of a stack in a preallocated structured array.
+
+    The recorder is created once (for the maximum number of frames of a stack) and reset before each stack.
+    In multicolor acquisitions, all channels of a plane are recorded with one call of record_plane.
+
+    Example:
+        recorder = FrameMetadataRecorder(num_z_planes * num_laserlines)
+        recorder.reset()
+        for plane in range(num_z_planes):
+            ...
+            recorder.record_plane(time.time(), z_target, z_actual, ['488 nm', '561 nm'], [10, 20], x, y, signal)
+        np.save(path, recorder.get_data())
+    """
+
+    def __init__(self, n_frames):
+        """
+        @param int n_frames: maximum number of frames of a stack
+        """
+        self._data = np.zeros(n_frames, dtype=FRAME_METADATA_DTYPE)
+        self.n_recorded = 0
+        self.reset()
+
+    def reset(self):
+        """ Discard the recorded frames, before the acquisition of a new stack. """
+        self._data['frame'] = np.arange(len(self._data))
+        for name in FRAME_METADATA_DTYPE.names:
+            if FRAME_METADATA_DTYPE[name].kind == 'f':
+                self._data[name] = np.nan
+        self._data['laser_line'] = b''
+        self.n_recorded = 0
+
+    def record_frame(self, timestamp, z_target=np.nan, z_actual=np.nan, laser_line='', intensity=np.nan,
+                     stage_x=np.nan, stage_y=np.nan, autofocus_signal=np.nan):
+        """ Record the metadata of the next frame. Frames exceeding the preallocated size are ignored.
+
+        @param float timestamp: time of the trigger of the frame, such as time.time()
+        @param float z_target: target position of the z stage
+        @param float z_actual: measured position of the z stage
+        @param str laser_line: light source
+        @param float intensity: intensity of the light source
+        @param float stage_x: x position of the stage
+        @param float stage_y: y position of the stage
+        @param float autofocus_signal: signal of the autofocus detector
+        """
+        if self.n_recorded >= len(self._data):
+            return
+        self._data[self.n_recorded] = (self.n_recorded, timestamp, z_target, z_actual, laser_line, intensity,
+                                       stage_x, stage_y, autofocus_signal)
+        self.n_recorded += 1
+
+    def record_plane(self, timestamp, z_target, z_actual, laser_lines, intensities, stage_x=np.nan,
+                     stage_y=np.nan, autofocus_signal=np.nan):
+        """ Record the metadata of the frames of one plane of a multicolor stack, one frame per laser line.
+
+        @param float timestamp: time of the trigger of the plane, such as time.time()
+        @param float z_target: target position of the z stage
+        @param float z_actual: measured position of the z stage
+        @param list laser_lines: light sources, in the order of the acquisition
+        @param list intensities: intensities of the light sources
+        @param float stage_x: x position of the stage
+        @param float stage_y: y position of the stage
+        @param float autofocus_signal: signal of the autofocus detector
+        """
+        for laser_line, intensity in zip(laser_lines, intensities):
+            self.record_frame(timestamp, z_target, z_actual, laser_line, intensity, stage_x, stage_y,
+                              autofocus_signal)
+
+    def get_data(self):
+        """ Return a copy of the records of the current stack, which remains valid after the next reset.
+
+        @return numpy structured array: one record per recorded frame, see FRAME_METADATA_DTYPE
+        """
+        return self._data[:self.n_recorded].copy()
+
+    @staticmethod
+    def save(path, data):
+        """ Save records in numpy format (.npy), to be loaded using numpy.load.
+
+        @param str path: complete path, including the suffix .npy
+        @param numpy structured array data: records returned by get_data
+        """
+        np.save(path, data)
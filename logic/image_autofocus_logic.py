@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Extension for qudi software
+
+This module contains a logic class for an image based autofocus, using the sharpness of the sample images acquired
+with the main camera.
+
+The autofocus logics based on the IR reflection (autofocus_logic_camera.py, autofocus_logic_FPGA.py) stabilize the
+distance to the coverslip, which is not necessarily the plane of interest in thick samples (see calibrate_offset).
+This module finds the plane where the sample itself is sharpest:
+- a short z stack is acquired around the current position (coarse steps), the sharpness of all planes is calculated in
+  one vectorized pass, and the peak is located with sub-step precision by a parabolic interpolation,
+- a second stack with fine steps is acquired around this peak, and the piezo is moved to the interpolated maximum.
+The sharpest plane can also be determined on a stack that was already acquired (for example the z stack of a Hi-M
+acquisition), so that no additional exposure of the sample is needed.
+
+Sharpness metrics (calculated on the binned images, all normalized by the mean intensity of the plane so that they are
+insensitive to fluctuations of the illumination):
+- 'normalized_variance': variance of the intensity divided by the mean intensity
+- 'brenner': mean squared difference between pixels two columns apart, divided by the squared mean intensity
+- 'laplacian': mean squared laplacian (energy of the second derivative), divided by the squared mean intensity
+"""
+from time import perf_counter
+import numpy as np
+
+from core.connector import Connector
+from core.configoption import ConfigOption
+from logic.generic_logic import GenericLogic
+from qtpy import QtCore
+
+
+SHARPNESS_METRICS = ['normalized_variance', 'brenner', 'laplacian']
+
+
+def bin_stack(stack, binning):
+    """ Sum blocks of binning x binning pixels of each plane. The edges not filling a complete block are dropped.
+
+    @param numpy.ndarray stack: image data of shape (n_planes, height, width)
+    @param int binning: size of the blocks in pixel
+
+    @return numpy.ndarray: float32 array of shape (n_planes, height // binning, width // binning)
+    """
+    stack = np.asarray(stack)
+    if binning <= 1:
+        return stack.astype(np.float32)
+    n, height, width = stack.shape
+    h, w = height // binning, width // binning
+    return stack[:, :h * binning, :w * binning].reshape(n, h, binning, w, binning).sum(axis=(2, 4),
+                                                                                      dtype=np.float32)
+
+
+def sharpness(stack, metric='normalized_variance', binning=1):
+    """ Calculate the sharpness of each plane of a stack. All planes are processed at once.
+
+    @param numpy.ndarray stack: image data of shape (n_planes, height, width), or a single image
+    @param str metric: one of SHARPNESS_METRICS
+    @param int binning: the images are binned before the calculation (faster, less sensitive to noise)
+
+    @return numpy.ndarray: sharpness of each plane (float64)
+    """
+    if metric not in SHARPNESS_METRICS:
+        raise ValueError(f'Unknown sharpness metric {metric}. Available metrics: {SHARPNESS_METRICS}')
+    stack = np.asarray(stack)
+    if stack.ndim == 2:
+        stack = stack[np.newaxis]
+    planes = bin_stack(stack, binning)
+    mean = planes.mean(axis=(1, 2), dtype=np.float64)
+    mean[mean == 0] = np.nan  # dark planes have no defined sharpness
+
+    if metric == 'normalized_variance':
+        return planes.var(axis=(1, 2), dtype=np.float64) / mean
+    if metric == 'brenner':
+        diff = planes[:, :, 2:] - planes[:, :, :-2]
+        return np.mean(diff * diff, axis=(1, 2), dtype=np.float64) / mean ** 2
+    # laplacian, on the inner pixels
+    laplacian = (planes[:, 1:-1, :-2] + planes[:, 1:-1, 2:] + planes[:, :-2, 1:-1] + planes[:, 2:, 1:-1]
+                 - 4 * planes[:, 1:-1, 1:-1])
+    return np.mean(laplacian * laplacian, axis=(1, 2), dtype=np.float64) / mean ** 2
+
+
+def parabolic_peak(z_positions, values):
+    """ Position of the maximum of values, interpolated by a parabola through the maximum and its two neighbours.
+
+    @param array-like z_positions: positions of the planes (not necessarily equidistant, in increasing order)
+    @param array-like values: sharpness of the planes
+
+    @return tuple: (float z_peak, bool on_edge). on_edge is True if the maximum is the first or the last plane: the
+                   peak is then probably outside the scanned range, and the position of this plane is returned.
+    """
+    z_positions = np.asarray(z_positions, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    index = int(np.nanargmax(values))
+    if index == 0 or index == len(values) - 1:
+        return float(z_positions[index]), True
+    z = z_positions[index - 1:index + 2]
+    a, b, _ = np.polyfit(z - z[1], values[index - 1:index + 2], 2)
+    if a >= 0 or not np.all(np.isfinite([a, b])):  # not a maximum (flat or noisy neighbours)
+        return float(z[1]), False
+    # the vertex lies between the neighbours since the center value is the largest
+    return float(z[1] - b / (2 * a)), False
+
+
+class ImageAutofocusLogic(GenericLogic):
+    """ Autofocus on the sample, using the sharpness of the images of the main camera.
+
+    Config entry for copy-paste:
+
+    image_autofocus_logic:
+        module.Class: 'image_autofocus_logic.ImageAutofocusLogic'
+        metric: 'normalized_variance'  # 'normalized_variance', 'brenner' or 'laplacian'
+        binning: 4  # images are binned by binning x binning pixels before the calculation of the sharpness
+        coarse_range: 6  # in um, total range of the coarse stack
+        coarse_step: 1  # in um
+        fine_step: 0.2  # in um, the fine stack covers +/- coarse_step around the coarse peak
+        connect:
+            camera: 'camera_logic'
+            focus: 'focus_logic'
+    """
+
+    # declare connectors
+    camera = Connector(interface='CameraLogic')
+    focus = Connector(interface='FocusLogic')
+
+    # config options
+    _metric = ConfigOption('metric', 'normalized_variance')
+    _binning = ConfigOption('binning', 4)
+    _coarse_range = ConfigOption('coarse_range', 6)
+    _coarse_step = ConfigOption('coarse_step', 1)
+    _fine_step = ConfigOption('fine_step', 0.2)
+
+    # signals
+    sigSharpnessUpdated = QtCore.Signal(object, object)  # z positions, sharpness of the last stack
+    sigImageAutofocusFinished = QtCore.Signal(float)  # position of the sharpest plane, nan if not found
+
+    def __init__(self, config, **kwargs):
+        super().__init__(config=config, **kwargs)
+
+    def on_activate(self):
+        """ Initialisation performed during activation of the module.
+        """
+        self._camera = self.camera()
+        self._focus = self.focus()
+        if self._metric not in SHARPNESS_METRICS:
+            self.log.warning(f'Unknown sharpness metric {self._metric}. Using normalized_variance.')
+            self._metric = 'normalized_variance'
+
+    def on_deactivate(self):
+        """ Perform required deactivation. """
+        pass
+
+    def focus_from_stack(self, stack, z_positions, metric=None):
+        """ Find the sharpest plane of an already acquired stack, without any additional exposure.
+
+        @param numpy.ndarray stack: image data of shape (n_planes, height, width), one image per z position
+        @param array-like z_positions: position of each plane in um
+        @param str metric: sharpness metric, default: metric defined in the config
+
+        @return tuple: (float z of the sharpest plane (interpolated), bool True if the maximum is at the first or
+                        last plane, np.ndarray sharpness of each plane)
+        """
+        metric = self._metric if metric is None else metric
+        z_positions = np.asarray(z_positions, dtype=np.float64)
+        if len(z_positions) != len(stack):
+            raise ValueError(f'{len(stack)} planes but {len(z_positions)} z positions')
+        order = np.argsort(z_positions)
+        values = sharpness(stack, metric, self._binning)
+        z_peak, on_edge = parabolic_peak(z_positions[order], values[order])
+        self.sigSharpnessUpdated.emit(z_positions[order], values[order])
+        return z_peak, on_edge, values
+
+    def acquire_stack(self, z_positions):
+        """ Acquire one image at each z position with the current camera settings. The illumination (brightfield or
+        laser) must be switched on by the caller.
+
+        @param array-like z_positions: positions in um
+
+        @return numpy.ndarray: image data of shape (n_planes, height, width)
+        """
+        images = []
+        for z in z_positions:
+            self._focus.go_to_position(z)
+            self._camera.start_single_acquistion()
+            images.append(self._camera.get_last_image())
+        return np.array(images)
+
+    def run_image_autofocus(self, center=None):
+        """ Coarse to fine search of the sharpest plane around center, and move the piezo to this plane.
+
+        The coarse stack covers coarse_range with coarse_step. The fine stack covers +/- coarse_step around the
+        interpolated coarse maximum, with fine_step.
+
+        @param float center: center of the coarse stack in um. Default: current piezo position
+
+        @return float: position of the sharpest plane, or None if no maximum was found in the scanned range (the
+                       piezo is then moved back to center)
+        """
+        start = perf_counter()
+        self._camera.stop_live_mode()
+        if center is None:
+            center = self._focus.get_position()
+        half_range = self._coarse_range / 2
+        coarse = center + np.arange(-half_range, half_range + self._coarse_step / 2, self._coarse_step)
+        coarse = np.clip(coarse, self._focus._min_z, self._focus._max_z)
+        z_coarse, on_edge, _ = self.focus_from_stack(self.acquire_stack(coarse), coarse)
+        if on_edge:
+            self.log.warning(f'Image autofocus: sharpest plane at the border of the coarse range '
+                             f'({coarse[0]:.2f} - {coarse[-1]:.2f} um). Focus not found.')
+            self._focus.go_to_position(center)
+            self.sigImageAutofocusFinished.emit(np.nan)
+            return None
+
+        fine = z_coarse + np.arange(-self._coarse_step, self._coarse_step + self._fine_step / 2, self._fine_step)
+        fine = np.clip(fine, self._focus._min_z, self._focus._max_z)
+        z_fine, on_edge, _ = self.focus_from_stack(self.acquire_stack(fine), fine)
+        if on_edge:  # the fine stack spans two coarse steps around the peak: keep the coarse estimate
+            z_fine = z_coarse
+        self._focus.go_to_position(z_fine)
+        self.log.info(f'Image autofocus: sharpest plane at {z_fine:.3f} um ({len(coarse) + len(fine)} images, '
+                      f'{perf_counter() - start:.2f} s)')
+        self.sigImageAutofocusFinished.emit(z_fine)
+        return z_fine
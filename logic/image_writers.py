@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains writer classes used to save camera image data incrementally, frame by frame or in small blocks
+of frames, so that a movie does not need to be held in memory entirely before it is written to disk, as well as the
+chunked container format used to store all image stacks of an experiment in a single file.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+import struct
+import threading
+import yaml
+import numpy as np
+from astropy.io import fits
+
+from logic.frame_metadata import FRAME_METADATA_DTYPE
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def to_uint16(data, byteorder='='):
+    """ Convert image data to 16 bit unsigned integers. Float values are rounded, and values outside of the uint16
+    range are clipped to [0, 65535] instead of wrapping around.
+
+    @param numpy.ndarray data: image data
+    @param str byteorder: '<' (little endian), '>' (big endian) or '=' (native)
+
+    @return numpy.ndarray: data, not copied if it already has the requested type
+    """
+    data = np.asarray(data)
+    dtype = np.dtype(np.uint16).newbyteorder(byteorder)
+    if data.dtype == dtype:
+        return data
+    if data.dtype.kind == 'f':
+        data = np.rint(data)
+    if data.dtype.kind in 'fi' or (data.dtype.kind == 'u' and data.dtype.itemsize > 2):
+        data = np.clip(data, 0, 65535)
+    return data.astype(dtype)
+
+
+class TiffWriter:
+    """ Writes 16 bit grayscale images to a multi-page tiff file, one page per frame.
+
+    Frames can be appended one by one or in blocks using write. The image data is written directly from the numpy
+    array, without intermediate conversion to image objects. Each page consists of its image file directory (IFD)
+    followed by the uncompressed image data, so the file is written sequentially. The link from the last page to a
+    next one is removed when the file is closed.
+
+    Classic tiff files cannot exceed 4 GB. If bigtiff is None, the BigTIFF format is used automatically when the
+    expected size of the image data exceeds this limit. The metadata dictionary is stored in yaml format in the
+    image description tag of the first page.
+
+    Example:
+        with TiffWriter('movie.tiff', expected_size=data.nbytes, metadata={'exposure': 0.05}) as writer:
+            for frames in blocks:
+                writer.write(frames)
+    """
+    # tiff tags used in the image file directories
+    _IMAGE_WIDTH = 256
+    _IMAGE_LENGTH = 257
+    _BITS_PER_SAMPLE = 258
+    _COMPRESSION = 259
+    _PHOTOMETRIC = 262
+    _IMAGE_DESCRIPTION = 270
+    _STRIP_OFFSETS = 273
+    _SAMPLES_PER_PIXEL = 277
+    _ROWS_PER_STRIP = 278
+    _STRIP_BYTE_COUNTS = 279
+    _SAMPLE_FORMAT = 339
+
+    # field types
+    _ASCII = 2
+    _SHORT = 3
+    _LONG = 4
+    _LONG8 = 16
+
+    _CLASSIC_TIFF_LIMIT = 2**32 - 2**25  # keep a margin below 4 GB for the image file directories
+
+    def __init__(self, path, bigtiff=None, expected_size=None, metadata=None):
+        """
+        @param str path: complete path of the file, including the suffix .tiff
+        @param bool bigtiff: True: use the BigTIFF format, False: classic tiff format,
+                             None: choose depending on expected_size
+        @param int expected_size: expected size of the image data in bytes. If unknown, classic tiff format is used
+                                  (unless bigtiff is True) and write raises an error when the 4 GB limit is reached.
+        @param dict metadata: written to the image description of the first page
+        """
+        if bigtiff is None:
+            bigtiff = expected_size is not None and expected_size > self._CLASSIC_TIFF_LIMIT
+        self.path = path
+        self.bigtiff = bigtiff
+        self.n_frames = 0
+
+        if bigtiff:
+            header = b'II' + struct.pack('<HHHQ', 43, 8, 0, 0)
+            self._offset_format = 'Q'
+            self._offset_type = self._LONG8
+            self._max_offset = 2**64 - 1
+        else:
+            header = b'II' + struct.pack('<HI', 42, 0)
+            self._offset_format = 'I'
+            self._offset_type = self._LONG
+            self._max_offset = 2**32 - 1
+
+        self._description = None
+        if metadata is not None:
+            description = yaml.dump(metadata, default_flow_style=False).encode('ascii') + b'\0'
+            # longer than 8 bytes to be stored outside of the IFD entry, even length for word alignment
+            description = description.ljust(10, b'\0')
+            self._description = description + b'\0' * (len(description) % 2)
+
+        self._file = open(path, 'wb')
+        self._file.write(header)
+        self._position = len(header)
+        self._next_ifd_pointer = len(header) - struct.calcsize(self._offset_format)  # first IFD offset: in the header
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        """ Append one frame (2D array) or a block of frames (3D array, frame index as first dimension).
+
+        @param numpy.ndarray data: image data. It is converted to uint16 if needed: float values are rounded, and
+                                   values outside of the uint16 range are clipped to [0, 65535].
+        """
+        data = np.asarray(data)
+        if data.ndim == 2:
+            data = data[np.newaxis]
+        data = to_uint16(data, '<')
+        for frame in data:
+            self._write_page(np.ascontiguousarray(frame))
+
+    def close(self):
+        """ Terminate the chain of image file directories and close the file. """
+        if self._file.closed:
+            return
+        if self.n_frames > 0:
+            self._file.seek(self._next_ifd_pointer)
+            self._file.write(struct.pack('<' + self._offset_format, 0))
+        self._file.close()
+
+    def _write_page(self, frame):
+        """ Write the IFD of a single frame followed by its image data.
+
+        The offset of the next IFD is set to the end of the image data, where the next page will start.
+
+        @param numpy.ndarray frame: 2D C-contiguous array of type uint16, little endian
+        """
+        height, width = frame.shape
+        description_offset = self._position
+        description = self._description if self.n_frames == 0 else None
+        ifd_offset = description_offset + (len(description) if description is not None else 0)
+
+        entries = [(self._IMAGE_WIDTH, self._LONG, 1, width),
+                   (self._IMAGE_LENGTH, self._LONG, 1, height),
+                   (self._BITS_PER_SAMPLE, self._SHORT, 1, 16),
+                   (self._COMPRESSION, self._SHORT, 1, 1),  # no compression
+                   (self._PHOTOMETRIC, self._SHORT, 1, 1)]  # black is zero
+        if description is not None:
+            entries.append((self._IMAGE_DESCRIPTION, self._ASCII, len(description), description_offset))
+        entries.append((self._STRIP_OFFSETS, self._offset_type, 1, None))  # set below, once the IFD size is known
+        entries += [(self._SAMPLES_PER_PIXEL, self._SHORT, 1, 1),
+                    (self._ROWS_PER_STRIP, self._LONG, 1, height),
+                    (self._STRIP_BYTE_COUNTS, self._offset_type, 1, frame.nbytes),
+                    (self._SAMPLE_FORMAT, self._SHORT, 1, 1)]  # unsigned integer
+
+        if self.bigtiff:
+            ifd_size = 8 + 20 * len(entries) + 8
+        else:
+            ifd_size = 2 + 12 * len(entries) + 4
+        data_offset = ifd_offset + ifd_size
+        next_ifd_offset = data_offset + frame.nbytes
+        if next_ifd_offset > self._max_offset:
+            raise ValueError('Tiff file would exceed 4 GB. Use the BigTIFF format.')
+
+        ifd = self._pack_ifd(entries, data_offset, next_ifd_offset)
+        if description is not None:
+            self._file.write(description)
+        self._file.write(ifd)
+        self._file.write(frame)
+
+        self._next_ifd_pointer = data_offset - struct.calcsize(self._offset_format)
+        self._position = next_ifd_offset
+        self.n_frames += 1
+        if self.n_frames == 1:
+            # first page: set the offset of the first IFD in the header
+            self._file.seek(len(b'II') + (6 if self.bigtiff else 2))
+            self._file.write(struct.pack('<' + self._offset_format, ifd_offset))
+            self._file.seek(self._position)
+
+    def _pack_ifd(self, entries, data_offset, next_ifd_offset):
+        """ Create the binary representation of an image file directory.
+
+        @param list entries: tuples (tag, type, count, value). Values of type ASCII are offsets, value None stands
+                             for the offset of the image data.
+        @param int data_offset: offset of the image data
+        @param int next_ifd_offset: offset of the next IFD
+
+        @return bytes: IFD
+        """
+        if self.bigtiff:
+            ifd = struct.pack('<Q', len(entries))
+            entry_format, value_format = '<HHQ', {self._SHORT: 'HHHH', self._LONG: 'II', self._LONG8: 'Q',
+                                                   self._ASCII: 'Q'}
+        else:
+            ifd = struct.pack('<H', len(entries))
+            entry_format, value_format = '<HHI', {self._SHORT: 'HH', self._LONG: 'I', self._ASCII: 'I'}
+        for tag, typ, count, value in entries:
+            if value is None:
+                value = data_offset
+            values = (value,) + (0,) * (len(value_format[typ]) - 1)  # values are left-justified in the entry
+            ifd += struct.pack(entry_format, tag, typ, count) + struct.pack('<' + value_format[typ], *values)
+        ifd += struct.pack('<' + self._offset_format, next_ifd_offset)
+        return ifd
+
+
+class FitsWriter:
+    """ Writes a 16 bit image stack to a fits file, frame by frame.
+
+    The number of frames must be known when the file is created because it is part of the header. If less frames
+    were written when the file is closed, the remaining frames are filled with zeros so that the file stays valid.
+    The data is stored as unsigned 16 bit integers (BITPIX 16 with BZERO 32768).
+    """
+
+    def __init__(self, path, n_frames, height, width, metadata=None):
+        """
+        @param str path: complete path of the file, including the suffix .fits
+        @param int n_frames: number of frames
+        @param int height: number of rows of a frame
+        @param int width: number of columns of a frame
+        @param dict metadata: fits compatible header entries {key: (value, comment)}
+        """
+        self.path = path
+        self.n_frames = 0
+        self._n_frames_total = n_frames
+        self._frame_shape = (height, width)
+
+        header = fits.Header()
+        header['SIMPLE'] = True
+        header['BITPIX'] = 16
+        header['NAXIS'] = 3
+        header['NAXIS1'] = width
+        header['NAXIS2'] = height
+        header['NAXIS3'] = n_frames
+        header['BZERO'] = 32768
+        header['BSCALE'] = 1
+        if metadata is not None:
+            for key in metadata:
+                header[key] = metadata[key]
+        self._hdu = fits.StreamingHDU(path, header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        """ Append one frame (2D array) or a block of frames (3D array, frame index as first dimension).
+
+        @param numpy.ndarray data: image data. It is converted to uint16 if needed (see to_uint16).
+        """
+        data = np.asarray(data)
+        if data.ndim == 2:
+            data = data[np.newaxis]
+        data = data[:self._n_frames_total - self.n_frames]  # frames exceeding the size given in the header are lost
+        if len(data) == 0:
+            return
+        # unsigned to signed with offset 32768: flipping the most significant bit is equivalent to subtracting 32768
+        data = (to_uint16(data) ^ 0x8000).view(np.int16)
+        self._hdu.write(data.astype('>i2'))
+        self.n_frames += len(data)
+
+    def close(self):
+        """ Fill the missing frames with zeros, if any, and close the file. """
+        if self._hdu is None:
+            return
+        zero_frame = np.zeros(self._frame_shape, dtype=np.uint16)
+        while self.n_frames < self._n_frames_total:
+            self.write(zero_frame)
+        self._hdu.close()
+        self._hdu = None
+
+
+class ChunkedDatasetWriter:
+    """ Writes all image stacks of an experiment (such as Hi-M or MERFISH) into a single HDF5 container.
+
+    Layout of the file:
+        /data       uint16 array with axes (cycle, roi, z, channel, y, x). Each frame is a separate compressed chunk.
+        /z_target   float array with axes (cycle, roi, z): target positions of the z stages
+        /z_actual   float array with axes (cycle, roi, z): positions measured during the acquisition
+        /frame_metadata  structured array with axes (cycle, roi, frame): per-frame records in acquisition order,
+                         see logic.frame_metadata.FRAME_METADATA_DTYPE
+        /metadata/<cycle>/<roi>  group whose attributes contain the metadata of the stack
+
+    The attributes of the root group contain the names of the axes, of the cycles (e.g. probes), rois and channels,
+    as well as the experiment metadata. Stacks are added one by one using write_stack, in any order. The cycle and
+    roi axes grow when needed, so that an existing container can also be extended. The datasets are created when the
+    first stack is written because the frame size is only known at this moment.
+
+    Example:
+        with ChunkedDatasetWriter('experiment.h5', n_z=20, n_channels=2, roi_names=['ROI_001', 'ROI_002']) as writer:
+            writer.write_stack(0, 1, stack, metadata={'Exposure time (s)': 0.05})
+    """
+    axes = ('cycle', 'roi', 'z', 'channel', 'y', 'x')
+
+    def __init__(self, path, n_z, n_channels, roi_names=None, cycle_names=None, channel_names=None,
+                 compression='lzf', compression_level=None, attributes=None):
+        """
+        @param str path: complete path of the file, including the suffix .h5. An existing file is extended.
+        @param int n_z: number of planes of a stack
+        @param int n_channels: number of channels (e.g. laser lines), interleaved in each plane of the acquired stack
+        @param list roi_names: optional, names of the rois, in the order of the roi axis
+        @param list cycle_names: optional, names of the cycles (e.g. probes), in the order of the cycle axis
+        @param list channel_names: optional, names of the channels
+        @param str compression: 'lzf' (fast), 'gzip' (more compact) or None
+        @param int compression_level: only used for gzip (0 - 9)
+        @param dict attributes: experiment metadata, written to the root group
+        """
+        if h5py is None:
+            raise ImportError('The h5py package is required for the chunked dataset format. Perform e.g. '
+                              'pip install h5py in the console to install it.')
+        self.path = path
+        self.n_z = n_z
+        self.n_channels = n_channels
+        self.compression = compression
+        self.compression_level = compression_level if compression == 'gzip' else None
+        self._lock = threading.Lock()  # stacks may be written from several threads
+
+        self._file = h5py.File(path, 'a')
+        self._file.attrs['axes'] = ','.join(self.axes)
+        if roi_names is not None:
+            self._file.attrs['roi_names'] = [str(name) for name in roi_names]
+        if cycle_names is not None:
+            self._file.attrs['cycle_names'] = [str(name) for name in cycle_names]
+        if channel_names is not None:
+            self._file.attrs['channel_names'] = [str(name) for name in channel_names]
+        if attributes is not None:
+            self._set_attributes(self._file, attributes)
+        self._initial_size = (len(cycle_names) if cycle_names is not None else 1,
+                              len(roi_names) if roi_names is not None else 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_stack(self, cycle, roi, data, metadata=None, z_target=None, z_actual=None, frame_metadata=None):
+        """ Write the stack acquired in the given cycle for the given roi.
+
+        @param int cycle: index on the cycle axis
+        @param int roi: index on the roi axis
+        @param numpy.ndarray data: frames in acquisition order (3D array, n_z * n_channels frames: all channels of
+                                   the first plane, then all channels of the second plane, ...) or 4D array
+                                   (z, channel, y, x). It is converted to uint16 if needed.
+        @param dict metadata: optional, written to the attributes of the group /metadata/<cycle>/<roi>
+        @param list z_target: optional, target z positions of the planes
+        @param list z_actual: optional, measured z positions of the planes
+        @param numpy structured array frame_metadata: optional, per-frame records (see FrameMetadataRecorder)
+        """
+        data = np.asarray(data)
+        data = data.reshape((self.n_z, self.n_channels) + data.shape[-2:])
+        with self._lock:
+            if 'data' not in self._file:
+                self._create_datasets(data.shape[-2:])
+            self._resize(cycle, roi)
+            self._file['data'][cycle, roi] = to_uint16(data)
+            if z_target is not None:
+                self._file['z_target'][cycle, roi] = z_target
+            if z_actual is not None:
+                self._file['z_actual'][cycle, roi] = z_actual
+            if frame_metadata is not None and 'frame_metadata' in self._file:  # absent in older containers
+                frame_metadata = np.asarray(frame_metadata, dtype=FRAME_METADATA_DTYPE)[:self.n_z * self.n_channels]
+                self._file['frame_metadata'][cycle, roi, :len(frame_metadata)] = frame_metadata
+            if metadata is not None:
+                group = self._file.require_group(f'metadata/{cycle}/{roi}')
+                self._set_attributes(group, metadata)
+            self._file.flush()
+
+    def close(self):
+        """ Close the file. """
+        with self._lock:
+            if self._file.id.valid:
+                self._file.close()
+
+    def _create_datasets(self, frame_shape):
+        """ Create the image, z position and frame metadata datasets, resizable along the cycle and roi axes.
+
+        @param tuple frame_shape: (height, width) of a frame
+        """
+        n_cycles, n_rois = self._initial_size
+        shape = (n_cycles, n_rois, self.n_z, self.n_channels) + tuple(frame_shape)
+        self._file.create_dataset('data', shape=shape, maxshape=(None, None) + shape[2:], dtype=np.uint16,
+                                  chunks=(1, 1, 1, 1) + tuple(frame_shape), compression=self.compression,
+                                  compression_opts=self.compression_level,
+                                  shuffle=self.compression is not None)  # byte shuffling improves the compression
+        self._file['data'].attrs['axes'] = ','.join(self.axes)
+        for name in ['z_target', 'z_actual']:
+            self._file.create_dataset(name, shape=shape[:3], maxshape=(None, None, self.n_z), dtype=np.float64,
+                                      fillvalue=np.nan)
+        n_frames = self.n_z * self.n_channels
+        self._file.create_dataset('frame_metadata', shape=shape[:2] + (n_frames,), maxshape=(None, None, n_frames),
+                                  dtype=FRAME_METADATA_DTYPE)
+
+    def _resize(self, cycle, roi):
+        """ Extend the cycle and roi axes of the datasets if the given indices are out of range. """
+        dataset = self._file['data']
+        n_cycles = max(dataset.shape[0], cycle + 1)
+        n_rois = max(dataset.shape[1], roi + 1)
+        if (n_cycles, n_rois) != dataset.shape[:2]:
+            for name in ['data', 'z_target', 'z_actual', 'frame_metadata']:
+                if name in self._file:
+                    self._file[name].resize((n_cycles, n_rois) + self._file[name].shape[2:])
+
+    @staticmethod
+    def _set_attributes(node, dictionary):
+        """ Write a dictionary to the attributes of a group. Values which can not be stored as attributes directly
+        (e.g. nested dictionaries, None) are stored in yaml format.
+        """
+        for key, value in dictionary.items():
+            if isinstance(value, (str, bool, int, float, np.number)):
+                node.attrs[str(key)] = value
+            else:
+                node.attrs[str(key)] = yaml.safe_dump(value, default_flow_style=True).strip()
+
+
+class ChunkedDatasetReader:
+    """ Gives access to parts of a container written by ChunkedDatasetWriter, without loading the complete file.
+
+    Only the chunks covering the requested part are read. Frames of an uncompressed container can also be
+    memory-mapped.
+
+    Example:
+        with ChunkedDatasetReader('experiment.h5') as reader:
+            stack = reader.read(cycle=3, roi=reader.roi_names.index('ROI_002'), channel=1)
+    """
+
+    def __init__(self, path):
+        """
+        @param str path: complete path of the container
+        """
+        if h5py is None:
+            raise ImportError('The h5py package is required for the chunked dataset format. Perform e.g. '
+                              'pip install h5py in the console to install it.')
+        self.path = path
+        self._file = h5py.File(path, 'r')
+        self.data = self._file['data']  # h5py dataset: slicing reads only the required chunks
+        self.shape = self.data.shape
+        attrs = self._file.attrs
+        self.roi_names = list(attrs['roi_names']) if 'roi_names' in attrs else []
+        self.cycle_names = list(attrs['cycle_names']) if 'cycle_names' in attrs else []
+        self.channel_names = list(attrs['channel_names']) if 'channel_names' in attrs else []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, cycle, roi, z=slice(None), channel=slice(None)):
+        """ Read a part of the image data.
+
+        @param int cycle: index on the cycle axis
+        @param int roi: index on the roi axis
+        @param int or slice z: planes
+        @param int or slice channel: channels
+
+        @return numpy.ndarray: image data
+        """
+        return self.data[cycle, roi, z, channel]
+
+    def z_positions(self, cycle, roi):
+        """ Return the target and measured z positions of a stack.
+
+        @return tuple(numpy.ndarray, numpy.ndarray): z_target, z_actual
+        """
+        return self._file['z_target'][cycle, roi], self._file['z_actual'][cycle, roi]
+
+    def frame_metadata(self, cycle, roi):
+        """ Return the per-frame records of a stack. Frames without record have a zero timestamp.
+
+        @return numpy structured array: records in acquisition order, see FRAME_METADATA_DTYPE
+        """
+        if 'frame_metadata' not in self._file:  # container written by an older version
+            return np.zeros(0, dtype=FRAME_METADATA_DTYPE)
+        return self._file['frame_metadata'][cycle, roi]
+
+    def metadata(self, cycle=None, roi=None):
+        """ Return the experiment metadata, or the metadata of a stack if cycle and roi are given.
+
+        @return dict: metadata
+        """
+        if cycle is None or roi is None:
+            return dict(self._file.attrs)
+        group = self._file.get(f'metadata/{cycle}/{roi}')
+        return dict(group.attrs) if group is not None else {}
+
+    def memmap_frame(self, cycle, roi, z, channel):
+        """ Memory-map a single frame. Only possible if the container is not compressed.
+
+        @return numpy.memmap: frame (read only), or None if the frame was not written yet
+        """
+        if self.data.compression is not None:
+            raise ValueError('Compressed frames can not be memory-mapped. Use read instead.')
+        chunk = self.data.id.get_chunk_info_by_coord((cycle, roi, z, channel, 0, 0))
+        if chunk.byte_offset is None:
+            return None
+        return np.memmap(self.path, dtype=self.data.dtype, mode='r', offset=chunk.byte_offset,
+                         shape=self.data.shape[-2:])
+
+    def close(self):
+        """ Close the file. """
+        if self._file.id.valid:
+            self._file.close()
@@ -115,9 +115,9 @@ class LaserControlLogic(GenericLogic):
                 # alternative: (to test which is faster)
                 # self.apply_voltage_single_channel(self._intensity_dict[key] * self._laser_dict[key]['ao_voltage_range'][1] / 100, self._laser_dict[key]['channel'])
                 # does the delay due to iteration matter ? (laser 4 switched on slightly after laser 1 ? ..)
-        elif self.controllertype == 'fpga':
-            for key in self._laser_dict:
-                self._controller.apply_voltage(self._intensity_dict[key], self._laser_dict[key]['channel'])
+        elif self.controllertype == 'fpga':  # all channels are written with a single update of the outputs
+            self._controller.apply_voltages({self._laser_dict[key]['channel']: self._intensity_dict[key]
+                                             for key in self._laser_dict})
         else:
             self.log.warning('your controller type is currently not covered')
 
@@ -129,8 +129,7 @@ class LaserControlLogic(GenericLogic):
                 self._controller.apply_voltage(0.0, self._laser_dict[key]['channel'])
             # note that the intensity dict is intentionally not reset to allow easy on off switching without need to rewrite the value
         elif self.controllertype == 'fpga':
-            for key in self._laser_dict:
-                self._controller.apply_voltage(0, self._laser_dict[key]['channel'])
+            self._controller.apply_voltages({self._laser_dict[key]['channel']: 0 for key in self._laser_dict})
         else:
             self.log.warning('your controller type is currently not covered')
 
@@ -248,6 +247,14 @@ class LaserControlLogic(GenericLogic):
         else:
             pass
 
+    def send_trigger_and_wait_for_fire(self, timeout):
+        """ for multicolor imaging task : send the trigger and wait until the end of the exposure (fire signal low).
+        Returns 0 if the fire signal was received, -1 otherwise. """
+        if self.controllertype == 'daq':
+            return self._controller.send_trigger_and_wait_for_fire(timeout)
+        else:
+            pass
+
 
 
 
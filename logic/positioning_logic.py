@@ -57,7 +57,8 @@ class zMoveWorker(QtCore.QRunnable):
 
 class PositioningLogic(GenericLogic):
     """
-    Class containing the logic to control the 3 axis positioning system for the probes
+    Class containing the logic to control the 3 axis positioning system for the probes.
+    The stage must provide start_move_abs returning a completion handle (MotionHandle), as the PI 3 axis stage.
 
     Example config for copy-paste:
 
@@ -91,6 +92,7 @@ class PositioningLogic(GenericLogic):
 
 
     moving = False
+    _stage_move = None  # completion handle of the current stage movement (MotionHandle)
     origin = None
     delta_x = 14.9  # in mm # to be defined by config later
     delta_y = 14.9  # in mm # to be defined by config later
@@ -187,15 +189,11 @@ class PositioningLogic(GenericLogic):
             # separate movement into xy and z movements for safety
             pos_dict_xy = {key: pos_dict[key] for key in ['x', 'y']}
             pos_dict_z = {key: pos_dict[key] for key in ['z']}
-            self._stage.move_abs({'z': self.z_safety_pos})  # move to z safety position before making the xy movement
-            ready = self._stage.get_status('z')['z']
-            while not ready:
-                sleep(0.5)
-                ready = self._stage.get_status('z')['z']
-                # or use wait for idle (waitontarget) as non interface method .. or add it to the interface
+            # move to z safety position before making the xy movement
+            self._stage.start_move_abs({'z': self.z_safety_pos}).wait()
 
             # start the xy movement of the translation stage
-            self._stage.move_abs(pos_dict_xy)
+            self._stage_move = self._stage.start_move_abs(pos_dict_xy)
 
             # start a worker thread to monitor the xy movement
             worker = xyMoveWorker(pos_dict_xy, pos_dict_z)
@@ -203,15 +201,12 @@ class PositioningLogic(GenericLogic):
             self.threadpool.start(worker)
 
     def move_xy_stage_loop(self, pos_dict_xy, pos_dict_z):
-        # compare the current position with the target position
+        # update the position indicators
         new_position = self.get_position()
-        x_pos = new_position[0]
-        y_pos = new_position[1]
         self.sigUpdatePosition.emit(new_position)
 
         if self.moving:  # make sure that movement has not been aborted
-            # if x_pos != pos_dict_xy['x'] or y_pos != pos_dict_xy['y']:
-            if (abs(x_pos - pos_dict_xy['x']) > 0.001) or (abs(y_pos - pos_dict_xy['y']) > 0.001):
+            if not self._stage_move.done():
                 # enter in a loop until xy position reached
                 worker = xyMoveWorker(pos_dict_xy, pos_dict_z)
                 worker.signals.sigxyStepFinished.connect(self.move_xy_stage_loop)
@@ -222,22 +217,21 @@ class PositioningLogic(GenericLogic):
 
     def start_move_z_stage(self, pos_dict_z):
         # start the z movement of the translation stage
-        self._stage.move_abs(pos_dict_z)
+        self._stage_move = self._stage.start_move_abs(pos_dict_z)
 
-        # start a worker thread to monitor the xy movement
+        # start a worker thread to monitor the z movement
         worker = zMoveWorker(pos_dict_z)
         worker.signals.sigzStepFinished.connect(self.move_z_stage_loop)
         self.threadpool.start(worker)
 
     def move_z_stage_loop(self, pos_dict_z):
         """  """
-        # compare the current position with the target position
+        # update the position indicators
         new_position = self.get_position()
-        z_pos = new_position[2]
         self.sigUpdatePosition.emit(new_position)
 
         if self.moving:  # make sure that movement has not been aborted
-            if z_pos != pos_dict_z['z']:
+            if not self._stage_move.done():
                 # enter in a loop until z position reached
                 worker = zMoveWorker(pos_dict_z)
                 worker.signals.sigzStepFinished.connect(self.move_z_stage_loop)
@@ -289,15 +283,10 @@ class PositioningLogic(GenericLogic):
         pos_dict_z = {key: pos_dict[key] for key in ['z']}
 
         # do the z safety movement
-        self._stage.move_abs({'z': self.z_safety_pos})
-        ready = self._stage.get_status('z')['z']
-        while not ready:
-            sleep(0.5)
-            ready = self._stage.get_status('z')['z']
-            # or use wait for idle (waitontarget) as non interface method .. or add it to the interface
+        self._stage.start_move_abs({'z': self.z_safety_pos}).wait()
 
         # start the xy movement of the translation stage
-        self._stage.move_abs(pos_dict_xy)
+        self._stage_move = self._stage.start_move_abs(pos_dict_xy)
 
         # start a worker thread to monitor the xy movement
         worker = xyMoveWorker(pos_dict_xy, pos_dict_z)
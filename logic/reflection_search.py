@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the search engine for the reflection of the IR beam on the QPD (autofocus_logic_FPGA.py).
+
+The z axis of the translation stage is swept at constant velocity while the QPD sum signal is sampled at the rate of
+the FPGA (a sample is kept for each new value of the FPGA iteration counter). The stage position of each sample is
+computed from the commanded velocity and the time elapsed since the start of the movement (the samples recorded while
+the stage accelerates or decelerates are dropped), and the reflection is located by peak detection on the
+recorded profile. A sweep stops early once the peak was passed, so that a reflection close to the starting point is
+found quickly.
+
+Example:
+    search = ReflectionSearch(stage, read_qpd, threshold=300)
+    z_peak, max_sum = search.find_peak(search.sweep(20, velocity=0.05))
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+from time import perf_counter
+import numpy as np
+
+
+class ReflectionSearch:
+    """ Continuous sweeps of the stage z axis with sampling of the QPD sum signal.
+
+    The stage must provide (in addition to the MotorInterface) start_move_rel, a non-blocking relative movement
+    returning a MotionHandle, as the ASI MS2000 stage.
+    """
+
+    def __init__(self, stage, read_qpd, threshold=300, axis='z', peak_drop=0.5, smoothing=5, acceleration_time=0.07):
+        """
+        @param stage: stage hardware module
+        @param callable read_qpd: returns the FPGA QPD values [x, y, sum, counter, iteration duration]
+        @param float threshold: minimum QPD sum of a reflection
+        @param str axis: label of the z axis of the stage
+        @param float peak_drop: the sweep is stopped when the sum drops below peak_drop * maximum after the maximum
+                                exceeded the threshold
+        @param int smoothing: number of samples of the moving average applied before the peak detection
+        @param float acceleration_time: time in s needed by the stage to reach the sweep velocity. The samples recorded
+                                        during this time are dropped
+        """
+        self._stage = stage
+        self._read_qpd = read_qpd
+        self.threshold = threshold
+        self.axis = axis
+        self.peak_drop = peak_drop
+        self.smoothing = smoothing
+        self.acceleration_time = acceleration_time
+
+    def sweep(self, distance, velocity, stop_after_peak=True):
+        """ Move the z axis by distance at the given velocity and record the QPD sum.
+
+        @param float distance: relative movement in um (the sign gives the direction)
+        @param float velocity: stage velocity during the sweep, in mm/s (stage units)
+        @param bool stop_after_peak: stop the movement once a reflection was passed
+
+        @return tuple: (np.ndarray z positions in um, np.ndarray QPD sum, float duration of the sweep in s)
+        """
+        previous_velocity = self._stage.get_velocity()[self.axis]
+        self._stage.set_velocity({self.axis: velocity})
+        try:
+            z_start = self._stage.get_pos()[self.axis]
+            times, sums = [], []
+            max_sum = 0
+            last_count = None
+            t_start = perf_counter()
+            movement = self._stage.start_move_rel({self.axis: distance})
+            t_move = perf_counter()  # the movement command was acknowledged
+            while not movement.done():
+                qpd = self._read_qpd()
+                now = perf_counter()
+                if qpd[3] != last_count:  # new FPGA iteration
+                    last_count = qpd[3]
+                    times.append(now)
+                    sums.append(qpd[2])
+                    max_sum = max(max_sum, qpd[2])
+                    if stop_after_peak and max_sum > self.threshold and qpd[2] < self.peak_drop * max_sum:
+                        self._stage.abort()
+                        break
+            t_end = perf_counter()
+            movement.wait(timeout=5)  # after an abort, wait until the stage has stopped
+        finally:
+            self._stage.set_velocity({self.axis: previous_velocity})
+
+        # constant (commanded) velocity after a linear acceleration, until the end of the movement. The position read
+        # after the end of the sweep is not used, since it includes the latency of the abort and the deceleration
+        times = np.array(times) - t_move
+        speed = velocity * 1000  # in um/s
+        keep = (times >= self.acceleration_time) & (times <= abs(distance) / speed + self.acceleration_time / 2)
+        z = z_start + np.sign(distance) * speed * (times[keep] - self.acceleration_time / 2)
+        return z, np.array(sums, dtype=np.float64)[keep], t_end - t_start
+
+    def find_peak(self, profile):
+        """ Locate the reflection in a recorded profile.
+
+        @param tuple profile: (z positions, QPD sum, ...) as returned by sweep
+
+        @return tuple: (float z position of the maximum of the smoothed profile, float maximum of the smoothed
+                        profile). The position is None if the maximum is below the threshold.
+        """
+        z, sums = profile[0], profile[1]
+        if len(sums) == 0:
+            return None, 0
+        width = min(self.smoothing, len(sums))
+        smoothed = np.convolve(sums, np.ones(width) / width, mode='same')
+        index = int(np.argmax(smoothed))
+        if smoothed[index] < self.threshold:
+            return None, float(smoothed[index])
+        # center of mass of the part of the peak above half maximum, more robust than the single maximum sample. The
+        # window is symmetric around the maximum, since a sweep stopped after the peak records only part of its tail
+        start, stop = index, index + 1
+        half = smoothed[index] / 2
+        while start > 0 and smoothed[start - 1] > half:
+            start -= 1
+        while stop < len(smoothed) and smoothed[stop] > half:
+            stop += 1
+        half_width = min(index - start, stop - 1 - index)
+        start, stop = index - half_width, index + half_width + 1
+        weights = smoothed[start:stop]
+        return float(np.dot(z[start:stop], weights) / weights.sum()), float(smoothed[index])
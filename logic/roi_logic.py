@@ -23,7 +23,7 @@ import numpy as np
 from time import sleep
 import json
 from itertools import product
-from math import ceil
+from collections import OrderedDict
 
 from core.connector import Connector
 from core.statusvariable import StatusVar
@@ -31,6 +31,9 @@ from datetime import datetime
 from logic.generic_logic import GenericLogic
 from qtpy import QtCore
 from core.util.mutex import Mutex
+from logic.roi_route import travel_time_matrix, tour_duration, optimize_route
+from logic.roi_tiling import centered_tiles, bounding_box_tiles, polygon_tiles, grid_indices, add_z
+from logic.spatial_index import SpatialIndex
 
 
 class WorkerSignals(QtCore.QObject):
@@ -86,7 +89,9 @@ class RegionOfInterestList:
         # Save name of the ROIlist. Create a generic, unambiguous one as default.
         self._name = None
         # dictionary of ROIs contained in this ROIlist with keys being the name
-        self._rois = dict()
+        self._rois = OrderedDict()  # ordered dictionary to access the last ROI directly (python 3.6)
+        # spatial index over the ROI positions, built when needed and discarded when the ROIs change
+        self._index = None
 
         self.creation_time = creation_time
         self.name = name
@@ -154,6 +159,29 @@ class RegionOfInterestList:
         origin = self.origin
         return {name: roi.position + origin for name, roi in self._rois.items()}
 
+    @property
+    def roi_position_array(self):
+        """ Positions of all ROIs as array of shape (n, 3), in the order of roi_names. """
+        if not self._rois:
+            return np.empty((0, 3))
+        return np.array([roi.position for roi in self._rois.values()]) + self.origin
+
+    @property
+    def spatial_index(self):
+        if self._index is None:
+            self._index = SpatialIndex(self.roi_position_array)
+        return self._index
+
+    def get_nearest_roi(self, x, y):
+        """ Name of the ROI closest to (x, y) and its distance, (None, inf) if the list is empty. """
+        index, distance = self.spatial_index.nearest(x, y)
+        return (None if index is None else self.roi_names[index]), distance
+
+    def get_rois_in_region(self, x_min, x_max, y_min, y_max):
+        """ Names of the ROIs inside the rectangle, in the order of the list. """
+        names = self.roi_names
+        return [names[i] for i in self.spatial_index.query_rect(x_min, x_max, y_min, y_max)]
+
     def get_roi_position(self, name):
         if not isinstance(name, str):
             raise TypeError('ROI name must be of type str.')
@@ -166,6 +194,7 @@ class RegionOfInterestList:
             raise KeyError('ROI with name "{0}" not found in ROIlist "{1}".\n'
                            'Unable to change ROI position.'.format(name, self.name))
         self._rois[name].position = np.array(new_pos, dtype=float) - self.origin
+        self._index = None
         return None
 
     ##### this method is made unavailable because only the generic name ROI_000 etc is allowed.
@@ -196,22 +225,36 @@ class RegionOfInterestList:
 
             # Create a generic name which cannot be accessed by the user
             # using the increment of the last roi in the list (deleted roi names do not get 'refilled')
-            if len(self._rois) == 0:
-                last_number = 0
-            else:
-                last_index = len(self._rois) - 1  # self._rois is a dictionary
-#                print(last_index)
-#                print(self._rois.keys())
-                keylist = [*self._rois.keys()]
-                last = keylist[last_index]  # pick the roi with the highest number in the list containing all the keys
-                last_number = int(last.strip('ROI_'))
-            new_index = last_number + 1
+            new_index = self._last_number() + 1
             str_new_index = str(new_index).zfill(3)  # zero padding
             name = 'ROI_' + str_new_index
 
             roi_inst = RegionOfInterest(position=position, name=name)
         self._rois[roi_inst.name] = roi_inst
-        return None
+        self._index = None
+        return roi_inst.name
+
+    def add_rois(self, positions):
+        """ Add many ROIs at once, with generic names continuing the numbering of the list.
+
+        @param array-like positions: array of shape (n, 3)
+
+        @return list: names of the new ROIs
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3) - self.origin
+        first_number = self._last_number() + 1
+        names = ['ROI_' + str(number).zfill(3) for number in range(first_number, first_number + len(positions))]
+        for name, position in zip(names, positions):
+            self._rois[name] = RegionOfInterest(position=position, name=name)
+        self._index = None
+        return names
+
+    def _last_number(self):
+        """ Number of the last ROI in the list (the one with the highest number), 0 for an empty list. """
+        if len(self._rois) == 0:
+            return 0
+        last = next(reversed(self._rois))  # pick the roi with the highest number in the list containing all the keys
+        return int(last.strip('ROI_'))
 
     def delete_roi(self, name):
         if not isinstance(name, str):
@@ -219,6 +262,7 @@ class RegionOfInterestList:
         if name not in self._rois:
             raise KeyError('Name "{0}" not found in ROI list.'.format(name))
         del self._rois[name]
+        self._index = None
         return None
 
     # can be activated and modified if camera image is added
@@ -366,6 +410,8 @@ class RoiLogic(GenericLogic):
     timer = None
     tracking_interval = 1
 
+    _stage_move = None  # completion handle of the last stage movement (stages providing start_move_abs)
+
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
 
@@ -448,7 +494,12 @@ class RoiLogic(GenericLogic):
     # formerly returned as list instead of tuple. in case error appears .. it worked correctly with a list
     @property
     def stage_position(self):
-        pos = self.stage().get_pos()  # this returns a dictionary of the format {'x': pos_x, 'y': pos_y}
+        return self._position_tuple(self.stage().get_pos())  # get_pos returns a dictionary of the format {'x': pos_x, 'y': pos_y}
+
+    @staticmethod
+    def _position_tuple(pos):
+        """ Convert a stage position dictionary into a tuple (x, y, z). """
+        pos = dict(pos)
         if len(pos) == 2 and 'z' not in pos.keys():  # case for the 2 axes stage
             pos['z'] = 0  # add an artificial z component so that add_roi method can be called which expects a tuple (x, y, z)
         return tuple(pos.values())[:3]  # get only the dictionary values as a tuple.
@@ -473,13 +524,8 @@ class RoiLogic(GenericLogic):
         if position is None:
             position = self.stage_position
 
-        current_roi_set = set(self.roi_names)
-
-        # Add ROI to current ROI list
-        self._roi_list.add_roi(position=position, name=name)
-
-        # Get newly added ROI name from comparing ROI names before and after addition of new ROI
-        roi_name = set(self.roi_names).difference(current_roi_set).pop()
+        # Add ROI to current ROI list, a generic name is given to the new ROI
+        roi_name = self._roi_list.add_roi(position=position, name=name)
 
         # Notify about a changed set of ROIs if necessary
         if emit_change:
@@ -489,6 +535,25 @@ class RoiLogic(GenericLogic):
         self.set_active_roi(roi_name)
         return None
 
+    def add_rois(self, positions, emit_change=True):
+        """
+        Adds many ROIs at once to the current ROI list (mosaics), with a single change notification.
+
+        @param array-like positions: array of shape (n, 3) with the (x, y, z) positions
+        @param bool emit_change: Flag indicating if the changed ROI set should be signaled.
+
+        @returns list: names of the new ROIs
+        """
+        names = self._roi_list.add_rois(positions)
+        if not names:
+            return names
+        # the last new ROI is the active one, as when adding the ROIs one by one
+        self._active_roi = names[-1]
+        if emit_change:
+            self.sigRoiListUpdated.emit({'rois': self.roi_positions})
+        self.sigActiveRoiUpdated.emit(self._active_roi)
+        return names
+
     # delete_roi can be called with a name present in the list (which will only be the generic names)
     @QtCore.Slot()
     def delete_roi(self, name=None):
@@ -524,7 +589,7 @@ class RoiLogic(GenericLogic):
         self.active_roi = None
         for name in self.roi_names:
             self._roi_list.delete_roi(name)
-            self.sigRoiUpdated.emit(name, '', np.zeros(3))
+        self.sigRoiListUpdated.emit({'rois': self.roi_positions})  # a single notification for all ROIs
         return None
 
     @QtCore.Slot(str)
@@ -545,6 +610,25 @@ class RoiLogic(GenericLogic):
         self.sigActiveRoiUpdated.emit('' if self.active_roi is None else self.active_roi)
         return None
 
+    def get_nearest_roi(self, position):
+        """
+        Returns the ROI closest to the given xy position, using the spatial index of the ROI list.
+
+        @param float[2] position: (x, y) position, further elements are ignored
+        @return tuple: (str name of the ROI or None if the list is empty, float distance)
+        """
+        return self._roi_list.get_nearest_roi(position[0], position[1])
+
+    def get_rois_in_region(self, x_range, y_range):
+        """
+        Returns the ROIs inside a rectangular region, using the spatial index of the ROI list.
+
+        @param float[2] x_range: (x_min, x_max)
+        @param float[2] y_range: (y_min, y_max)
+        @return list: names of the ROIs in the order of the ROI list
+        """
+        return self._roi_list.get_rois_in_region(min(x_range), max(x_range), min(y_range), max(y_range))
+
     def get_roi_position(self, name=None):
         """
         Returns the ROI position of the specified ROI or the active ROI if none is given.
@@ -581,11 +665,13 @@ class RoiLogic(GenericLogic):
         self._move_stage(self.get_roi_position(name))
         return None
 
-    def go_to_roi_xy(self, name=None):
+    def go_to_roi_xy(self, name=None, wait=True):
         """
         Move translation stage to the xy position of the given roi.
 
         @param str name: the name of the ROI, default is the active roi
+        @param bool wait: return at the end of the movement. If False, the movement is only started when the stage
+                          supports it: use wait_for_stage_move before acquiring data at the new position.
         """
         if name is None:
             name = self.active_roi
@@ -595,14 +681,15 @@ class RoiLogic(GenericLogic):
         x_roi, y_roi, z_roi = self.get_roi_position(name)
         x_stage, y_stage, z_stage = self.stage_position
         target_pos = np.array((x_roi, y_roi, z_stage))  # conversion from tuple to np.ndarray for call of _move_stage
-        self._move_stage(target_pos)
+        self._move_stage(target_pos, wait)
         return None
 
-    def _move_stage(self, position):
+    def _move_stage(self, position, wait=True):
         """ 
         Move the translation stage to position.
         
         @param float position: np.ndarray[3]
+        @param bool wait: return at the end of the movement (always the case for stages without start_move_abs)
         """
         # this functions accepts a tuple (x, y, z) as argument because it will be called with the roi position as argument. 
         # Hence, the input argument has to be converted into a dictionary of format {'x': x, 'y': y} to be passed to the translation stage function.
@@ -611,10 +698,31 @@ class RoiLogic(GenericLogic):
             return None
         axis_label = ('x', 'y', 'z')
         pos_dict = dict([*zip(axis_label, position)])
-        self.stage().move_abs(pos_dict)
+        stage = self.stage()
+        if hasattr(stage, 'start_move_abs'):  # the end of the movement is signaled by a completion handle
+            self._stage_move = stage.start_move_abs(pos_dict)
+            if wait:
+                self.wait_for_stage_move()
+        else:
+            self._stage_move = None
+            stage.move_abs(pos_dict)
         self.sigStageMoved.emit(position)
         return None
 
+    def wait_for_stage_move(self, timeout=30):
+        """ Wait for the end of the last movement started by go_to_roi or go_to_roi_xy.
+
+        @param float timeout: maximum waiting time in s
+
+        @returns: bool: True if the movement is finished, False in case of timeout
+        """
+        if self._stage_move is None:
+            return True
+        if not self._stage_move.wait(timeout):
+            self.log.warning(f'Stage movement not finished after {timeout} s')
+            return False
+        return True
+
     #    @QtCore.Slot()
     #    def set_cam_image(self, emit_change=True):
     #        """ Get the current xy scan data and set as scan_image of ROI. """
@@ -714,7 +822,8 @@ class RoiLogic(GenericLogic):
         return roi_list.to_dict()
 
     ################### mosaic tools
-    def add_mosaic(self, roi_width, width, height, x_center_pos=0, y_center_pos=0, z_pos=0, add=False):
+    def add_mosaic(self, roi_width, width, height, x_center_pos=0, y_center_pos=0, z_pos=0, add=False, overlap=0.0,
+                   order='serpentine'):
         """
         Defines a new list containing a serpentine scan. Parameters can be specified in the settings dialog on GUI option menu.
 
@@ -723,8 +832,11 @@ class RoiLogic(GenericLogic):
         @param height: number of tiles in y direction
         @param x_center_pos:
         @param y_center_pos:
-        @param z_pos: current z position of the stage if there is one; or 0 for two axes stage
+        @param z_pos: current z position of the stage if there is one; or 0 for two axes stage.
+                      Can also be a function z(x, y) evaluated on the arrays of tile positions (focus surface)
         @param bool add: add the mosaic to the present list (True) or start a new one (False)
+        @param float overlap: overlap between neighbouring tiles, as fraction of roi_width
+        @param str order: 'serpentine' (row by row), 'column' (serpentine column by column) or 'raster'
 
         @returns: None
         """
@@ -732,22 +844,35 @@ class RoiLogic(GenericLogic):
             if not add:
                 self.reset_roi_list()  # create a new list
 
-            # create a grid of the central points
-            grid = self.make_serpentine_grid(width, height)
-            # type conversion from list to np array for making linear, elementwise operations
-            grid_array = np.array(grid)
-            # shift and stretch the grid to create the roi centers
-            # mind the 3rd dimension so that it can be passed to the add_roi method
-            # calculate start positions (lower left corner of the grid) given the central position
-            x_start_pos = x_center_pos - roi_width * (width - 1) / 2
-            y_start_pos = y_center_pos - roi_width * (height - 1) / 2
-            roi_centers = grid_array * roi_width + [x_start_pos, y_start_pos, z_pos]
-
-            for item in roi_centers:
-                self.add_roi(item)
+            # tile centers of the grid centered on the given position, in visiting order
+            xy = centered_tiles(x_center_pos, y_center_pos, width, height, roi_width, overlap, order)
+            self.add_rois(add_z(xy, z_pos))
         except Exception:
             self.log.error('Could not create mosaic')
 
+    def add_polygon_mosaic(self, polygon, roi_width, z_pos=0, overlap=0.0, order='serpentine', add=True):
+        """
+        Covers a polygon (or the rectangle given by its bounding box) with tiles. Only the tiles whose center lies inside
+        the polygon are added.
+
+        @param array-like polygon: vertices (x, y) of the polygon, at least 3
+        @param roi_width: size of a tile
+        @param z_pos: z position of the tiles, or a function z(x, y) evaluated on the arrays of tile positions
+        @param float overlap: overlap between neighbouring tiles, as fraction of roi_width
+        @param str order: 'serpentine' (row by row), 'column' (serpentine column by column) or 'raster'
+        @param bool add: add the mosaic to the present list (True) or start a new one (False)
+
+        @returns: int number of added tiles
+        """
+        try:
+            xy = polygon_tiles(polygon, roi_width, overlap, order)
+            if not add:
+                self.reset_roi_list()
+            return len(self.add_rois(add_z(xy, z_pos)))
+        except Exception as e:
+            self.log.error(f'Could not create mosaic: {e}')
+            return 0
+
     def make_serpentine_grid(self, width, height):
         """ creates the grid points for a serpentine scan, with ascending x values in even numbered rows and descending x values in odd values rows.
         Each element is appended with z = 0.
@@ -757,18 +882,7 @@ class RoiLogic(GenericLogic):
 
         returns: list gridpoints: list with points in serpentine scan order
         """
-        list_even = [(x, y, 0) for y in range(height) for x in range(width) if y % 2 == 0]
-        list_odd = [(x, y, 0) for y in range(height) for x in reversed(range(width)) if y % 2 != 0]
-        list_all = list_even + list_odd
-        gridpoints = sorted(list_all, key=self.sort_second)
-        return gridpoints
-
-    def sort_second(self, val):
-        """ helper function for sorting a list of tuples by the second element of each tuple, used for setting up the serpentine grid
-
-        @returns: the second element of value (in the context here, value is a 3dim tuple (x, y, z))
-        """
-        return val[1]
+        return [(x, y, 0) for x, y in grid_indices(width, height, 'serpentine').tolist()]
 
     # with this overloading it is possible to call it from gui without specifying a roi_distance . the default value is taken
     # but maybe modify to send the selected value with it..
@@ -783,58 +897,80 @@ class RoiLogic(GenericLogic):
         @:returns: None
         """
 
-        if len(self.roi_positions) < 2:
+        if len(self.roi_names) < 2:
             self.log.warning('Please specify at least 2 ROIs to perform an interpolation')
         else:
             try:
                 # find the minimal and maximal x and y coordonates from the current roi_list
-                xmin = min([self.roi_positions[key][0] for key in self.roi_positions])
-                xmax = max([self.roi_positions[key][0] for key in self.roi_positions])
-                ymin = min([self.roi_positions[key][1] for key in self.roi_positions])
-                ymax = max([self.roi_positions[key][1] for key in self.roi_positions])
-                # print(xmin, xmax, ymin, ymax)
-
-                # calculate the number of tiles needed
-                width = abs(xmax - xmin)
-                height = abs(ymax - ymin)
-                # print(width, height)
-                num_x = ceil(width / roi_distance) + 1  # number of tiles in x direction
-                num_y = ceil(height / roi_distance) + 1  # number of tiles in y direction
-                # print(num_x, num_y)
-
-                # create a grid of the central points
-                grid = self.make_serpentine_grid(int(num_x), int(
-                    num_y))  # type conversion necessary because xmin etc are numpy floats
-                # type conversion from list to np array for making linear, elementwise operations
-                grid_array = np.array(grid)
+                positions = self._roi_list.roi_position_array
+                xmin, ymin = positions[:, :2].min(axis=0)
+                xmax, ymax = positions[:, :2].max(axis=0)
+
+                # create a grid of the central points, the first center point is in (x_min, y_min)
+                xy = bounding_box_tiles(xmin, xmax, ymin, ymax, roi_distance)
                 # get the current z position of the stage to keep the same level for all rois defined in the interpolation
                 # alternative: set it to 0. What should be done in case the different rois are not on the same z level ?
                 z = self.stage_position[2]
-                # stretch the grid and shift it so that the first center point is in (x_min, y_min)
-                roi_centers = grid_array * roi_distance + [xmin, ymin, z]
-                # print(roi_centers)
 
                 # list is not reset before adding new rois. we might end up having some overlapping exactly the initial ones.
                 # to discuss if the initial ones shall be kept
                 # or think of a method how to get rid of the twice defined positions
-                for item in roi_centers:
-                    self.add_roi(item)
+                self.add_rois(add_z(xy, z))
 
             except Exception:
                 self.log.error('Could not create interpolation')
 
+    ################### route optimization
+    def get_optimized_roi_order(self, velocity=None, start=None):
+        """ Order in which the ROIs are visited with the shortest travel time of the stage, including the return to the
+        first ROI at the end of a cycle. The order of the ROI list itself is not modified.
+
+        @param dict velocity: velocity of the x and y axes in mm/s, for example {'x': 1, 'y': 1}.
+                              Default: current velocity of the stage
+        @param str start: name of the first ROI. Default: ROI closest to the current stage position
+
+        @returns: tuple (list of ROI names in visiting order, float duration of a cycle in name order in s,
+                         float duration of a cycle in optimized order in s). The durations only include the travel time.
+        """
+        names = self.roi_names
+        if len(names) == 0:
+            return [], 0.0, 0.0
+        positions = np.array([self.roi_positions[name] for name in names])
+        if velocity is None:
+            velocity = self.stage().get_velocity()
+        cost = travel_time_matrix(positions, velocity)
+
+        if start is None:
+            stage_xy = np.array(self.stage_position[:2], dtype=float)
+            start_index = int(np.argmin(np.abs(positions[:, :2] - stage_xy).max(axis=1)))
+        else:
+            start_index = names.index(start)
+        order = optimize_route(cost, start_index)
+
+        initial_duration = tour_duration(np.arange(len(names)), cost)
+        optimized_duration = tour_duration(order, cost)
+        self.log.info(f'Optimized ROI order: travel time per cycle {optimized_duration:.1f} s instead of '
+                      f'{initial_duration:.1f} s (saving {initial_duration - optimized_duration:.1f} s)')
+        return [names[i] for i in order], initial_duration, optimized_duration
+
     # functions for the tracking mode of the stage position.
     # using a timer as first approach (did not work because i put the timer into __init__ but it should have gone in on_activate
     # alternatively, use worker thread as for temperature tracking in basic_gui
     # worker thread version
     def start_tracking(self):
         self.tracking = True
+        if self._stage_publishes_position():
+            # the stage publishes its position snapshots (ASI MS2000): no additional serial queries are needed
+            self.stage().sigPositionUpdated.connect(self._stage_position_updated)
+            return
         # monitor the current stage position, using a worker thread
         worker = Worker()
         worker.signals.sigFinished.connect(self.tracking_loop)
         self.threadpool.start(worker)
 
     def stop_tracking(self):
+        if self.tracking and self._stage_publishes_position():
+            self.stage().sigPositionUpdated.disconnect(self._stage_position_updated)
         self.tracking = False
         # get once again the latest position
         position = self.stage_position
@@ -850,6 +986,23 @@ class RoiLogic(GenericLogic):
             worker.signals.sigFinished.connect(self.tracking_loop)
             self.threadpool.start(worker)
 
+    def _stage_publishes_position(self):
+        """ Check if the stage polls its position in the background and publishes it with sigPositionUpdated.
+
+        @return bool: False if the position must be queried by the tracking loop
+        """
+        stage = self.stage()
+        return hasattr(stage, 'sigPositionUpdated') and hasattr(stage, 'is_position_polled') \
+            and stage.is_position_polled()
+
+    def _stage_position_updated(self, snapshot):
+        """ Forward a position snapshot published by the stage to the GUI in tracking mode.
+
+        @param dict snapshot: {'time': float, 'position': dict, 'status': str}
+        """
+        if self.tracking:
+            self.sigUpdateStagePosition.emit(self._position_tuple(snapshot['position']))
+
     def set_stage_velocity(self, param_dict):
         self.stage().set_velocity(param_dict)
 
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the route optimizer used to find a short order in which the ROIs are visited (roi_logic.py).
+
+The ROIs of a multi-ROI task are visited in each cycle, and the stage returns to the first ROI at the end of the cycle.
+The visiting order is therefore a closed tour. Its cost is the travel time of the stage: the x and y axes move
+simultaneously, each with its own velocity, so that a displacement takes max(|dx| / v_x, |dy| / v_y).
+
+The tour is built with the nearest neighbour heuristic starting at the given ROI, and improved by 2-opt moves
+(reversal of a segment of the tour) until no move shortens it. For the typical 30 - 100 ROIs this takes a few ms and
+the result is within a few percent of the optimal tour.
+
+Example:
+    cost = travel_time_matrix(positions, velocity={'x': 1, 'y': 1})
+    order = optimize_route(cost, start=0)
+    saving = tour_duration(range(len(positions)), cost) - tour_duration(order, cost)
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+import numpy as np
+
+
+def travel_time_matrix(positions, velocity):
+    """ Travel time of the stage between each pair of positions.
+
+    @param array-like positions: array of shape (n, 2) or (n, 3) with the x, y (and z) positions in um. z is ignored.
+    @param dict velocity: velocity of the x and y axes in mm/s (stage units), for example {'x': 1, 'y': 1}
+
+    @return numpy.ndarray: symmetric array of shape (n, n) with the travel times in s
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(len(positions), -1)[:, :2]
+    velocity = np.array([velocity['x'], velocity['y']], dtype=np.float64) * 1000  # in um/s
+    distance = np.abs(positions[:, np.newaxis, :] - positions[np.newaxis, :, :])
+    return (distance / velocity).max(axis=2)
+
+
+def tour_duration(order, cost):
+    """ Duration of the closed tour visiting the positions in the given order and returning to the first one.
+
+    @param array-like order: indices of the positions in visiting order
+    @param numpy.ndarray cost: travel time matrix
+
+    @return float: duration in s
+    """
+    order = np.asarray(order, dtype=int)
+    if len(order) < 2:
+        return 0.0
+    return float(cost[order, np.roll(order, -1)].sum())
+
+
+def nearest_neighbour_tour(cost, start=0):
+    """ Build a tour by moving each time to the closest position not yet visited.
+
+    @param numpy.ndarray cost: travel time matrix
+    @param int start: index of the first position
+
+    @return numpy.ndarray: indices of the positions in visiting order
+    """
+    n = len(cost)
+    order = [start]
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    for _ in range(n - 1):
+        distances = np.where(visited, np.inf, cost[order[-1]])
+        following = int(np.argmin(distances))
+        order.append(following)
+        visited[following] = True
+    return np.array(order, dtype=int)
+
+
+def two_opt(order, cost):
+    """ Improve a closed tour by reversing segments as long as this shortens it. The first position stays first.
+
+    Reversing order[i:j + 1] replaces the edges (order[i - 1], order[i]) and (order[j], order[j + 1]) by
+    (order[i - 1], order[j]) and (order[i], order[j + 1]). The gain of all j is evaluated at once for each i.
+
+    @param array-like order: initial tour
+    @param numpy.ndarray cost: symmetric travel time matrix
+
+    @return numpy.ndarray: improved tour
+    """
+    order = np.array(order, dtype=int)
+    n = len(order)
+    if n < 4:  # every closed tour of 3 positions has the same duration
+        return order
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            j = np.arange(i + 1, n)
+            following = order[(j + 1) % n]
+            gain = (cost[order[i - 1], order[i]] + cost[order[j], following]
+                    - cost[order[i - 1], order[j]] - cost[order[i], following])
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                order[i:j[best] + 1] = order[i:j[best] + 1][::-1]
+                improved = True
+    return order
+
+
+def optimize_route(cost, start=0):
+    """ Short closed tour through all positions, starting at start.
+
+    @param numpy.ndarray cost: symmetric travel time matrix
+    @param int start: index of the first position
+
+    @return numpy.ndarray: indices of the positions in visiting order
+    """
+    if len(cost) == 0:
+        return np.array([], dtype=int)
+    return two_opt(nearest_neighbour_tour(cost, start), cost)
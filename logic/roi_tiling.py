@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the tiling engine used to create the ROIs of a mosaic (roi_logic.py).
+
+The tile centers are calculated at once with numpy for a whole grid, so that mosaics covering a complete coverslip
+(thousands of tiles) are created in a few ms. A grid is defined by its first tile center, the tile size and the
+overlap between neighbouring tiles (fraction of the tile size). The tiles can be visited:
+- 'serpentine': row by row, x ascending in the even rows and descending in the odd rows,
+- 'column': column by column, y ascending in the even columns and descending in the odd columns,
+- 'raster': row by row, x always ascending.
+
+A grid can cover a rectangle (bounding box) or a polygon: in the second case only the tiles whose center is inside the
+polygon are kept. The z position of the tiles is either a constant or given by a function z(x, y) evaluated on the
+arrays of tile positions, for example the focus surface fitted to the autofocus positions.
+
+Example:
+    xy = polygon_tiles([(0, 0), (1000, 0), (500, 800)], tile_size=100, overlap=0.1)
+    tiles = add_z(xy, z=lambda x, y: 0.001 * x + 5)
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+from math import ceil
+import numpy as np
+
+ORDERS = ('serpentine', 'column', 'raster')
+
+
+def grid_indices(num_x, num_y, order='serpentine'):
+    """ Column and row indices of the tiles of a grid in visiting order.
+
+    @param int num_x: number of columns (x direction)
+    @param int num_y: number of rows (y direction)
+    @param str order: 'serpentine', 'column' or 'raster'
+
+    @return numpy.ndarray: int array of shape (num_x * num_y, 2) with the column and row index of each tile
+    """
+    if order not in ORDERS:
+        raise ValueError(f'Tile order must be one of {ORDERS}')
+    ix, iy = np.meshgrid(np.arange(num_x), np.arange(num_y))  # one line per row
+    if order == 'serpentine':
+        ix[1::2] = ix[1::2, ::-1]
+    elif order == 'column':
+        ix, iy = ix.T.copy(), iy.T.copy()  # one line per column
+        iy[1::2] = iy[1::2, ::-1]
+    return np.stack([ix.ravel(), iy.ravel()], axis=1)
+
+
+def tile_step(tile_size, overlap=0.0):
+    """ Distance between the centers of neighbouring tiles.
+
+    @param float tile_size: size of a tile
+    @param float overlap: overlap between neighbouring tiles, as fraction of the tile size (0 <= overlap < 1)
+    """
+    if not 0 <= overlap < 1:
+        raise ValueError('Tile overlap must be in the range [0, 1)')
+    return tile_size * (1 - overlap)
+
+
+def grid_tiles(x_start, y_start, num_x, num_y, tile_size, overlap=0.0, order='serpentine'):
+    """ Tile centers of a grid starting at (x_start, y_start).
+
+    @return numpy.ndarray: float array of shape (num_x * num_y, 2) with the x and y positions in visiting order
+    """
+    return grid_indices(num_x, num_y, order) * tile_step(tile_size, overlap) + [x_start, y_start]
+
+
+def centered_tiles(x_center, y_center, num_x, num_y, tile_size, overlap=0.0, order='serpentine'):
+    """ Tile centers of a grid of num_x * num_y tiles centered on (x_center, y_center). """
+    step = tile_step(tile_size, overlap)
+    return grid_tiles(x_center - step * (num_x - 1) / 2, y_center - step * (num_y - 1) / 2, num_x, num_y,
+                      tile_size, overlap, order)
+
+
+def bounding_box_tiles(x_min, x_max, y_min, y_max, tile_size, overlap=0.0, order='serpentine'):
+    """ Tile centers covering a rectangle: the first tile is centered on (x_min, y_min) and the last column and row
+    reach at least x_max and y_max. """
+    step = tile_step(tile_size, overlap)
+    # the small tolerance avoids an additional column or row when the extent is a multiple of the step
+    num_x = ceil(abs(x_max - x_min) / step - 1e-9) + 1
+    num_y = ceil(abs(y_max - y_min) / step - 1e-9) + 1
+    return grid_tiles(min(x_min, x_max), min(y_min, y_max), num_x, num_y, tile_size, overlap, order)
+
+
+def points_in_polygon(points, polygon):
+    """ Even-odd rule test of many points against a polygon.
+
+    @param array-like points: array of shape (n, 2) (further columns are ignored)
+    @param array-like polygon: vertices of shape (m, 2), the polygon is closed automatically
+
+    @return numpy.ndarray: bool array of shape (n,)
+    """
+    points = np.asarray(points, dtype=np.float64)
+    polygon = np.asarray(polygon, dtype=np.float64)
+    x, y = points[:, 0], points[:, 1]
+    inside = np.zeros(len(points), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        crosses = (y1 > y) != (y2 > y)  # always False for a horizontal edge
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (x < x_cross)
+    return inside
+
+
+def polygon_tiles(polygon, tile_size, overlap=0.0, order='serpentine'):
+    """ Tile centers inside a polygon, on the grid covering its bounding box, in visiting order.
+
+    @param array-like polygon: vertices (x, y) of shape (m, 2), at least 3 vertices
+
+    @return numpy.ndarray: float array of shape (n, 2)
+    """
+    polygon = np.asarray(polygon, dtype=np.float64)
+    if polygon.ndim != 2 or len(polygon) < 3:
+        raise ValueError('Polygon must be given by at least 3 vertices (x, y)')
+    (x_min, y_min), (x_max, y_max) = polygon[:, :2].min(axis=0), polygon[:, :2].max(axis=0)
+    tiles = bounding_box_tiles(x_min, x_max, y_min, y_max, tile_size, overlap, order)
+    return tiles[points_in_polygon(tiles, polygon)]
+
+
+def add_z(xy, z=0.0):
+    """ Append the z position to the tile centers.
+
+    @param numpy.ndarray xy: array of shape (n, 2)
+    @param z: float, or callable z(x, y) evaluated on the arrays of x and y positions
+
+    @return numpy.ndarray: float array of shape (n, 3)
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    z_values = z(xy[:, 0], xy[:, 1]) if callable(z) else z
+    return np.column_stack([xy, np.broadcast_to(np.asarray(z_values, dtype=np.float64), len(xy))])
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the spatial index over the ROI positions (roi_logic.py).
+
+The xy plane is divided into square cells, and the indices of the positions are sorted by cell. A query only examines
+the positions in the cells overlapping the queried region, so that nearest neighbour lookups and region queries stay
+fast for lists of many thousand ROIs (mosaics covering a complete coverslip). The index is built with numpy in a few ms
+and is rebuilt when the ROI list changes.
+
+Example:
+    index = SpatialIndex(positions)  # array of shape (n, 2) or (n, 3), z is ignored
+    i, distance = index.nearest(x, y)
+    indices = index.query_rect(x_min, x_max, y_min, y_max)
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+from math import ceil, sqrt
+import numpy as np
+
+
+class SpatialIndex:
+    """ Uniform grid of cells over xy positions. """
+
+    def __init__(self, positions, cell_size=None):
+        """
+        @param array-like positions: array of shape (n, 2) or (n, 3)
+        @param float cell_size: size of the cells. Default: about one position per cell for a uniform distribution
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        self.positions = positions.reshape(-1, positions.shape[-1])[:, :2] if positions.size else np.empty((0, 2))
+        if cell_size is None:
+            extent = float(np.ptp(self.positions, axis=0).max()) if len(self.positions) else 0.0
+            cell_size = extent / sqrt(len(self.positions)) if extent > 0 else 1.0
+        self.cell_size = cell_size
+        cells = np.floor(self.positions / cell_size).astype(np.int64)
+        self._origin = cells.min(axis=0) if len(cells) else np.zeros(2, dtype=np.int64)
+        cells -= self._origin
+        self._shape = cells.max(axis=0) + 1 if len(cells) else np.zeros(2, dtype=np.int64)
+        # the positions are sorted by column of cells, then by row: a column range of cells is a contiguous slice
+        keys = cells[:, 0] * int(self._shape[1]) + cells[:, 1]
+        self._order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._order]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _cell(self, x, y):
+        """ Cell (column, row) containing (x, y), relative to the origin of the grid (can be outside of the grid). """
+        return (int(np.floor(x / self.cell_size)) - int(self._origin[0]),
+                int(np.floor(y / self.cell_size)) - int(self._origin[1]))
+
+    def _candidates(self, ix_min, ix_max, iy_min, iy_max):
+        """ Indices of the positions in the cells [ix_min, ix_max] x [iy_min, iy_max]. """
+        ix_min, iy_min = max(ix_min, 0), max(iy_min, 0)
+        ix_max, iy_max = min(ix_max, int(self._shape[0]) - 1), min(iy_max, int(self._shape[1]) - 1)
+        if ix_min > ix_max or iy_min > iy_max:
+            return np.empty(0, dtype=np.int64)
+        columns = np.arange(ix_min, ix_max + 1) * int(self._shape[1])
+        starts = np.searchsorted(self._sorted_keys, columns + iy_min, side='left')
+        stops = np.searchsorted(self._sorted_keys, columns + iy_max, side='right')
+        return np.concatenate([self._order[start:stop] for start, stop in zip(starts, stops)])
+
+    def query_rect(self, x_min, x_max, y_min, y_max):
+        """ Indices of the positions inside the rectangle (borders included), in ascending order.
+
+        @return numpy.ndarray: int array
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64)
+        ix_min, iy_min = self._cell(x_min, y_min)
+        ix_max, iy_max = self._cell(x_max, y_max)
+        candidates = self._candidates(ix_min, ix_max, iy_min, iy_max)
+        x, y = self.positions[candidates, 0], self.positions[candidates, 1]
+        inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        return np.sort(candidates[inside])
+
+    def query_radius(self, x, y, radius):
+        """ Indices of the positions within the distance radius of (x, y), in ascending order. """
+        candidates = self.query_rect(x - radius, x + radius, y - radius, y + radius)
+        distance = np.hypot(self.positions[candidates, 0] - x, self.positions[candidates, 1] - y)
+        return candidates[distance <= radius]
+
+    def nearest(self, x, y):
+        """ Position closest to (x, y).
+
+        The cells are searched in growing squares around the cell of (x, y). Once a position at the distance d was
+        found, the search square is extended so that it contains the whole disk of radius d.
+
+        @return tuple: (int index of the position, float distance), (None, inf) if the index is empty
+        """
+        if len(self) == 0:
+            return None, float('inf')
+        cx, cy = self._cell(x, y)
+        # distance of (x, y) to the grid: the first square must at least reach the grid
+        radius = max(0, -cx, -cy, cx - int(self._shape[0]) + 1, cy - int(self._shape[1]) + 1)
+        while True:
+            candidates = self._candidates(cx - radius, cx + radius, cy - radius, cy + radius)
+            if len(candidates):
+                distance = np.hypot(self.positions[candidates, 0] - x, self.positions[candidates, 1] - y)
+                best = int(np.argmin(distance))
+                # the square of cells contains all positions closer than radius * cell_size
+                if distance[best] <= radius * self.cell_size:
+                    return int(candidates[best]), float(distance[best])
+                radius = max(radius + 1, int(ceil(distance[best] / self.cell_size)))
+            else:
+                radius = 2 * radius + 1
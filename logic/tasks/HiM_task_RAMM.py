@@ -22,6 +22,8 @@ Config example pour copy-paste:
             valves: 'valve_logic'
             pos: 'positioning_logic'
             flow: 'flowcontrol_logic'
+            # zstack: 'zstack_logic'  # optional: hardware-timed z stacks
+            # image_focus: 'image_autofocus_logic'  # optional: sharpest plane of each stack (first laser line)
         config:
             path_to_user_config: 'C:/Users/sCMOS-1/qudi_data/qudi_task_config_files/hi_m_task_RAMM.yaml'
 """
@@ -33,6 +35,7 @@ import time
 from datetime import datetime
 from tqdm import tqdm
 from logic.generic_task import InterruptableTask
+from logic.frame_metadata import FrameMetadataRecorder
 
 
 class Task(InterruptableTask):  # do not change the name of the class. it is always called Task !
@@ -106,6 +109,20 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         self.num_frames = self.num_z_planes * self.num_laserlines
         self.ref['cam'].prepare_camera_for_multichannel_imaging(self.num_frames, self.exposure, None, None, None)
 
+        # per-frame metadata (timestamps, z positions, illumination, stage position, autofocus signal) of each stack
+        self.frame_metadata = FrameMetadataRecorder(self.num_frames)
+        self.laser_lines = [item[0] for item in self.imaging_sequence]
+        self.laser_intensities = [item[1] for item in self.imaging_sequence]
+
+        # h5 format: all stacks are saved in a single container, with one entry per probe and roi
+        if self.file_format == 'h5':
+            self.container_path = os.path.join(self.directory, os.path.basename(self.directory) + '.h5')
+            self.ref['cam'].open_dataset_container(self.container_path, self.num_z_planes, self.num_laserlines,
+                                                   roi_names=self.roi_names,
+                                                   cycle_names=[probe[1] for probe in self.probe_list],
+                                                   channel_names=[item[0] for item in self.imaging_sequence],
+                                                   attributes={'Sample name': self.sample_name})
+
         # initialize a counter to iterate over the number of probes to inject
         self.probe_counter = 0
 
@@ -236,23 +253,32 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
             #     time.sleep(0.1)
             #     busy = self.ref['focus'].piezo_correction_running
 
-            for item in self.roi_names:
+            for item in self.roi_order:
                 if self.aborted:
                     break
 
                 # create the save path for each roi --------------------------------------------------------------------
-                cur_save_path = self.get_complete_path(self.directory, item, self.probe_list[self.probe_counter - 1][1])
+                if self.file_format == 'h5':
+                    cur_save_path = self.container_path
+                else:
+                    cur_save_path = self.get_complete_path(self.directory, item,
+                                                           self.probe_list[self.probe_counter - 1][1])
 
                 # move to roi ------------------------------------------------------------------------------------------
                 self.ref['roi'].active_roi = None
                 self.ref['roi'].set_active_roi(name=item)
-                self.ref['roi'].go_to_roi_xy()
+                self.ref['roi'].go_to_roi_xy(wait=False)
+
+                # autofocus --------------------------------------------------------------------------------------------
+                # the roi position is used as stage position (reading the stage via the serial port is too slow)
+                stage_x, stage_y = self.ref['roi'].get_roi_position(item)[:2]
+                # start the search close to the focus predicted from the rois already visited. The piezo is positioned
+                # while the stage is moving
+                self.ref['focus'].go_to_predicted_focus_position(stage_x, stage_y)
+                self.ref['roi'].wait_for_stage_move()
                 self.log.info('Moved to {}'.format(item))
-                time.sleep(1)  # replace maybe by wait for idle
                 if self.logging:
                     add_log_entry(self.log_path, self.probe_counter, 2, f'Moved to {item}')
-
-                # autofocus --------------------------------------------------------------------------------------------
                 self.ref['focus'].start_search_focus()
                 # need to ensure that focus is stable here.
                 ready = self.ref['focus']._stage_is_positioned
@@ -265,76 +291,112 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                         break
 
                 reference_position = self.ref['focus'].get_position()  # save it to go back to this plane after imaging
+                if ready:  # update the focus map only with converged positions
+                    self.ref['focus'].record_focus_position(stage_x, stage_y, reference_position, name=item)
                 start_position = self.calculate_start_position(self.centered_focal_plane)
 
                 # imaging sequence -----------------------------------------------------------------------------------------
-                # prepare the daq: set the digital output to 0 before starting the task
-                self.ref['daq'].write_to_do_channel(1, np.array([0], dtype=np.uint8), self.ref['daq']._daq.DIO3_taskhandle)
-
-                # start camera acquisition
-                self.ref['cam'].stop_acquisition()   # for safety
-                self.ref['cam'].start_acquisition()
-
-                # initialize arrays to save the target and current z positions
-                z_target_positions = []
-                z_actual_positions = []
+                self.frame_metadata.reset()
 
                 print(f'{item}: performing z stack..')
-
-                for plane in tqdm(range(self.num_z_planes)):
-                    # print(f'plane number {plane + 1}')
-
-                    # position the piezo
-                    position = start_position + plane * self.z_step
-                    self.ref['focus'].go_to_position(position)
-                    # print(f'target position: {position} um')
-                    time.sleep(0.03)
-                    cur_pos = self.ref['focus'].get_position()
-                    # print(f'current position: {cur_pos} um')
-                    z_target_positions.append(position)
-                    z_actual_positions.append(cur_pos)
-
-                    # send signal from daq to FPGA connector 0/DIO3 ('piezo ready')
-                    self.ref['daq'].write_to_do_channel(1, np.array([1], dtype=np.uint8), self.ref['daq']._daq.DIO3_taskhandle)
-                    time.sleep(0.005)
+                # autofocus signal at the reference plane, read once per stack to keep the plane loop free of
+                # detector reads
+                autofocus_signal = self.ref['focus'].read_detector_signal()
+
+                if 'zstack' in self.ref:  # hardware-timed z stack: piezo positions and triggers are run by the daq
+                    image_data, z_target_positions, z_actual_positions, timestamps = self.ref['zstack'].run_zstack(
+                        start_position, self.num_z_planes, self.z_step, self.imaging_sequence, self.exposure,
+                        return_position=reference_position)
+                    for plane in range(self.num_z_planes):
+                        self.frame_metadata.record_plane(timestamps[plane], z_target_positions[plane],
+                                                         z_actual_positions[plane], self.laser_lines,
+                                                         self.laser_intensities, stage_x, stage_y, autofocus_signal)
+                else:
+                    # prepare the daq: set the digital output to 0 before starting the task
                     self.ref['daq'].write_to_do_channel(1, np.array([0], dtype=np.uint8), self.ref['daq']._daq.DIO3_taskhandle)
 
-                    # wait for signal from FPGA to DAQ ('acquisition ready')
-                    fpga_ready = self.ref['daq'].read_do_channel(1, self.ref['daq']._daq.DIO4_taskhandle)[0]
-                    t0 = time.time()
-
-                    while not fpga_ready:
-                        time.sleep(0.001)
-                        fpga_ready = self.ref['daq'].read_do_channel(1, self.ref['daq']._daq.DIO4_taskhandle)[0]
-
-                        t1 = time.time() - t0
-                        if t1 > 1:  # for safety: timeout if no signal received within 1 s
+                    # start camera acquisition
+                    self.ref['cam'].stop_acquisition()   # for safety
+                    self.ref['cam'].start_acquisition()
+
+                    # initialize arrays to save the target and current z positions
+                    z_target_positions = []
+                    z_actual_positions = []
+
+                    for plane in tqdm(range(self.num_z_planes)):
+                        # print(f'plane number {plane + 1}')
+
+                        # position the piezo
+                        position = start_position + plane * self.z_step
+                        self.ref['focus'].go_to_position(position)
+                        # print(f'target position: {position} um')
+                        time.sleep(0.03)
+                        cur_pos = self.ref['focus'].get_position()
+                        # print(f'current position: {cur_pos} um')
+                        z_target_positions.append(position)
+                        z_actual_positions.append(cur_pos)
+                        self.frame_metadata.record_plane(time.time(), position, cur_pos, self.laser_lines,
+                                                         self.laser_intensities, stage_x, stage_y, autofocus_signal)
+
+                        # send signal from daq to FPGA connector 0/DIO3 ('piezo ready')
+                        self.ref['daq'].arm_di_edge_detection()
+                        self.ref['daq'].write_to_do_channel(1, np.array([1], dtype=np.uint8), self.ref['daq']._daq.DIO3_taskhandle)
+                        time.sleep(0.005)
+                        self.ref['daq'].write_to_do_channel(1, np.array([0], dtype=np.uint8), self.ref['daq']._daq.DIO3_taskhandle)
+
+                        # wait for signal from FPGA to DAQ ('acquisition ready'), detected by the daq hardware
+                        # for safety: timeout if no signal received within 1 s
+                        if not self.ref['daq'].wait_for_di_edge(timeout=1):
                             self.log.warning('Timeout occurred')
-                            break
 
-                self.ref['focus'].go_to_position(reference_position)
+                    self.ref['focus'].go_to_position(reference_position)
+
+                    image_data = self.ref['cam'].get_acquired_data()
+
+                # sharpest plane of the sample, determined on the acquired stack (no additional exposure) -------------
+                if 'image_focus' in self.ref:
+                    try:
+                        z_sharpest, on_edge, _ = self.ref['image_focus'].focus_from_stack(
+                            image_data[::self.num_laserlines], z_actual_positions)
+                    except ValueError as e:  # for example a frame missing in the stack, not worth stopping the task
+                        self.log.warning(f'{item}: sharpest plane not determined: {e}')
+                    else:
+                        if on_edge:
+                            self.log.warning(f'{item}: sharpest plane at the border of the stack '
+                                             f'({z_sharpest:.2f} um)')
+                        else:
+                            self.log.info(f'{item}: sharpest plane at {z_sharpest - reference_position:+.2f} um '
+                                          f'from the reference plane')
 
                 # data handling ----------------------------------------------------------------------------------------
-                image_data = self.ref['cam'].get_acquired_data()
-
-                if self.file_format == 'fits':
-                    metadata = self.get_fits_metadata()
-                    self.ref['cam']._save_to_fits(cur_save_path, image_data, metadata)
-                else:  # use tiff as default format
-                    self.ref['cam']._save_to_tiff(self.num_frames, cur_save_path, image_data)
+                # the image data is written in the background while the task moves on to the next roi
+                if self.file_format == 'h5':  # metadata and z positions are saved in the container
                     metadata = self.get_metadata()
-                    file_path = cur_save_path.replace('tiff', 'yaml', 1)
-                    self.save_metadata_file(metadata, file_path)
-
-                # save file with z positions (same procedure for either file format)
-                file_path = os.path.join(os.path.split(cur_save_path)[0], 'z_positions.yaml')
-                self.save_z_positions_to_file(z_target_positions, z_actual_positions, file_path)
+                    self.ref['cam'].save_async(cur_save_path, image_data, metadata, file_format='h5',
+                                               cycle=self.probe_counter - 1, roi=self.roi_names.index(item),
+                                               z_positions=(z_target_positions, z_actual_positions),
+                                               frame_metadata=self.frame_metadata.get_data())
+                else:
+                    if self.file_format == 'fits':
+                        metadata = self.get_fits_metadata()
+                        self.ref['cam'].save_async(cur_save_path, image_data, metadata, file_format='fits',
+                                                   frame_metadata=self.frame_metadata.get_data())
+                    else:  # use tiff as default format
+                        metadata = self.get_metadata()
+                        self.ref['cam'].save_async(cur_save_path, image_data, metadata, file_format='tiff',
+                                                   frame_metadata=self.frame_metadata.get_data())
+                        file_path = cur_save_path.replace('tiff', 'yaml', 1)
+                        self.save_metadata_file(metadata, file_path)
+
+                    # save file with z positions (same procedure for either file format)
+                    file_path = os.path.join(os.path.split(cur_save_path)[0], 'z_positions.yaml')
+                    self.save_z_positions_to_file(z_target_positions, z_actual_positions, file_path)
 
                 if self.logging:  # to modify: check if data saved correctly before writing this log entry
-                    add_log_entry(self.log_path, self.probe_counter, 2, 'Image data saved', 'info')
+                    add_log_entry(self.log_path, self.probe_counter, 2, 'Image data handed over for saving', 'info')
 
             # go back to first ROI (to avoid a long displacement just before restarting imaging)
-            self.ref['roi'].set_active_roi(name=self.roi_names[0])
+            self.ref['roi'].set_active_roi(name=self.roi_order[0])
             self.ref['roi'].go_to_roi_xy()
 
             if self.logging:
@@ -445,6 +507,9 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
     def cleanupTask(self):
         """ """
         self.log.info('cleanupTask called')
+        # wait until all image data is written to disk
+        self.ref['cam'].flush()
+        self.ref['cam'].close_dataset_container()  # h5 format
         if self.logging:
             self.status_dict = {}
             write_status_dict_to_file(self.status_dict_path, self.status_dict)
@@ -506,6 +571,7 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                 self.file_format = self.user_param_dict['file_format']
                 self.roi_list_path = self.user_param_dict['roi_list_path']
                 self.injections_path = self.user_param_dict['injections_path']
+                self.optimize_roi_order = self.user_param_dict.get('optimize_roi_order', False)  # optional entry
 
         except Exception as e:  # add the type of exception
             self.log.warning(f'Could not load user parameters for task {self.name}: {e}')
@@ -514,6 +580,8 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         # load rois from file and create a list ------------------------------------------------------------------------
         self.ref['roi'].load_roi_list(self.roi_list_path)
         self.roi_names = self.ref['roi'].roi_names
+        # the rois keep their name order (and index in the data) but can be visited in the order with the shortest travel
+        self.roi_order = self.roi_names
 
         # imaging ------------------------------------------------------------------------------------------------------
         # convert the imaging_sequence given by user into format required by the bitfile
@@ -532,6 +600,11 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         # injections ---------------------------------------------------------------------------------------------------
         self.load_injection_parameters()
 
+        if self.optimize_roi_order:
+            self.roi_order, initial_duration, optimized_duration = self.ref['roi'].get_optimized_roi_order()
+            self.log.info(f'Optimized ROI order saves {(initial_duration - optimized_duration) * len(self.probe_list):.0f} s '
+                          f'of stage travel over {len(self.probe_list)} cycles')
+
     def load_injection_parameters(self):
         """ """
         try:
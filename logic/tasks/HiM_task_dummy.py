@@ -255,8 +255,8 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                     metadata = self.get_fits_metadata()
                     self.ref['cam']._save_to_fits(cur_save_path, image_data, metadata)
                 else:  # use tiff as default format
-                    self.ref['cam']._save_to_tiff(self.num_frames, cur_save_path, image_data)
                     metadata = self.get_metadata()
+                    self.ref['cam']._save_to_tiff(self.num_frames, cur_save_path, image_data, metadata)
                     file_path = cur_save_path.replace('tiff', 'yaml', 1)
                     self.save_metadata_file(metadata, file_path)
 
@@ -77,21 +77,14 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         print(f'current position: {cur_pos} um')
 
         # send signal from daq to FPGA connector 0/DIO3 ('piezo ready')
+        self.ref['daq'].arm_di_edge_detection()
         self.ref['daq'].write_to_do_channel(1, np.array([1], dtype=np.uint8), self.ref['daq']._daq.DIO3_taskhandle)
         sleep(0.005)
         self.ref['daq'].write_to_do_channel(1, np.array([0], dtype=np.uint8), self.ref['daq']._daq.DIO3_taskhandle)
 
-        # wait for signal from FPGA to DAQ ('acquisition ready')
-        fpga_ready = self.ref['daq'].read_do_channel(1, self.ref['daq']._daq.DIO4_taskhandle)[0]
-        t0 = time()
-
-        while not fpga_ready:
-            sleep(0.001)
-            fpga_ready = self.ref['daq'].read_do_channel(1, self.ref['daq']._daq.DIO4_taskhandle)[0]
-
-            t1 = time() - t0
-            if t1 > 5:  # for safety: timeout if no signal received within 5 s
-                break
+        # wait for signal from FPGA to DAQ ('acquisition ready'), detected by the daq hardware
+        # for safety: timeout if no signal received within 5 s
+        self.ref['daq'].wait_for_di_edge(timeout=5)
 
         return self.step_counter < self.num_z_planes
 
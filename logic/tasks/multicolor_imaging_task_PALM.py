@@ -109,17 +109,9 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
             
                 # switch the laser on and send the trigger to the camera
                 self.ref['daq'].apply_voltage()
-                err = self.ref['daq'].send_trigger_and_control_ai()  
-            
-                # read fire signal of camera and switch off when the signal is low
-                ai_read = self.ref['daq'].read_ai_channel()
-                count = 0
-                while not ai_read <= 2.5:  # analog input varies between 0 and 5 V. use max/2 to check if signal is low
-                    sleep(0.001)  # read every ms
-                    ai_read = self.ref['daq'].read_ai_channel()
-                    count += 1  # can be used for control and debug
+                # send the trigger and wait for the end of the exposure (falling edge of the camera fire signal)
+                err = self.ref['daq'].send_trigger_and_wait_for_fire(timeout=self.exposure + 1)
                 self.ref['daq'].voltage_off()
-                # self.log.debug(f'iterations of read analog in - while loop: {count}')
             
                 # waiting time for stability
                 sleep(0.05)
@@ -100,22 +100,15 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         self.z_actual_positions.append(cur_pos)
 
         # send signal from daq to FPGA connector 0/DIO3 ('piezo ready')
+        self.ref['daq'].arm_di_edge_detection()
         self.ref['daq'].write_to_do_channel(1, np.array([1], dtype=np.uint8), self.ref['daq']._daq.DIO3_taskhandle)
         sleep(0.005)
         self.ref['daq'].write_to_do_channel(1, np.array([0], dtype=np.uint8), self.ref['daq']._daq.DIO3_taskhandle)
 
-        # wait for signal from FPGA to DAQ ('acquisition ready')
-        fpga_ready = self.ref['daq'].read_do_channel(1, self.ref['daq']._daq.DIO4_taskhandle)[0]
-        t0 = time()
-
-        while not fpga_ready:
-            sleep(0.001)
-            fpga_ready = self.ref['daq'].read_do_channel(1, self.ref['daq']._daq.DIO4_taskhandle)[0]
-
-            t1 = time() - t0
-            if t1 > 1:  # for safety: timeout if no signal received within 1 s
-                self.log.warning('Timeout occurred')
-                break
+        # wait for signal from FPGA to DAQ ('acquisition ready'), detected by the daq hardware
+        # for safety: timeout if no signal received within 1 s
+        if not self.ref['daq'].wait_for_di_edge(timeout=1):
+            self.log.warning('Timeout occurred')
 
         return self.step_counter < self.num_z_planes
 
@@ -142,8 +135,8 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                 metadata = self.get_fits_metadata()
                 self.ref['cam']._save_to_fits(self.complete_path, image_data, metadata)
             else:   # use tiff as default format
-                self.ref['cam']._save_to_tiff(self.num_frames, self.complete_path, image_data)
                 metadata = self.get_metadata()
+                self.ref['cam']._save_to_tiff(self.num_frames, self.complete_path, image_data, metadata)
                 file_path = self.complete_path.replace('tiff', 'yaml', 1)
                 self.save_metadata_file(metadata, file_path)
 
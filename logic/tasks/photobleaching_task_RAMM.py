@@ -64,9 +64,8 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         # move to ROI
         # ------------------------------------------------------------------------------------------
         self.ref['roi'].set_active_roi(name=self.roi_names[self.roi_counter])
-        self.ref['roi'].go_to_roi_xy()
+        self.ref['roi'].go_to_roi_xy()  # returns at the end of the movement
         self.log.info('Moved to {}'.format(self.roi_names[self.roi_counter]))
-        sleep(1)  # replace maybe by wait for idle
 
         # ------------------------------------------------------------------------------------------
         # activate lightsource
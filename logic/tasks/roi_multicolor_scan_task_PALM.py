@@ -110,9 +110,8 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
 
         # go to roi
         self.ref['roi'].set_active_roi(name=self.roi_names[self.roi_counter])
-        self.ref['roi'].go_to_roi_xy()
+        self.ref['roi'].go_to_roi_xy()  # returns at the end of the movement
         self.log.info('Moved to {} xy position'.format(self.roi_names[self.roi_counter]))
-        sleep(1)  # replace maybe by wait for idle
 
         # autofocus  # add this when autofocus is set up correctly and tested on PALM setup
         # self.ref['focus'].search_focus()
@@ -155,17 +154,9 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
 
                     # switch the laser on and send the trigger to the camera
                     self.ref['daq'].apply_voltage()
-                    err = self.ref['daq'].send_trigger_and_control_ai()
-
-                    # read fire signal of camera and switch off when the signal is low
-                    ai_read = self.ref['daq'].read_ai_channel()
-                    count = 0
-                    while not ai_read <= 2.5:  # analog input varies between 0 and 5 V. use max/2 to check if signal is low
-                        sleep(0.001)  # read every ms
-                        ai_read = self.ref['daq'].read_ai_channel()
-                        count += 1  # can be used for control and debug
+                    # send the trigger and wait for the end of the exposure (falling edge of the camera fire signal)
+                    err = self.ref['daq'].send_trigger_and_wait_for_fire(timeout=self.exposure + 1)
                     self.ref['daq'].voltage_off()
-                    # self.log.debug(f'iterations of read analog in - while loop: {count}')
 
                     # waiting time for stability
                     sleep(0.05)
@@ -262,6 +253,7 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
             file_format: 'tiff'
             imaging_sequence = [('488 nm', 3), ('561 nm', 3), ('641 nm', 10)]
             roi_list_path:
+            optimize_roi_order: False  # optional: visit the rois in the order with the shortest travel of the stage
         """
         try:
             with open(self.user_config_path, 'r') as stream:
@@ -279,6 +271,7 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                 self.imaging_sequence_raw = self.user_param_dict['imaging_sequence']
                 self.file_format = self.user_param_dict['file_format']
                 self.roi_list_path = self.user_param_dict['roi_list_path']
+                self.optimize_roi_order = self.user_param_dict.get('optimize_roi_order', False)
 
         except Exception as e:  # add the type of exception
             self.log.warning(f'Could not load user parameters for task {self.name}: {e}')
@@ -289,6 +282,8 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         self.ref['roi'].load_roi_list(self.roi_list_path)
         # get the list of the roi names
         self.roi_names = self.ref['roi'].roi_names
+        if self.optimize_roi_order:
+            self.roi_names = self.ref['roi'].get_optimized_roi_order()[0]
 
         # for the imaging sequence, we need to access the corresponding labels
         laser_dict = self.ref['daq'].get_laser_dict()
@@ -81,6 +81,15 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         self.num_frames = self.num_z_planes * self.num_laserlines
         self.ref['cam'].prepare_camera_for_multichannel_imaging(self.num_frames, self.exposure, None, None, None)
 
+        # h5 format: all stacks are saved in a single container, with one entry per roi
+        if self.file_format == 'h5':
+            self.container_path = os.path.join(self.directory, os.path.basename(self.directory) + '.h5')
+            cycle_names = ['DAPI'] if self.is_dapi else ['RNA'] if self.is_rna else None
+            self.ref['cam'].open_dataset_container(self.container_path, self.num_z_planes, self.num_laserlines,
+                                                   roi_names=self.roi_names, cycle_names=cycle_names,
+                                                   channel_names=[item[0] for item in self.imaging_sequence],
+                                                   attributes={'Sample name': self.sample_name})
+
         # initialize a counter to iterate over the ROIs
         self.roi_counter = 0
         # set the active_roi to none to avoid having two active rois displayed
@@ -94,16 +103,21 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         # move to ROI and focus
         # ------------------------------------------------------------------------------------------
         # create the path for each roi
-        cur_save_path = self.get_complete_path(self.directory, self.roi_names[self.roi_counter])
+        if self.file_format == 'h5':
+            cur_save_path = self.container_path
+        else:
+            cur_save_path = self.get_complete_path(self.directory, self.roi_names[self.roi_counter])
 
         # go to roi
         self.ref['roi'].set_active_roi(name=self.roi_names[self.roi_counter])
-        self.ref['roi'].go_to_roi_xy()
-        self.log.info('Moved to {} xy position'.format(self.roi_names[self.roi_counter]))
-        # waiting time needed ???
-        sleep(1)  # replace maybe by wait for idle
+        self.ref['roi'].go_to_roi_xy(wait=False)
 
-        # autofocus
+        # autofocus, starting close to the focus predicted from the rois already visited (the piezo is positioned
+        # while the stage is moving)
+        stage_x, stage_y = self.ref['roi'].get_roi_position(self.roi_names[self.roi_counter])[:2]
+        self.ref['focus'].go_to_predicted_focus_position(stage_x, stage_y)
+        self.ref['roi'].wait_for_stage_move()
+        self.log.info('Moved to {} xy position'.format(self.roi_names[self.roi_counter]))
         self.ref['focus'].start_search_focus()
         # need to ensure that focus is stable here.
         ready = self.ref['focus']._stage_is_positioned
@@ -114,6 +128,8 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
             ready = self.ref['focus']._stage_is_positioned
             if counter > 50:
                 break
+        if ready:  # update the focus map only with converged positions
+            self.ref['focus'].record_focus_position(stage_x, stage_y, name=self.roi_names[self.roi_counter])
 
         start_position = self.calculate_start_position(self.centered_focal_plane)
 
@@ -169,20 +185,26 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         # ------------------------------------------------------------------------------------------
         # data saving
         # ------------------------------------------------------------------------------------------
+        # the image data is written in the background while the task moves on to the next roi
         image_data = self.ref['cam'].get_acquired_data()
 
-        if self.file_format == 'fits':
-            metadata = self.get_fits_metadata()
-            self.ref['cam']._save_to_fits(cur_save_path, image_data, metadata)
-        else:  # use tiff as default format
-            self.ref['cam']._save_to_tiff(self.num_frames, cur_save_path, image_data)
+        if self.file_format == 'h5':  # metadata and z positions are saved in the container
             metadata = self.get_metadata()
-            file_path = cur_save_path.replace('tiff', 'yaml', 1)
-            self.save_metadata_file(metadata, file_path)
-
-        # save file with z positions (same procedure for either file format)
-        file_path = os.path.join(os.path.split(cur_save_path)[0], 'z_positions.yaml')
-        self.save_z_positions_to_file(z_target_positions, z_actual_positions, file_path)
+            self.ref['cam'].save_async(cur_save_path, image_data, metadata, file_format='h5', cycle=0,
+                                       roi=self.roi_counter, z_positions=(z_target_positions, z_actual_positions))
+        else:
+            if self.file_format == 'fits':
+                metadata = self.get_fits_metadata()
+                self.ref['cam'].save_async(cur_save_path, image_data, metadata, file_format='fits')
+            else:  # use tiff as default format
+                metadata = self.get_metadata()
+                self.ref['cam'].save_async(cur_save_path, image_data, metadata, file_format='tiff')
+                file_path = cur_save_path.replace('tiff', 'yaml', 1)
+                self.save_metadata_file(metadata, file_path)
+
+            # save file with z positions (same procedure for either file format)
+            file_path = os.path.join(os.path.split(cur_save_path)[0], 'z_positions.yaml')
+            self.save_z_positions_to_file(z_target_positions, z_actual_positions, file_path)
 
         self.roi_counter += 1
         return self.roi_counter < len(self.roi_names)
@@ -198,6 +220,9 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
     def cleanupTask(self):
         """ """
         self.log.info('cleanupTask called')
+        # wait until all image data is written to disk
+        self.ref['cam'].flush()
+        self.ref['cam'].close_dataset_container()  # h5 format
         # go back to first ROI
         self.ref['roi'].set_active_roi(name=self.roi_names[0])
         self.ref['roi'].go_to_roi_xy()
@@ -245,6 +270,7 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
                 self.save_path = self.user_param_dict['save_path']
                 self.file_format = self.user_param_dict['file_format']
                 self.roi_list_path = self.user_param_dict['roi_list_path']
+                self.optimize_roi_order = self.user_param_dict.get('optimize_roi_order', False)  # optional entry
 
         except Exception as e:  # add the type of exception
             self.log.warning(f'Could not load user parameters for task {self.name}: {e}')
@@ -254,6 +280,8 @@ class Task(InterruptableTask):  # do not change the name of the class. it is alw
         self.ref['roi'].load_roi_list(self.roi_list_path)
         # get the list of the roi names
         self.roi_names = self.ref['roi'].roi_names
+        if self.optimize_roi_order:  # visit the rois in the order with the shortest travel of the stage
+            self.roi_names = self.ref['roi'].get_optimized_roi_order()[0]
 
         # convert the imaging_sequence given by user into format required by the bitfile
         lightsource_dict = {'BF': 0, '405 nm': 1, '488 nm': 2, '561 nm': 3, '640 nm': 4}
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Extension for qudi software
+
+This module contains a logic class for hardware-timed z stack acquisitions on the RAMM setup.
+
+Instead of positioning the piezo, sending the 'piezo ready' trigger to the FPGA (DIO3) and polling the 'acquisition
+done' line (DIO4) from python for each plane, the piezo positions and the triggers of the complete stack are uploaded
+to the DAQ as waveforms sharing one sample clock. The FPGA (multicolor imaging bitfile) runs the laser sequence and
+triggers the camera on each DIO3 pulse, as in the software-timed mode. The piezo position and the DIO4 line are sampled
+with the same clock, so that the actual positions and the timestamps of the planes are available at the end.
+
+Requirement: the piezo controller follows the analog output of the DAQ (piezo_write channel of
+hardware/daq/national_instruments_m_series_MCL.py), and its position monitor is connected to the piezo_read channel.
+"""
+from time import sleep, perf_counter
+import numpy as np
+
+from core.connector import Connector
+from core.configoption import ConfigOption
+from logic.generic_logic import GenericLogic
+
+
+class ZStackLogic(GenericLogic):
+    """ Hardware-timed z stack acquisition.
+
+    Config entry for copy-paste:
+
+    zstack_logic:
+        module.Class: 'zstack_logic.ZStackLogic'
+        sample_rate: 5000  # in Hz, sample clock of the waveforms
+        settle_time: 0.01  # in s, waiting time between the piezo step and the trigger of the plane
+        trigger_pulse: 0.005  # in s, duration of the DIO3 pulse
+        frame_overhead: 0.01  # in s, time per frame in addition to the exposure (readout, laser switching)
+        ramp_point_time: 0.001  # in s, time per position of the ramps to the first plane and back
+        connect:
+            daq: 'nidaq_6259_logic'
+            camera: 'camera_logic'
+            focus: 'focus_logic'
+    """
+
+    # declare connectors
+    daq = Connector(interface='DAQaoLogic')
+    camera = Connector(interface='CameraLogic')
+    focus = Connector(interface='FocusLogic')
+
+    # config options
+    _sample_rate = ConfigOption('sample_rate', 5000)
+    _settle_time = ConfigOption('settle_time', 0.01)
+    _trigger_pulse = ConfigOption('trigger_pulse', 0.005)
+    _frame_overhead = ConfigOption('frame_overhead', 0.01)
+    _ramp_point_time = ConfigOption('ramp_point_time', 0.001)
+    _readout_timeout = 1  # in s, maximum waiting time for the camera after the end of the waveforms (in addition to
+                          # one plane period)
+
+    def __init__(self, config, **kwargs):
+        super().__init__(config=config, **kwargs)
+
+    def on_activate(self):
+        """ Initialisation performed during activation of the module.
+        """
+        self._daq = self.daq()
+        self._camera = self.camera()
+        self._focus = self.focus()
+
+    def on_deactivate(self):
+        """ Perform required deactivation. """
+        pass
+
+    def get_plane_period(self, num_laserlines, exposure):
+        """ Time between the triggers of two successive planes.
+
+        @param int num_laserlines: number of frames per plane
+        @param float exposure: exposure time in s
+
+        @return float: plane period in s
+        """
+        return self._settle_time + num_laserlines * (exposure + self._frame_overhead)
+
+    def compute_waveforms(self, start_position, num_z_planes, z_step, plane_period, current_position=None,
+                          return_position=None):
+        """ Compute the piezo position and DIO3 trigger for each sample of the stack.
+
+        The waveform starts with a ramp from current_position to the first plane, then each plane is held during
+        plane_period, with a trigger pulse settle_time after the step. It ends with a ramp to return_position.
+
+        @return tuple: (np.ndarray z_waveform, np.ndarray trigger_waveform, np.ndarray z_target,
+                        np.ndarray trigger indices (one per plane))
+        """
+        rate = self._sample_rate
+        max_step = self._focus._max_step
+        z_target = start_position + np.arange(num_z_planes) * z_step
+        ramp_samples = max(int(round(self._ramp_point_time * rate)), 1)
+        plane_samples = int(round(plane_period * rate))
+        settle_samples = int(round(self._settle_time * rate))
+        pulse_samples = max(int(round(self._trigger_pulse * rate)), 1)
+
+        parts = []
+        if current_position is not None:
+            parts.append(np.repeat(self._focus.compute_ramp(current_position, z_target[0], max_step), ramp_samples))
+        lead_in = sum(len(part) for part in parts)
+        parts.append(np.repeat(z_target, plane_samples))
+        if return_position is not None:
+            parts.append(np.repeat(self._focus.compute_ramp(z_target[-1], return_position, max_step), ramp_samples))
+        z_waveform = np.concatenate(parts)
+
+        trigger_indices = lead_in + np.arange(num_z_planes) * plane_samples + settle_samples
+        trigger_waveform = np.zeros(len(z_waveform), dtype=np.uint8)
+        for index in trigger_indices:
+            trigger_waveform[index:index + pulse_samples] = 1
+        return z_waveform, trigger_waveform, z_target, trigger_indices
+
+    def run_zstack(self, start_position, num_z_planes, z_step, imaging_sequence, exposure, return_position=None):
+        """ Acquire a z stack with hardware timing. The FPGA session for multicolor imaging must be running and the
+        camera must be prepared for num_z_planes * len(imaging_sequence) frames (as for the software-timed stack).
+
+        @param float start_position: position of the first plane in um
+        @param int num_z_planes: number of planes
+        @param float z_step: distance between two planes in um
+        @param list imaging_sequence: (laser line, intensity) tuples, acquired for each plane
+        @param float exposure: exposure time in s
+        @param float return_position: optional, piezo position at the end. Default: stay on the last plane
+
+        @return tuple: (image data, list z_target, list z_actual (measured at the trigger of each plane),
+                        list timestamps (time.time() of the trigger of each plane, nan if the FPGA did not signal
+                        the end of the plane before the next trigger))
+        """
+        rate = self._sample_rate
+        plane_period = self.get_plane_period(len(imaging_sequence), exposure)
+        z_waveform, trigger_waveform, z_target, trigger_indices = self.compute_waveforms(
+            start_position, num_z_planes, z_step, plane_period, self._focus.get_position(), return_position)
+
+        self._camera.stop_acquisition()  # for safety
+        self._camera.start_acquisition()
+        positions, ready, start_time = self._daq.run_zstack_waveforms(z_waveform, trigger_waveform, rate)
+        # the last frame may still be read out when the waveforms are completed
+        n_frames = num_z_planes * len(imaging_sequence)
+        if not self.wait_for_frames(n_frames, timeout=plane_period + self._readout_timeout):
+            self.log.warning(f'Camera acquisition not finished: {self._camera.get_progress()} of {n_frames} frames.')
+        image_data = self._camera.get_acquired_data()
+
+        # measured position just before each trigger (first sample if the trigger is at the start of the waveform).
+        # A plane is complete if DIO4 rises before the next trigger
+        z_actual = positions[np.maximum(trigger_indices - 1, 0)]
+        rising_edges = np.flatnonzero(np.diff(ready.astype(np.int8)) > 0) + 1
+        next_trigger = np.append(trigger_indices[1:], len(ready))
+        timestamps = start_time + trigger_indices / rate
+        for plane, (trigger, end) in enumerate(zip(trigger_indices, next_trigger)):
+            if not np.any((rising_edges > trigger) & (rising_edges < end)):
+                timestamps[plane] = np.nan
+        missed = int(np.count_nonzero(np.isnan(timestamps)))
+        if missed > 0:
+            self.log.warning(f'{missed} of {num_z_planes} planes not finished within the plane period of '
+                             f'{plane_period * 1000:.1f} ms. Increase frame_overhead or settle_time.')
+
+        return image_data, list(z_target), list(z_actual), list(timestamps)
+
+    def wait_for_frames(self, n_frames, timeout):
+        """ Wait until the camera has acquired n_frames frames.
+
+        @param int n_frames: number of frames of the acquisition
+        @param float timeout: maximum waiting time in s
+
+        @return bool: True if all frames were acquired, False if the timeout occurred
+        """
+        start = perf_counter()
+        while True:
+            progress = self._camera.get_progress()  # None if the camera could not be queried
+            if progress is not None and progress >= n_frames:
+                return True
+            if perf_counter() - start > timeout:
+                return False
+            sleep(0.001)
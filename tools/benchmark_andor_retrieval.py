@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the image retrieval of the Andor iXon Ultra 897 hardware module.
+
+Compares the frame rate of the former retrieval (ctypes array copied pixel by pixel into a float64 array)
+with the retrieval directly into a numpy array (newly allocated or supplied by the caller). No camera is needed: the Andor dll is replaced
+by a stand-in which copies frames generated by the camera dummy into the memory handed over by the driver.
+
+Run from the qudi-cbs root directory:
+python tools/benchmark_andor_retrieval.py --frames 1000 --legacy-frames 5 --size 512
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import sys
+import argparse
+from ctypes import c_int, pointer, memmove
+from time import perf_counter
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from hardware.camera.camera_dummy import CameraDummy
+from hardware.camera.andor.iXon897_ultra import IxonUltra
+
+DRV_SUCCESS = 20002
+
+
+class AndorDllStandIn:
+    """ Replaces the Andor dll: copies a prepared kinetic series into the memory handed over by the caller. """
+
+    def __init__(self, frames):
+        self._frames32 = np.ascontiguousarray(frames, dtype=np.int32)
+        self._frames16 = np.ascontiguousarray(frames, dtype=np.uint16)
+
+    @staticmethod
+    def _copy(source, destination, size):
+        size = min(size, source.size)
+        memmove(destination, source.ctypes.data, size * source.itemsize)
+        return DRV_SUCCESS
+
+    def GetAcquiredData(self, destination, size):
+        return self._copy(self._frames32, destination, size)
+
+    def GetAcquiredData16(self, destination, size):
+        return self._copy(self._frames16, destination, size)
+
+    def GetMostRecentImage(self, destination, size):
+        return self._copy(self._frames32[-1], destination, size)
+
+    def GetMostRecentImage16(self, destination, size):
+        return self._copy(self._frames16[-1], destination, size)
+
+
+def legacy_get_acquired_data(dll, n_frames, height, width):
+    """ Former implementation of IxonUltra.get_acquired_data for a kinetic series. """
+    dim = int(n_frames * height * width)
+    image_array = np.zeros(dim)
+    cimage_array = c_int * dim
+    cimage = cimage_array()
+    dll.GetAcquiredData(pointer(cimage), dim)
+    for i in range(len(cimage)):
+        image_array[i] = cimage[i]
+    return np.reshape(image_array, (n_frames, height, width))
+
+
+def generate_frames(n_frames, size):
+    """ Generate a kinetic series using the camera dummy. """
+    dummy = CameraDummy(manager=None, name='camera_dummy', config={'resolution': (size, size)})
+    dummy.on_activate()
+    return dummy.generate_frames(n_frames)
+
+
+def set_up_camera(dll, data_type, n_frames, size):
+    """ Create an IxonUltra instance using the dll stand-in, configured for a kinetic series. """
+    camera = IxonUltra(manager=None, name='andor_benchmark', config={'dll_location': '', 'data_type': data_type})
+    camera.dll = dll
+    camera._width, camera._height = size, size
+    camera._read_mode = 'IMAGE'
+    camera._acquisition_mode = 'KINETICS'
+    camera._scans = n_frames
+    return camera
+
+
+def frames_per_second(function, n_frames, repetitions):
+    """ Call function repetitions times and return the achieved number of frames per second. """
+    start = perf_counter()
+    for _ in range(repetitions):
+        function()
+    duration = perf_counter() - start
+    return n_frames * repetitions / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the Andor iXon image retrieval')
+    parser.add_argument('--frames', type=int, default=1000, help='number of frames of the kinetic series')
+    parser.add_argument('--legacy-frames', type=int, default=5, help='number of frames for the legacy path (slow)')
+    parser.add_argument('--size', type=int, default=512, help='width and height of a frame in pixel')
+    parser.add_argument('--repetitions', type=int, default=5, help='number of repetitions for the new paths')
+    args = parser.parse_args()
+
+    frames = generate_frames(args.frames, args.size)
+
+    # legacy path, only on a few frames because it is very slow
+    legacy_dll = AndorDllStandIn(frames[:args.legacy_frames])
+    legacy_fps = frames_per_second(lambda: legacy_get_acquired_data(legacy_dll, args.legacy_frames, args.size,
+                                                                    args.size), args.legacy_frames, 1)
+    print(f'legacy per-pixel copy (float64): {legacy_fps:10.1f} frames/s')
+
+    dll = AndorDllStandIn(frames)
+    for data_type in ['int32', 'uint16']:
+        camera = set_up_camera(dll, data_type, args.frames, args.size)
+        data = camera.get_acquired_data()
+        if not np.array_equal(data, frames):
+            print(f'retrieved data differs from the generated data ({data_type})')
+        fps = frames_per_second(camera.get_acquired_data, args.frames, args.repetitions)
+        print(f'numpy array ({data_type}):            {fps:10.1f} frames/s')
+
+        out = np.empty((args.frames, args.size, args.size), dtype=data_type)
+        fps = frames_per_second(lambda: camera.get_acquired_data(out=out), args.frames, args.repetitions)
+        print(f'caller-supplied array ({data_type}):  {fps:10.1f} frames/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of the camera logic module (logic/camera_logic2.py), run against the camera dummy.
+
+Measures:
+    - live display: frame rate of the camera and of the display, frames not displayed
+    - latency between the availability of a frame and the signal sigUpdateDisplay
+    - save_video: throughput in MB/s for each file format, with and without streaming
+    - write throughput and peak memory of get_acquired_data, _save_to_tiff, _save_to_fits (and _save_to_container
+      if h5py is installed)
+
+The results are written in json format (to stdout or to the file given by --output), so that the results of
+different versions of the drivers or of the saving code can be compared.
+
+Run from the qudi-cbs root directory:
+python tools/benchmark_camera_logic.py --frames 500 --size 512 --output benchmark.json
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from qtpy import QtCore
+
+from hardware.camera.camera_dummy import CameraDummy
+from logic.camera_logic2 import CameraLogic
+from logic.image_writers import h5py
+
+
+def set_up_modules(size, exposure, max_frame_rate):
+    """ Create and activate the camera dummy and the camera logic connected to it. """
+    camera = CameraDummy(manager=None, name='camera_dummy',
+                         config={'resolution': (size, size), 'exposure': exposure, 'max_frame_rate': max_frame_rate,
+                                 'seed': 0})
+    logic = CameraLogic(manager=None, name='camera_logic', config={})
+    logic.connectors['hardware'].connect(camera)
+    camera.module_state.activate()
+    logic.module_state.activate()
+    return camera, logic
+
+
+def statistics_ms(values):
+    """ Summary of a list of durations in seconds, in milliseconds. """
+    if len(values) == 0:
+        return None
+    values = np.array(values) * 1000
+    return {'mean': float(np.mean(values)), 'median': float(np.median(values)),
+            'p95': float(np.percentile(values, 95)), 'max': float(np.max(values)), 'n': len(values)}
+
+
+def benchmark_live(app, camera, logic, duration):
+    """ Run the live display for duration seconds and measure the display rate and latency. """
+    latencies = []
+    displayed = []
+
+    def on_update_display():
+        frame_time = camera.get_last_frame_time()
+        if frame_time is not None:
+            latencies.append(perf_counter() - frame_time)
+        displayed.append(camera.get_progress())
+
+    logic.sigUpdateDisplay.connect(on_update_display)
+    start = perf_counter()
+    logic.start_loop()
+    QtCore.QTimer.singleShot(int(duration * 1000), app.quit)
+    app.exec_()
+    n_acquired = camera.get_progress()
+    logic.stop_loop()
+    elapsed = perf_counter() - start
+    logic.sigUpdateDisplay.disconnect(on_update_display)
+
+    unique = len(set(displayed))
+    return {'duration_s': elapsed,
+            'camera_fps': n_acquired / elapsed,
+            'display_fps': len(displayed) / elapsed,
+            'frames_acquired': n_acquired,
+            'frames_displayed': unique,
+            'frames_not_displayed': n_acquired - unique,
+            'repeated_display_updates': len(displayed) - unique,
+            'display_rate_setting_fps': logic._fps,
+            'frame_ready_to_display_latency_ms': statistics_ms(latencies)}
+
+
+def benchmark_save_video(camera, logic, directory, n_frames):
+    """ Time save_video for each file format, with and without streaming. """
+    width, height = camera.get_size()
+    megabytes = n_frames * width * height * 2 / 2**20
+    results = []
+    for fileformat in ['.tiff', '.fits']:
+        for streaming in [False, True]:
+            filenamestem = os.path.join(directory, f'save_video_{fileformat[1:]}_{"stream" if streaming else "block"}')
+            start = perf_counter()
+            logic.save_video(filenamestem, fileformat, n_frames, False, {'benchmark': True}, emit_signal=False,
+                             streaming=streaming)
+            elapsed = perf_counter() - start
+            acquisition_time = n_frames * camera.get_kinetic_time()
+            results.append({'format': fileformat[1:], 'streaming': streaming, 'frames': n_frames,
+                            'size_mb': megabytes, 'duration_s': elapsed, 'acquisition_time_s': acquisition_time,
+                            'overhead_s': elapsed - acquisition_time, 'throughput_mb_s': megabytes / elapsed})
+    return results
+
+
+def measure(function, *args):
+    """ Call function and return its duration and the peak of the memory allocated during the call.
+
+    @return tuple: (result, duration in s, peak memory in MB)
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = perf_counter()
+    result = function(*args)
+    duration = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, duration, (peak - baseline) / 2**20
+
+
+def benchmark_memory(camera, logic, directory, n_frames):
+    """ Measure duration, throughput and peak memory of the data retrieval and of the save functions. """
+    results = {}
+    camera.prepare_camera_for_multichannel_imaging(n_frames, camera.get_exposure(), None, None, None)
+    logic.start_acquisition()
+    camera.wait_until_finished()
+    data, duration, peak = measure(logic.get_acquired_data)
+    megabytes = data.nbytes / 2**20
+    results['get_acquired_data'] = {'duration_s': duration, 'peak_memory_mb': peak, 'data_size_mb': megabytes}
+
+    _, duration, peak = measure(logic._save_to_tiff, n_frames, os.path.join(directory, 'stack.tiff'), data, {'a': 1})
+    results['_save_to_tiff'] = {'duration_s': duration, 'throughput_mb_s': megabytes / duration,
+                                'peak_memory_mb': peak, 'data_size_mb': megabytes}
+
+    _, duration, peak = measure(logic._save_to_fits, os.path.join(directory, 'stack.fits'), data, {'A': 1})
+    results['_save_to_fits'] = {'duration_s': duration, 'throughput_mb_s': megabytes / duration,
+                                'peak_memory_mb': peak, 'data_size_mb': megabytes}
+
+    if h5py is not None:
+        path = os.path.join(directory, 'stack.h5')
+        logic.open_dataset_container(path, n_frames, 1)
+        _, duration, peak = measure(logic._save_to_container, path, data, 0, 0, {'a': 1}, None)
+        logic.close_dataset_container(path)
+        results['_save_to_container'] = {'duration_s': duration, 'throughput_mb_s': megabytes / duration,
+                                         'peak_memory_mb': peak, 'data_size_mb': megabytes,
+                                         'file_size_mb': os.path.getsize(path) / 2**20}
+    camera.reset_camera_after_multichannel_imaging()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite of the camera logic, using the camera dummy')
+    parser.add_argument('--frames', type=int, default=200, help='number of frames of the movies and stacks')
+    parser.add_argument('--size', type=int, default=512, help='width and height of a frame in pixel')
+    parser.add_argument('--exposure', type=float, default=0.005, help='exposure time in s')
+    parser.add_argument('--max-frame-rate', type=float, default=200, help='frame rate limit of the camera dummy')
+    parser.add_argument('--live-duration', type=float, default=3, help='duration of the live display test in s')
+    parser.add_argument('--directory', default=None, help='directory for the saved files (default: temporary)')
+    parser.add_argument('--output', default=None, help='json file for the results (default: stdout)')
+    args = parser.parse_args()
+
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication(sys.argv)
+    camera, logic = set_up_modules(args.size, args.exposure, args.max_frame_rate)
+    directory = args.directory if args.directory is not None else tempfile.mkdtemp(prefix='camera_benchmark_')
+
+    try:
+        results = {'date': datetime.now().isoformat(timespec='seconds'),
+                   'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                                   'platform': platform.platform()},
+                   'settings': vars(args),
+                   'live': benchmark_live(app, camera, logic, args.live_duration),
+                   'save_video': benchmark_save_video(camera, logic, directory, args.frames),
+                   'memory': benchmark_memory(camera, logic, directory, args.frames)}
+    finally:
+        logic.module_state.deactivate()
+        camera.module_state.deactivate()
+        if args.directory is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the serial command protocol of the ASI MS2000 stage (hardware/motor/asi_protocol.py), compared to the
+previous implementation (one command per axis, input buffer flushed before each command, replies of the commands
+without data not read).
+
+The controller is replaced by a loopback serial stand-in answering like an MS2000: the bytes are transmitted at the
+given baud rate in both directions and each command takes a fixed processing time in the controller. For each workload
+(typical sequences of the hardware module) the number of operations per second, the number of writes to the serial
+port per operation and the number of replies that were not matched to their command are written in json format to
+stdout or to the file given by --output.
+
+Run from the qudi-cbs root directory:
+python tools/benchmark_ms2000_protocol.py --repetitions 50
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import sys
+import json
+import argparse
+import platform
+from collections import deque
+from time import perf_counter, sleep
+
+sys.path.append(os.getcwd())
+
+from hardware.motor.asi_protocol import ASIProtocol
+
+AXES = ['x', 'y', 'z']
+CONVERSION = 10.0  # the stage uses 0.1 um
+
+
+class LoopbackMS2000:
+    """ Serial stand-in answering like an ASI MS2000 controller. The replies become readable after the transmission of
+    the command, the processing time of the controller and the transmission of the reply. """
+
+    def __init__(self, baud_rate=9600, command_time=0.002):
+        self.byte_time = 10 / baud_rate  # 8 data bits, start and stop bit
+        self.command_time = command_time
+        self.positions = {'X': 0, 'Y': 0, 'Z': 0}
+        self.velocities = {'X': 5.74592, 'Y': 5.74592, 'Z': 1.0}
+        self.writes = 0
+        self._line = ''
+        self._tx_free = 0.0  # end of the transmission of the last written byte
+        self._controller_free = 0.0  # end of the processing of the last command
+        self._rx_free = 0.0  # end of the transmission of the last reply
+        self._replies = deque()  # (time at which the reply is completely received, reply)
+
+    def write(self, data):
+        self.writes += 1
+        self._tx_free = max(perf_counter(), self._tx_free)
+        for char in data.decode():
+            self._tx_free += self.byte_time
+            if char != '\r':
+                self._line += char
+                continue
+            self._controller_free = max(self._tx_free, self._controller_free) + self.command_time
+            reply = (self._execute(self._line.strip()) + '\r\n').encode()
+            self._rx_free = max(self._rx_free, self._controller_free) + len(reply) * self.byte_time
+            self._replies.append((self._rx_free, reply))
+            self._line = ''
+
+    def readline(self):
+        if not self._replies:
+            return b''  # read timeout
+        ready, reply = self._replies.popleft()
+        sleep(max(ready - perf_counter(), 0))
+        return reply
+
+    def reset_input_buffer(self):
+        """ Discard the replies that were already received. """
+        now = perf_counter()
+        while self._replies and self._replies[0][0] <= now:
+            self._replies.popleft()
+
+    flushInput = reset_input_buffer
+
+    def _execute(self, line):
+        command, *arguments = line.upper().split()
+        if command == '/':
+            return 'N'  # the movements are not simulated: the stage is always idle
+        if command == 'W':
+            return ':A ' + ' '.join(str(self.positions[axis]) for axis in arguments)
+        if command in ('M', 'R', 'S') and arguments and arguments[0].endswith('?'):
+            values = self.velocities if command == 'S' else self.positions
+            return ':A ' + ' '.join(f'{argument[0]}={values[argument[0]]:.6f}' for argument in arguments)
+        if command in ('M', 'R', 'S'):
+            for argument in arguments:
+                axis, value = argument.split('=')
+                if command == 'S':
+                    self.velocities[axis] = float(value)
+                else:
+                    self.positions[axis] = round(float(value) + (self.positions[axis] if command == 'R' else 0))
+            return ':A'
+        if command == '\\':
+            return ':A'
+        return ':N-1'
+
+
+class PreviousDriver:
+    """ Command sequences of the previous MS2000 driver: input buffer flushed before each command, one command per
+    axis, the acknowledgement of the commands without data is not read. """
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def query(self, command):
+        self._connection.flushInput()
+        self._connection.write(command.encode())
+        return self._connection.readline().decode().strip()
+
+    def write(self, command):
+        self._connection.flushInput()
+        self._connection.write(command.encode())
+
+    def get_pos(self):
+        return {axis: float(self.query(f'W {axis}\r')[3:]) / CONVERSION for axis in AXES}
+
+    def snapshot(self):
+        return self.get_pos(), self.query('/ \r')
+
+    def wait_for_idle(self):
+        # the acknowledgement of the previous command can be read as status: the loop then waits 0.1 s
+        status = self.query('/ \r')
+        while status != 'N':
+            sleep(0.1)
+            status = self.query('/ \r')
+        return status
+
+    def focus_step(self):
+        self.write(f'R z={0.1 * CONVERSION}\r')
+        status = self.wait_for_idle()
+        return status, float(self.query('W z\r')[3:]) / CONVERSION
+
+    def get_velocity(self):
+        return {axis: float(self.query(f'S {axis}?\r')[5:]) for axis in AXES}
+
+    def set_velocity(self, param_dict):
+        velo = {}
+        for axis, value in param_dict.items():
+            self.write(f'S {axis}={value}\r')
+            self.wait_for_idle()
+            velo[axis] = float(self.query(f'S {axis}?\r')[5:])
+        return velo
+
+    def status_burst(self, count):
+        return [self.query('/ \r') for _ in range(count)]
+
+
+class PipelinedDriver:
+    """ Command sequences of the current MS2000 driver, using ASIProtocol. """
+
+    def __init__(self, connection):
+        self._protocol = ASIProtocol(connection)
+
+    def get_pos(self):
+        values = self._protocol.get_axes('W', AXES)
+        return {axis: value / CONVERSION for axis, value in zip(AXES, values)}
+
+    def snapshot(self):
+        position, status = self._protocol.transact([f"W {' '.join(AXES)}", '/'])
+        values = self._protocol.parse_values(position, len(AXES))
+        return {axis: value / CONVERSION for axis, value in zip(AXES, values)}, status
+
+    def focus_step(self):
+        self._protocol.set_axes('R', {'z': 0.1 * CONVERSION})
+        status = self._protocol.transact(['/'])[0]
+        return status, self._protocol.get_axes('W', ['z'])[0] / CONVERSION
+
+    def get_velocity(self):
+        return dict(zip(AXES, self._protocol.get_axes('S', AXES)))
+
+    def set_velocity(self, param_dict):
+        set_reply, get_reply = self._protocol.transact(
+            ['S ' + ' '.join(f'{axis}={value}' for axis, value in param_dict.items()),
+             'S ' + ' '.join(f'{axis}?' for axis in param_dict)])
+        return dict(zip(param_dict, self._protocol.parse_values(get_reply, len(param_dict))))
+
+    def status_burst(self, count):
+        return self._protocol.transact(['/'] * count)
+
+
+WORKLOADS = {
+    'get_pos': (lambda driver: driver.get_pos(), lambda result: all(v == v for v in result.values())),
+    'snapshot': (lambda driver: driver.snapshot(), lambda result: result[1] == 'N'),
+    'focus_step': (lambda driver: driver.focus_step(), lambda result: result[0] == 'N'),
+    'get_velocity': (lambda driver: driver.get_velocity(), lambda result: len(result) == len(AXES)),
+    'set_velocity': (lambda driver: driver.set_velocity({'x': 5.0, 'y': 5.0, 'z': 1.0}),
+                     lambda result: result == {'x': 5.0, 'y': 5.0, 'z': 1.0}),
+    'status_burst_8': (lambda driver: driver.status_burst(8), lambda result: result == ['N'] * 8),
+}
+
+
+def run_workload(driver_class, name, repetitions, baud_rate, command_time):
+    """ Execute a workload repeatedly on a new loopback controller.
+
+    @return dict: operations per second, serial writes per operation and number of operations with a wrong reply
+    """
+    operation, is_valid = WORKLOADS[name]
+    connection = LoopbackMS2000(baud_rate, command_time)
+    driver = driver_class(connection)
+    errors = 0
+    start = perf_counter()
+    for _ in range(repetitions):
+        try:
+            if not is_valid(operation(driver)):
+                errors += 1
+        except ValueError:  # a reply of another command could not be parsed
+            errors += 1
+        sleep(0.005)  # the replies of the previous operation are received before the next operation
+    duration = perf_counter() - start - repetitions * 0.005
+    return {'operations_per_s': repetitions / duration, 'writes_per_operation': connection.writes / repetitions,
+            'wrong_replies': errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the ASI MS2000 serial command protocol')
+    parser.add_argument('--repetitions', type=int, default=50, help='number of operations per workload')
+    parser.add_argument('--baud-rate', type=int, default=9600, help='baud rate of the serial connection')
+    parser.add_argument('--command-time', type=float, default=0.002, help='processing time of a command in s')
+    parser.add_argument('--output', default=None, help='json file for the results (default: stdout)')
+    args = parser.parse_args()
+
+    results = {}
+    for name in WORKLOADS:
+        before = run_workload(PreviousDriver, name, args.repetitions, args.baud_rate, args.command_time)
+        after = run_workload(PipelinedDriver, name, args.repetitions, args.baud_rate, args.command_time)
+        results[name] = {'before': before, 'after': after,
+                         'speedup': after['operations_per_s'] / before['operations_per_s']}
+
+    output = json.dumps({'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+                         'settings': vars(args), 'results': results}, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(output)
+
+
+if __name__ == '__main__':
+    main()